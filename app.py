@@ -1,8 +1,18 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import sqlparse
 import pandas as pd
-from utils.db_simulator import get_structured_schema, run_query
-from langchain_agents import generate_sql, review_sql, check_compliance, interpret_healthcare_query, validate_healthcare_sql
+from utils.db_simulator import (
+    ROLLUP_STATS, get_structured_schema, check_query_cost, create_pager, export_results, submit_sql
+)
+from utils.exporters import EXPORTERS
+from utils.query_engine import QueryInterrupted
+from utils.repair_loop import EMPTY_RESULT_ERROR
+from utils.schema_catalog import db_fingerprint, load_catalog
+from langchain_agents import (
+    answer_cache_report, execute_with_repair, generate_sql, llm_metrics_report, prompt_cache_report,
+    repair_report, run_review_pipeline, stream_interpret_healthcare_query,
+)
 from utils.ui_helpers import display_metrics_dashboard, create_healthcare_context_help, display_query_examples
 import time
 
@@ -140,7 +150,8 @@ st.markdown("""
 DB_PATH = "dataset/data.sqlite"
 
 @st.cache_data(show_spinner=False)
-def load_schema():
+def load_schema(fingerprint):
+    # fingerprint (mtime/size/schema_version) is only the cache key: a changed database misses
     return get_structured_schema(DB_PATH)
 
 # Header
@@ -157,17 +168,38 @@ with st.sidebar:
     
     # Schema management
     if st.button("🔄 Refresh Schema", use_container_width=True):
-        st.cache_data.clear()
+        load_catalog(DB_PATH, refresh=True)
+        load_schema.clear()
         st.success("Schema refreshed successfully!")
     
     # Database info
-    db_schema = load_schema()
+    db_schema = load_schema(tuple(db_fingerprint(DB_PATH).values()))
     st.markdown("### 📊 Database Overview")
     
     # Count tables
     table_count = db_schema.count("TABLE:")
     st.metric("📋 Tables", table_count)
     
+    # Persistent answer cache for repeated and paraphrased questions
+    answer_stats = answer_cache_report()
+    if answer_stats["lookups"]:
+        st.metric("♻️ Answer Cache Hit Rate", f"{answer_stats['hit_rate']:.0%}")
+        st.caption(f"{answer_stats['exact_hits']} exact · {answer_stats['similar_hits']} similar · "
+                   f"{answer_stats['misses']} misses")
+    
+    # Automatic repair of failed or empty executions
+    repair_stats = repair_report()
+    if repair_stats["runs"]:
+        st.metric("🔧 Auto-Repair Success", f"{repair_stats['success_rate']:.0%}")
+        st.caption(f"{repair_stats['runs']} repairs · {repair_stats['mean_attempts']:.1f} attempts · "
+                   f"{repair_stats['mean_seconds']:.1f}s to a correct answer on average")
+    
+    # Aggregates answered from the materialized rollups (python -m utils.rollups)
+    rollup_stats = ROLLUP_STATS.snapshot()
+    if rollup_stats["routed"]:
+        st.metric("🧮 Served from Rollups", f"{rollup_stats['hit_rate']:.0%}")
+        st.caption(" · ".join(f"{name}: {count}" for name, count in rollup_stats["by_rollup"].items()))
+    
     # Example queries with enhanced UI
     st.markdown("### 💡 Example Queries")
     
@@ -199,6 +231,26 @@ with col2:
     steps_completed = sum(1 for key in session_keys[:-1] if st.session_state.get(key) is not None)
     display_metrics_dashboard(st.session_state['llm_cost'], steps_completed, len(session_keys)-1)
     
+    # Shared prompt prefix reuse across all agent calls in this server process
+    cache_stats = prompt_cache_report()
+    if cache_stats["calls"]:
+        st.caption(f"🧠 Prompt prefix cache: {cache_stats['tokens_saved']:,} tokens read from the provider cache "
+                   f"({cache_stats['hit_rate']:.0%} of {cache_stats['prefix_tokens']:,}); "
+                   f"~{cache_stats['estimated_reused_tokens']:,} sent while warm (estimate)")
+    if st.session_state.get("pipeline_time_saved"):
+        st.caption(f"⚡ Concurrent stages saved {st.session_state['pipeline_time_saved']:.1f}s of LLM wait")
+    
+    # Per-stage LLM telemetry for this server process (billed tokens from the provider)
+    stage_metrics = llm_metrics_report()
+    if stage_metrics:
+        with st.expander("📡 LLM calls by stage"):
+            st.dataframe(pd.DataFrame([
+                {"stage": stage, "calls": m["calls"], "errors": m["errors"], "mean ms": round(m["latency_ms"]),
+                 "first token ms": round(m["first_token_ms"]) if m["streamed"] else None,
+                 "prompt tok": m["prompt_tokens"], "output tok": m["completion_tokens"], "cost $": round(m["cost"], 6)}
+                for stage, m in stage_metrics.items()
+            ]), hide_index=True, use_container_width=True)
+    
     # Progress indicators
     steps = [
         ("🔍", "Interpret Query", st.session_state["interpretation"] is not None),
@@ -232,19 +284,24 @@ with col1:
     def add_cost(c):
         st.session_state["llm_cost"] += c
     
+    def render_stream(stream, key, error_label):
+        """Show an agent's report token by token where it belongs, then keep it in session_state[key]"""
+        try:
+            st.write_stream(stream)
+        except Exception as e:
+            st.error(f"{error_label}: {e}")
+            return
+        st.session_state[key] = stream.result["text"]
+        add_cost(stream.result["cost"])
+    
     # Enhanced button layout
     col_btn1, col_btn2, col_btn3, col_btn4 = st.columns(4)
     
     with col_btn1:
         if st.button("🔍 Analyze Query", use_container_width=True) and prompt.strip():
-            with st.spinner("Interpreting healthcare query..."):
-                try:
-                    interpretation = interpret_healthcare_query(prompt, db_schema)
-                    st.session_state["interpretation"] = interpretation["text"]
-                    add_cost(interpretation["cost"])
-                    st.success("Query interpretation completed!")
-                except Exception as e:
-                    st.error(f"Error interpreting query: {e}")
+            # Nothing is sent yet: the interpretation streams into its section below
+            st.session_state["interpretation"] = None
+            st.session_state["interpretation_stream"] = stream_interpret_healthcare_query(prompt, db_schema)
     
     with col_btn2:
         if st.button("💻 Generate SQL", use_container_width=True) and prompt.strip():
@@ -253,7 +310,10 @@ with col1:
                     gen = generate_sql(prompt, db_schema)
                     st.session_state["generated_sql"] = gen["text"]
                     add_cost(gen["cost"])
-                    st.success("SQL generated successfully!")
+                    if gen.get("cached"):
+                        st.success(f"SQL served from the answer cache ({gen['cached']} match)")
+                    else:
+                        st.success("SQL generated successfully!")
                 except Exception as e:
                     st.error(f"Error generating SQL: {e}")
     
@@ -370,8 +430,9 @@ with col1:
                 fk_count = db_schema.count("FOREIGN KEY")
                 st.metric("🔗 Foreign Keys", fk_count)
 
-    # Display interpretation if available
-    if st.session_state["interpretation"]:
+    # Display interpretation if available, or stream it in
+    interpretation_stream = st.session_state.pop("interpretation_stream", None)
+    if interpretation_stream is not None or st.session_state["interpretation"]:
         st.markdown("""
         <div class="step-container">
             <div class="step-header">
@@ -381,7 +442,10 @@ with col1:
         </div>
         """, unsafe_allow_html=True)
         
-        st.markdown(st.session_state["interpretation"])
+        if interpretation_stream is not None:
+            render_stream(interpretation_stream, "interpretation", "Error interpreting query")
+        else:
+            st.markdown(st.session_state["interpretation"])
 
 # SQL Generation and Processing
 if st.session_state["generated_sql"]:
@@ -401,24 +465,28 @@ if st.session_state["generated_sql"]:
     
     with col1:
         if st.button("✅ Review & Validate", use_container_width=True):
-            with st.spinner("Reviewing and validating SQL..."):
+            with st.spinner("Reviewing SQL and checking compliance..."):
                 try:
-                    # Review SQL
-                    rev = review_sql(st.session_state["generated_sql"], db_schema)
+                    # Review SQL, then validate and check compliance side by side; the validation report
+                    # is already streaming and finishes rendering after the rerun
+                    run = run_review_pipeline(st.session_state["generated_sql"], db_schema, stream=True)
+                    
+                    rev = run.value("review")
                     st.session_state["reviewed_sql"] = rev["text"]
                     add_cost(rev["cost"])
                     
-                    # Validate SQL
-                    validation = validate_healthcare_sql(st.session_state["reviewed_sql"], db_schema)
-                    st.session_state["validation"] = validation["text"]
-                    add_cost(validation["cost"])
+                    st.session_state["validation"] = None
+                    st.session_state["validation_stream"] = run.value("validate")
                     
-                    # Check compliance
-                    comp = check_compliance(st.session_state["reviewed_sql"])
+                    comp = run.value("compliance")
                     st.session_state["compliance_report"] = comp["text"]
+                    st.session_state["compliance_status"] = comp["status"]
                     add_cost(comp["cost"])
                     
-                    st.success("SQL reviewed and validated!")
+                    st.session_state["pipeline_time_saved"] = (
+                        st.session_state.get("pipeline_time_saved", 0.0) + run.time_saved
+                    )
+                    st.success("SQL reviewed!")
                     st.rerun()
                 except Exception as e:
                     st.error(f"Error in review process: {e}")
@@ -452,8 +520,9 @@ if st.session_state["reviewed_sql"]:
     
     st.code(sqlparse.format(st.session_state["reviewed_sql"], reindent=True, keyword_case="upper"), language="sql")
     
-    # Display validation results
-    if st.session_state["validation"]:
+    # Display validation results, or stream them in
+    validation_stream = st.session_state.pop("validation_stream", None)
+    if validation_stream is not None or st.session_state["validation"]:
         st.markdown("""
         <div class="step-container">
             <div class="step-header">
@@ -463,7 +532,10 @@ if st.session_state["reviewed_sql"]:
         </div>
         """, unsafe_allow_html=True)
         
-        st.markdown(st.session_state["validation"])
+        if validation_stream is not None:
+            render_stream(validation_stream, "validation", "Error validating SQL")
+        else:
+            st.markdown(st.session_state["validation"])
 
 # Display compliance report
 if st.session_state["compliance_report"]:
@@ -477,8 +549,10 @@ if st.session_state["compliance_report"]:
     """, unsafe_allow_html=True)
     
     compliance_text = st.session_state["compliance_report"]
+    compliance_status = st.session_state.get("compliance_status")
     
-    if "compliant" in compliance_text.lower():
+    # Gate on the structured status: the report text of a failing check says "Non-compliant"
+    if compliance_status == "compliant":
         st.markdown(f"""
         <div class="success-box">
             <strong>✅ Compliance Status: PASSED</strong><br>
@@ -486,16 +560,101 @@ if st.session_state["compliance_report"]:
         </div>
         """, unsafe_allow_html=True)
         
+        # Planner-based cost guard: only EXPLAIN runs here, never the query itself
+        try:
+            verdict = check_query_cost(st.session_state["reviewed_sql"])
+        except Exception as e:
+            verdict = None
+            st.error(f"Query cannot be planned: {e}")
+        if verdict is not None:
+            reasons = "".join(f"<br>• {r}" for r in verdict.reasons)
+            box = {"allow": "success-box", "limit": "warning-box", "reject": "error-box"}[verdict.action]
+            icon = {"allow": "🛡️", "limit": "⚠️", "reject": "⛔"}[verdict.action]
+            st.markdown(f"""
+            <div class="{box}">
+                <strong>{icon} Cost Guard: {verdict.summary}</strong>{reasons}
+            </div>
+            """, unsafe_allow_html=True)
+        
+        if st.session_state.get("query_notice"):
+            st.warning(st.session_state.pop("query_notice"))
+        
         # Execute query button
-        if st.button("🚀 Execute Query", use_container_width=True):
+        if st.button("🚀 Execute Query", use_container_width=True,
+                     disabled=verdict is None or not verdict.allowed):
+            # Runs off the script thread: any rerun (e.g. Cancel) stops the query via finally
+            handle = submit_sql(verdict.sql, user=get_script_run_ctx().session_id)
+            
+            def cancel_query(handle=handle):
+                handle.cancel()
+                st.session_state["query_notice"] = "⏹️ Query cancelled"
+            
+            st.button("⏹️ Cancel Query", key="cancel_query", on_click=cancel_query)
+            progress = st.empty()
             with st.spinner("Executing query..."):
                 try:
-                    result = run_query(st.session_state["reviewed_sql"])
+                    try:
+                        while not handle.done():
+                            stats = handle.progress()
+                            if "queued_ms" in stats:
+                                progress.caption(f"🕒 Queued behind your other queries "
+                                                 f"({stats['queued_ms'] / 1000:.1f}s)")
+                            else:
+                                progress.caption(f"⏳ {stats['elapsed_ms'] / 1000:.1f}s · "
+                                                 f"{stats['vm_steps']:,} VM steps · {stats['rows']:,} rows read")
+                            time.sleep(0.1)
+                    finally:
+                        if not handle.done():
+                            handle.cancel()
+                    progress.empty()
+                    executed_sql, failure, result = verdict.sql, None, None
+                    try:
+                        result = handle.result()
+                        if result.row_count == 0:
+                            failure = EMPTY_RESULT_ERROR
+                    except QueryInterrupted:
+                        raise
+                    except Exception as e:
+                        failure = f"{type(e).__name__}: {e}"
+                    st.session_state["repair_notice"] = None
+                    if failure:
+                        # Feed the error back to the LLM; every fix is re-validated and re-screened locally
+                        with st.spinner("🔧 Query failed, repairing it automatically..."):
+                            outcome = execute_with_repair(
+                                prompt, verdict.sql, db_schema, first_error=failure,
+                                execute=lambda sql: submit_sql(sql, user=get_script_run_ctx().session_id).result(),
+                            )
+                        add_cost(outcome.cost)
+                        if outcome.success:
+                            result, executed_sql = outcome.result, outcome.sql
+                            st.session_state["repair_notice"] = (
+                                f"🔧 Repaired automatically after {len(outcome.attempts)} attempts "
+                                f"({outcome.seconds:.1f}s)", outcome.sql)
+                        elif result is None:
+                            raise RuntimeError(f"{failure} (automatic repair stopped: {outcome.stop_reason}; "
+                                               f"last error: {outcome.last_error})")
                     st.session_state["query_result"] = result
+                    st.session_state["executed_sql"] = executed_sql
+                    # Seed the pager with the rows already fetched so page 1 is not queried twice
+                    if st.session_state.get("query_pager") is not None:
+                        st.session_state["query_pager"].close()
+                    st.session_state["query_pager"] = create_pager(executed_sql, first_result=result)
+                    st.session_state["result_page"] = 0
+                    st.session_state["export_file"] = None
                     st.success("Query executed successfully!")
                     st.rerun()
+                except QueryInterrupted as e:
+                    st.warning(f"{e} after {e.elapsed_ms:,.0f} ms ({e.rows:,} rows read, "
+                               f"~{e.vm_steps:,} VM steps)")
                 except Exception as e:
                     st.error(f"Query execution failed: {e}")
+    elif compliance_status == "needs_review":
+        st.markdown(f"""
+        <div class="warning-box">
+            <strong>⚠️ Compliance Status: NEEDS REVIEW</strong><br>
+            {compliance_text}
+        </div>
+        """, unsafe_allow_html=True)
     else:
         st.markdown(f"""
         <div class="error-box">
@@ -515,37 +674,72 @@ if st.session_state["query_result"]:
     </div>
     """, unsafe_allow_html=True)
     
-    # Try to parse as DataFrame for better display
-    try:
-        import io
-        from contextlib import redirect_stdout
-        
-        # Check if result looks like a table
-        if "Query Results:" in st.session_state["query_result"]:
-            result_text = st.session_state["query_result"].replace("Query Results:\n", "")
-            
-            # Try to display as a nice table
-            lines = result_text.strip().split('\n')
-            if len(lines) > 1:
-                # Display as formatted table
-                st.markdown("### 📋 Data Table")
-                st.text(result_text)
-            else:
-                st.code(st.session_state["query_result"])
-        else:
-            st.code(st.session_state["query_result"])
-    except Exception:
-        st.code(st.session_state["query_result"])
-    
-    # Download results
-    if st.download_button(
-        label="📥 Download Results",
-        data=st.session_state["query_result"],
-        file_name="query_results.txt",
-        mime="text/plain",
-        use_container_width=True
-    ):
-        st.success("Results downloaded!")
+    result = st.session_state["query_result"]
+    if st.session_state.get("repair_notice"):
+        notice, repaired_sql = st.session_state["repair_notice"]
+        st.info(notice)
+        with st.expander("Repaired SQL"):
+            st.code(sqlparse.format(repaired_sql, reindent=True, keyword_case="upper"), language="sql")
+    col_rows, col_time, col_cols = st.columns(3)
+    with col_rows:
+        st.metric("📄 Rows", f"{result.row_count}{'+' if result.truncated else ''}")
+    with col_time:
+        st.metric("⏱️ Execution Time", f"{result.elapsed_ms:.1f} ms")
+    with col_cols:
+        st.metric("📊 Columns", len(result.columns))
+    
+    with st.expander("🧬 Result Schema"):
+        st.dataframe(pd.DataFrame(result.schema, columns=["column", "type"]), hide_index=True)
+    
+    # Later pages are read on demand from one cursor the pager keeps open across reruns, and
+    # every page read is kept, so Next/Previous never re-run the query
+    pager = st.session_state["query_pager"]
+    page_number = st.session_state.get("result_page", 0)
+    page = pager.page(page_number)
+    
+    st.markdown("### 📋 Data Table")
+    st.dataframe(page.to_dataframe(), use_container_width=True, hide_index=True)
+    
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if st.button("⬅️ Previous", use_container_width=True, disabled=page.page == 0):
+            st.session_state["result_page"] = page.page - 1
+            st.rerun()
+    with col_info:
+        first_row = page.offset + 1 if page.rows else 0
+        st.caption(f"Page {page.page + 1} · rows {first_row}–{page.offset + len(page.rows)}")
+    with col_next:
+        if st.button("Next ➡️", use_container_width=True, disabled=not page.has_more):
+            st.session_state["result_page"] = page.page + 1
+            st.rerun()
+    
+    # Download results: the full result is streamed from the cursor into a temp file in chunks
+    col_fmt, col_prepare = st.columns([1, 1])
+    with col_fmt:
+        export_format = st.selectbox("Export format", list(EXPORTERS), label_visibility="collapsed")
+    with col_prepare:
+        if st.button("📦 Prepare Export", use_container_width=True):
+            with st.spinner(f"Exporting {export_format}..."):
+                try:
+                    path = export_results(st.session_state.get("executed_sql") or st.session_state["reviewed_sql"], export_format)
+                    st.session_state["export_file"] = (export_format, path)
+                except QueryInterrupted as e:
+                    st.warning(f"Export stopped: {e} after {e.elapsed_ms:,.0f} ms")
+                except Exception as e:
+                    st.error(f"Export failed: {e}")
+    
+    export_file = st.session_state.get("export_file")
+    if export_file and export_file[0] == export_format:
+        spec = EXPORTERS[export_format]
+        with open(export_file[1], "rb") as fh:
+            if st.download_button(
+                label="📥 Download Results",
+                data=fh,
+                file_name=f"query_results.{spec['extension']}",
+                mime=spec["mime"],
+                use_container_width=True
+            ):
+                st.success("Results downloaded!")
 
 # Footer
 st.markdown("---")
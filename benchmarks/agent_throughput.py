@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark: sequential run_agent calls vs concurrent arun_agent under the shared limiter
+
+Uses the offline fake model, so no API key or network is needed to measure the runtime.
+Run from the project directory:
+    python -m benchmarks.agent_throughput [--requests 40] [--latency 0.5] [--failure-rate 0.1]
+"""
+
+import argparse
+import asyncio
+import time
+
+import langchain_agents
+from utils.fake_llm import FakeChatModel
+from utils.llm_runtime import RateLimiter, RetryPolicy
+
+SYSTEM = "You are a highly skilled Senior Data Analyst specializing in healthcare SQL analytics."
+HUMAN = "User request:\nTop 5 life science firms by total payments to HCPs"
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[max(0, int(round(q * len(ordered))) - 1)]
+
+
+def report(label, latencies, wall, calls, requests):
+    print(f"{label:<22} {requests / wall:>7.2f} req/s   p50 {percentile(latencies, 0.5) * 1e3:7.0f} ms   "
+          f"p95 {percentile(latencies, 0.95) * 1e3:7.0f} ms   attempts {calls} ({calls - requests} retries)")
+
+
+def run_sequential(requests):
+    latencies = []
+    wall = time.perf_counter()
+    for _ in range(requests):
+        start = time.perf_counter()
+        langchain_agents.run_agent(SYSTEM, HUMAN)
+        latencies.append(time.perf_counter() - start)
+    return latencies, time.perf_counter() - wall
+
+
+async def run_concurrent(requests):
+    async def one():
+        start = time.perf_counter()
+        await langchain_agents.arun_agent(SYSTEM, HUMAN)
+        return time.perf_counter() - start
+
+    wall = time.perf_counter()
+    latencies = await asyncio.gather(*(one() for _ in range(requests)))
+    return list(latencies), time.perf_counter() - wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.5, help="Fake model latency in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.1, help="Share of transient 429/503s")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=None, help="Token-bucket requests per second")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    langchain_agents.RETRY_POLICY = RetryPolicy(max_attempts=6, base_delay=0.05, max_delay=0.5)
+    langchain_agents.LLM_LIMITER = RateLimiter(args.concurrency, args.rate, burst=args.concurrency)
+
+    print(f"📊 {args.requests} requests, {args.latency:g}s fake latency, "
+          f"{args.failure_rate:.0%} transient failures, concurrency {args.concurrency}")
+    langchain_agents.llm = FakeChatModel(args.latency, failure_rate=args.failure_rate, seed=args.seed)
+    latencies, sequential_wall = run_sequential(args.requests)
+    report("sequential run_agent", latencies, sequential_wall, langchain_agents.llm.calls, args.requests)
+
+    langchain_agents.llm = FakeChatModel(args.latency, failure_rate=args.failure_rate, seed=args.seed)
+    latencies, concurrent_wall = asyncio.run(run_concurrent(args.requests))
+    report("concurrent arun_agent", latencies, concurrent_wall, langchain_agents.llm.calls, args.requests)
+    print(f"⚡ Throughput gain: {sequential_wall / concurrent_wall:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark: the bundled gold queries on SQLite vs the DuckDB/Parquet backend, with result parity
+
+The bundled tables hold 100 rows each, far too few for columnar execution to pay off, so
+--scale N first copies every table N times into a scratch database.
+Run from the project directory:
+    python -m benchmarks.columnar [--scale 2000] [--repeat 5]
+Exits 1 when a query DuckDB answers itself disagrees with SQLite.
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.nl2sql import load_gold
+from utils.columnar import SQLiteOnly, _require_duckdb, convert_to_parquet, execute_columnar, snapshot_dir
+from utils.db_simulator import DB_PATH
+from utils.execution_accuracy import compare_results
+from utils.query_engine import execute_query
+from utils.schema_catalog import MATERIALIZED_PREFIX, load_catalog, quote_identifier
+
+
+def scaled_copy(source: str, scale: int, directory: str) -> str:
+    """Copy source with every base table repeated scale times"""
+    target = os.path.join(directory, f"data_x{scale}.sqlite")
+    with sqlite3.connect(source) as src, sqlite3.connect(target) as dst:
+        src.backup(dst)
+    conn = sqlite3.connect(target, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        tables = [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+                  if not name.startswith(("sqlite_", MATERIALIZED_PREFIX))]
+        conn.execute("BEGIN")
+        for table in tables:
+            conn.execute(f"CREATE TEMP TABLE original AS SELECT * FROM {quote_identifier(table)}")
+            for _ in range(scale - 1):
+                conn.execute(f"INSERT INTO {quote_identifier(table)} SELECT * FROM temp.original")
+            conn.execute("DROP TABLE temp.original")
+        conn.execute("COMMIT")
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+    return target
+
+
+def timed(run, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--scale", type=int, default=1, help="Repeat every table this many times first")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per query; the median is reported")
+    args = parser.parse_args()
+
+    duckdb = _require_duckdb()
+    scratch = tempfile.mkdtemp(prefix="columnar_bench_")
+    db_path = args.db
+    try:
+        if args.scale > 1:
+            start = time.perf_counter()
+            db_path = scaled_copy(args.db, args.scale, scratch)
+            print(f"📦 Scaled copy x{args.scale} in {time.perf_counter() - start:.1f}s")
+        catalog = load_catalog(db_path)
+        start = time.perf_counter()
+        convert_to_parquet(db_path, catalog=catalog)
+        print(f"📦 Parquet snapshot of {sum(t.row_count for t in catalog.tables):,} rows "
+              f"in {time.perf_counter() - start:.1f}s")
+
+        print(f"{'query':<24} {'sqlite ms':>10} {'duckdb ms':>10} {'speedup':>8}  parity")
+        mismatches = 0
+        sqlite_total = duckdb_total = 0.0
+        for case in load_gold():
+            expected, sqlite_ms = timed(lambda: execute_query(db_path, case["sql"]), args.repeat)
+            try:
+                result, duckdb_ms = timed(lambda: execute_columnar(db_path, case["sql"], fallback=False),
+                                          args.repeat)
+            except (duckdb.Error, SQLiteOnly) as e:
+                print(f"{case['id']:<24} {sqlite_ms:>10.2f} {'-':>10} {'-':>8}  ↩️  SQLite fallback "
+                      f"({type(e).__name__})")
+                continue
+            order_by = [expected.columns.index(c) for c in case["expected"].get("order_by", ())]
+            match = compare_results(result.rows(), expected.rows(), order_by, allow_extra_columns=False)
+            same = match.correct and result.columns == expected.columns
+            mismatches += not same
+            sqlite_total += sqlite_ms
+            duckdb_total += duckdb_ms
+            print(f"{case['id']:<24} {sqlite_ms:>10.2f} {duckdb_ms:>10.2f} {sqlite_ms / duckdb_ms:>7.1f}x  "
+                  f"{'✅' if same else '❌ ' + (match.reason or 'column names differ')}")
+        if duckdb_total:
+            print(f"⚡ Queries DuckDB answered: {sqlite_total:.1f} ms on SQLite vs {duckdb_total:.1f} ms "
+                  f"({sqlite_total / duckdb_total:.1f}x)")
+    finally:
+        if db_path != args.db:
+            shutil.rmtree(snapshot_dir(db_path), ignore_errors=True)
+        shutil.rmtree(scratch, ignore_errors=True)
+    if mismatches:
+        print(f"❌ {mismatches} result(s) differ between the engines")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-call sqlite3.connect vs the pooled read-only connections
+
+Run from the project directory:
+    python -m benchmarks.connection_pool [--iterations 2000] [--threads 8]
+"""
+
+import argparse
+import sqlite3
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.connection_pool import get_pool
+from utils.db_simulator import DB_PATH
+
+QUERY = 'SELECT life_science_firm_name, SUM(amount) FROM "Payments to HCPs" GROUP BY 1 ORDER BY 2 DESC LIMIT 5'
+
+
+def per_call_connect(_):
+    start = time.perf_counter()
+    conn = sqlite3.connect(DB_PATH)
+    conn.execute(QUERY).fetchall()
+    conn.close()
+    return time.perf_counter() - start
+
+
+def pooled(_):
+    start = time.perf_counter()
+    with get_pool(DB_PATH).connection() as conn:
+        conn.execute(QUERY).fetchall()
+    return time.perf_counter() - start
+
+
+def run(label, fn, iterations, threads):
+    wall = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(fn, range(iterations)))
+    wall = time.perf_counter() - wall
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f"{label:<18} {iterations / wall:>10.0f} q/s   "
+          f"mean {statistics.mean(latencies) * 1e3:7.3f} ms   p95 {p95 * 1e3:7.3f} ms")
+    return wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    print(f"📊 {args.iterations} queries on {DB_PATH} with {args.threads} threads")
+    # Warm the pool so its connection setup is not charged to the first samples
+    pooled(None)
+    baseline = run("per-call connect", per_call_connect, args.iterations, args.threads)
+    pooled_wall = run("connection pool", pooled, args.iterations, args.threads)
+    print(f"⚡ Speedup: {baseline / pooled_wall:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
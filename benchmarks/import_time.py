@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark: cold import time of langchain_agents, guarded against regressions
+
+Each run is a fresh interpreter with `python -X importtime`; the median cumulative import
+time must stay under --max-ms and the provider SDK / tokenizer must not be loaded at import
+(they are built on first use by get_llm / get_encoding). Exits 1 when either guard fails.
+Run from the project directory:
+    python -m benchmarks.import_time [--runs 5] [--max-ms 1500] [--module langchain_agents]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+# Modules that belong behind the lazy factories, not on the import path
+DEFERRED = ("langchain_google_genai", "google.genai", "tiktoken", "langchain")
+
+
+def import_once(module):
+    """({module: (self_us, cumulative_us)}, set of loaded top-level packages) for one cold import"""
+    probe = f"import sys, {module}; print(' '.join(sorted(sys.modules)))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", probe],
+                          capture_output=True, text=True, cwd=os.getcwd(), check=True)
+    timings = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if self_us.isdigit():
+            timings[name] = (int(self_us), int(cumulative_us))
+    return timings, set(proc.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="langchain_agents")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=1500.0, help="Budget for the median cold import")
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports to list")
+    args = parser.parse_args()
+
+    totals, self_times = [], defaultdict(list)
+    loaded = set()
+    for _ in range(args.runs):
+        timings, loaded = import_once(args.module)
+        totals.append(timings[args.module][1] / 1000)
+        for name, (self_us, _) in timings.items():
+            self_times[name].append(self_us / 1000)
+
+    median = statistics.median(totals)
+    print(f"📊 import {args.module}: median {median:.0f} ms, min {min(totals):.0f} ms, "
+          f"max {max(totals):.0f} ms over {args.runs} cold runs (budget {args.max_ms:.0f} ms)")
+    print("Slowest imports (median self time):")
+    slowest = sorted(self_times.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, samples in slowest[:args.top]:
+        print(f"  {statistics.median(samples):8.1f} ms  {name}")
+
+    eager = sorted(m for m in loaded if any(m == d or m.startswith(d + ".") for d in DEFERRED))
+    failed = False
+    if eager:
+        print(f"❌ Loaded at import, should be lazy: {', '.join(eager[:10])}{' ...' if len(eager) > 10 else ''}")
+        failed = True
+    if median > args.max_ms:
+        print(f"❌ Median import {median:.0f} ms exceeds the {args.max_ms:.0f} ms budget")
+        failed = True
+    if not failed:
+        print("✅ Import time within budget; provider SDK and tokenizer deferred")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
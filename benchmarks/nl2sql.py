@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Benchmark: NL->SQL execution accuracy and per-stage latency/token/cost percentiles on a gold set
+
+Every gold question goes through the same pipeline as main.py (interpret || generate -> review
+-> validate || compliance, cost guard, execution, automatic repair) and the executed result is
+scored against the gold result. No network is needed by default: the oracle backend answers
+with the gold SQL (--error-rate breaks some of it to exercise repair), and --replay replays
+responses recorded earlier with --replay record against any backend.
+Run from the project directory:
+    python -m benchmarks.nl2sql [--model oracle/gold] [--replay replay] [--min-accuracy 0.9] [--json out.json]
+    python -m benchmarks.nl2sql --model google/gemini-2.5-flash --replay record   # record a live run
+    python -m benchmarks.nl2sql --refresh-expected    # re-derive expected results from the gold SQL
+Gold SQL spells columns without the extract's BOM and quotes and runs through dialect translation,
+so it fits data.sqlite as shipped and after python -m utils.ingest; expected results belong to the
+data snapshot, so refresh them after re-ingesting.
+Exits 1 when accuracy or the end-to-end p95 latency misses its threshold.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import langchain_agents
+from utils.db_simulator import (DB_PATH, check_query_cost, clean_sql, execute_sql, get_structured_schema,
+                                normalize_sql)
+from utils.execution_accuracy import score_result
+from utils.fake_llm import OracleChatModel
+from utils.helper import MODEL_PRICING, register_model_price
+from utils.index_advisor import QUERY_LOG
+from utils.llm_backends import REPLAY_DIR, BackendRegistry, register_backend, unregister_backend
+from utils.metrics import MetricsRecorder
+from utils.repair_loop import EMPTY_RESULT_ERROR
+
+GOLD_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "nl2sql_gold.json")
+PIPELINE_STAGES = ("interpret", "generate", "review", "validate", "compliance")
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[max(0, int(round(q * len(ordered))) - 1)]
+
+
+def load_gold(path: str = GOLD_PATH) -> List[Dict[str, Any]]:
+    """Gold cases with their SQL translated onto DB_PATH's spelling of the columns"""
+    with open(path, "r", encoding="utf-8") as fh:
+        cases = json.load(fh)["cases"]
+    return [{**case, "sql": normalize_sql(case["sql"])} for case in cases]
+
+
+def expected_result(sql: str, order_by=()) -> Dict[str, Any]:
+    result = execute_sql(normalize_sql(sql), max_rows=None)
+    return {"columns": result.columns, "rows": [list(row) for row in result.rows()], "order_by": list(order_by)}
+
+
+def check_gold(cases: List[Dict[str, Any]]) -> List[str]:
+    """Ids of cases whose gold SQL no longer reproduces the stored result (data or engine drift)"""
+    drifted = []
+    for case in cases:
+        try:
+            match = score_result(execute_sql(case["sql"], max_rows=None), case["expected"])
+        except Exception:
+            drifted.append(case["id"])
+            continue
+        if not match.correct:
+            drifted.append(case["id"])
+    return drifted
+
+
+def _compact_lists(match: "re.Match") -> str:
+    try:
+        return json.dumps(json.loads(match.group(0)), ensure_ascii=False)
+    except ValueError:
+        return match.group(0)
+
+
+def refresh_expected(path: str = GOLD_PATH) -> None:
+    with open(path, "r", encoding="utf-8") as fh:
+        gold = json.load(fh)
+    for case in gold["cases"]:
+        case["expected"] = expected_result(case["sql"], case.get("expected", {}).get("order_by", ()))
+    text = json.dumps(gold, indent=2, ensure_ascii=False)
+    # One line per result row keeps the file reviewable
+    text = re.sub(r"\[[^\[\]{}]*\]", _compact_lists, text)
+    with open(path, "w", encoding="utf-8") as fh:
+        fh.write(text + "\n")
+
+
+@contextmanager
+def configure(cases: List[Dict[str, Any]], model: Optional[str], replay: Optional[str],
+              replay_dir: str = REPLAY_DIR, error_rate: float = 0.0, latency: float = 0.0,
+              seed: int = 7) -> Iterator[None]:
+    """Point langchain_agents at the benchmark backend; answer cache and query log off, metrics
+    in memory only. Everything it changes is restored on exit"""
+    answers = {case["question"]: case["sql"] for case in cases}
+    saved = {name: getattr(langchain_agents, name) for name in ("llm", "BACKENDS", "ANSWER_CACHE", "LLM_METRICS")}
+    saved_price = MODEL_PRICING.get("oracle/")
+    saved_log = QUERY_LOG.path
+    previous = register_backend("oracle", lambda spec: OracleChatModel(answers, error_rate=error_rate,
+                                                                       latency=latency, seed=seed))
+    try:
+        register_model_price("oracle/", 0.0, 0.0, 0.0)
+        langchain_agents.llm = None
+        langchain_agents.BACKENDS = BackendRegistry.from_config(override=model, replay_mode=replay,
+                                                                replay_dir=replay_dir,
+                                                                timeout=langchain_agents.RETRY_POLICY.timeout)
+        langchain_agents.ANSWER_CACHE = None  # every case must reach the model (or its recording)
+        langchain_agents.LLM_METRICS = MetricsRecorder()
+        QUERY_LOG.path = None  # benchmark runs are not workload for the index advisor
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(langchain_agents, name, value)
+        QUERY_LOG.path = saved_log
+        if saved_price is None:
+            MODEL_PRICING.pop("oracle/", None)
+        else:
+            MODEL_PRICING["oracle/"] = saved_price
+        if previous is None:
+            unregister_backend("oracle")
+        else:
+            register_backend("oracle", previous)
+
+
+def _stage(value: Any, elapsed_ms: float) -> Dict[str, float]:
+    value = value if isinstance(value, dict) else {}
+    return {"latency_ms": elapsed_ms, "tokens": value.get("tokens", 0), "cost": value.get("cost", 0.0)}
+
+
+def run_case(case: Dict[str, Any], db_schema: str) -> Dict[str, Any]:
+    """Pipeline, cost guard, execution and repair for one question, the way main.py runs it"""
+    report = {"id": case["id"], "question": case["question"], "correct": False, "reason": "",
+              "sql": None, "repaired": False, "stages": {}}
+    started = time.perf_counter()
+    run = langchain_agents.run_healthcare_pipeline(case["question"], db_schema)
+    for name, stage in run.results.items():
+        report["stages"][name] = _stage(stage.value, stage.elapsed * 1000)
+    result = None
+    try:
+        sql = clean_sql(run.value("review")["text"])
+        compliance = run.value("compliance")
+        if compliance["status"] != "compliant":
+            raise RuntimeError(f"blocked by compliance ({compliance['status']})")
+        execute_started = time.perf_counter()
+        try:
+            # A plan error or a cost rejection is repaired like a failed run
+            verdict = check_query_cost(sql)
+            if not verdict.allowed:
+                raise RuntimeError(f"rejected by the cost guard: {verdict.summary}")
+            sql = verdict.sql
+            result = execute_sql(sql, max_rows=None)
+            failure = EMPTY_RESULT_ERROR if result.row_count == 0 else None
+        except Exception as e:
+            result, failure = None, f"{type(e).__name__}: {e}"
+        report["stages"]["execute"] = _stage(None, (time.perf_counter() - execute_started) * 1000)
+        if failure:
+            outcome = langchain_agents.execute_with_repair(
+                case["question"], sql, db_schema, first_error=failure,
+                execute=lambda repaired: execute_sql(repaired, max_rows=None))
+            report["stages"]["repair"] = {"latency_ms": outcome.seconds * 1000, "tokens": outcome.tokens,
+                                          "cost": outcome.cost}
+            if outcome.success:
+                result, sql = outcome.result, outcome.sql
+                report["repaired"] = True
+            elif result is None:
+                raise RuntimeError(f"{failure} (repair stopped: {outcome.stop_reason})")
+        report["sql"] = sql
+    except Exception as e:
+        report["reason"] = str(e)
+    if result is not None:
+        match = score_result(result, case["expected"])
+        report["correct"], report["reason"] = match.correct, match.reason
+    report["stages"]["total"] = {
+        "latency_ms": (time.perf_counter() - started) * 1000,
+        "tokens": sum(s["tokens"] for s in report["stages"].values()),
+        "cost": sum(s["cost"] for s in report["stages"].values()),
+    }
+    return report
+
+
+def summarize(reports: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Accuracy plus latency percentiles and token/cost per stage"""
+    stages = {}
+    for name in PIPELINE_STAGES + ("execute", "repair", "total"):
+        samples = [r["stages"][name] for r in reports if name in r["stages"]]
+        if not samples:
+            continue
+        latencies = [s["latency_ms"] for s in samples]
+        tokens = [s["tokens"] for s in samples]
+        stages[name] = {
+            "runs": len(samples),
+            **{f"p{int(q * 100)}_ms": percentile(latencies, q) for q in PERCENTILES},
+            "p50_tokens": percentile(tokens, 0.5),
+            "p95_tokens": percentile(tokens, 0.95),
+            "cost": sum(s["cost"] for s in samples),
+        }
+    correct = sum(r["correct"] for r in reports)
+    return {
+        "cases": len(reports),
+        "correct": correct,
+        "accuracy": correct / len(reports) if reports else 0.0,
+        "repaired": sum(r["repaired"] for r in reports),
+        "stages": stages,
+    }
+
+
+def run_benchmark(cases: List[Dict[str, Any]], repeat: int = 1) -> Dict[str, Any]:
+    db_schema = get_structured_schema(DB_PATH)
+    reports = [run_case(case, db_schema) for _ in range(repeat) for case in cases]
+    return {**summarize(reports), "reports": reports}
+
+
+def print_summary(summary: Dict[str, Any]) -> None:
+    print(f"{'stage':<11} {'runs':>5} {'p50 ms':>9} {'p90 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'p50 tok':>8} {'p95 tok':>8} {'cost $':>10}")
+    for name, s in summary["stages"].items():
+        print(f"{name:<11} {s['runs']:>5} {s['p50_ms']:>9.1f} {s['p90_ms']:>9.1f} {s['p95_ms']:>9.1f} "
+              f"{s['p99_ms']:>9.1f} {s['p50_tokens']:>8} {s['p95_tokens']:>8} {s['cost']:>10.6f}")
+    for report in summary["reports"]:
+        if not report["correct"]:
+            print(f"❌ {report['id']}: {report['reason']}")
+    print(f"🎯 Execution accuracy {summary['accuracy']:.1%} ({summary['correct']}/{summary['cases']}), "
+          f"{summary['repaired']} repaired")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--gold", default=GOLD_PATH)
+    parser.add_argument("--model", default="oracle/gold",
+                        help='Backend for every agent ("oracle/gold", "fake/sql", "google/gemini-2.5-flash"); '
+                             '"" uses config/agents.yaml')
+    parser.add_argument("--replay", choices=("record", "replay", "auto"), default=None)
+    parser.add_argument("--replay-dir", default=REPLAY_DIR)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Oracle: share of broken first answers")
+    parser.add_argument("--latency", type=float, default=0.0, help="Oracle: seconds per call")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--min-accuracy", type=float, default=None)
+    parser.add_argument("--max-p95-ms", type=float, default=None, help="Budget for end-to-end p95 latency")
+    parser.add_argument("--json", default=None, help="Write the full report here (CI artifact)")
+    parser.add_argument("--refresh-expected", action="store_true")
+    args = parser.parse_args()
+
+    if args.refresh_expected:
+        refresh_expected(args.gold)
+        print(f"✅ Expected results refreshed in {args.gold}")
+        return
+
+    cases = load_gold(args.gold)
+    drifted = check_gold(cases)
+    if drifted:
+        print(f"❌ Gold SQL no longer reproduces the expected result: {', '.join(drifted)}")
+        sys.exit(1)
+    print(f"📊 {len(cases)} gold questions x {args.repeat}, backend {args.model or 'agents.yaml'}"
+          f"{f', replay {args.replay}' if args.replay else ''}")
+    with configure(cases, args.model or None, args.replay, args.replay_dir, args.error_rate, args.latency, args.seed):
+        summary = run_benchmark(cases, args.repeat)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(summary, fh, indent=2, default=str)
+
+    failed = False
+    if args.min_accuracy is not None and summary["accuracy"] < args.min_accuracy:
+        print(f"❌ Accuracy {summary['accuracy']:.1%} is below {args.min_accuracy:.1%}")
+        failed = True
+    p95 = summary["stages"].get("total", {}).get("p95_ms", 0.0)
+    if args.max_p95_ms is not None and p95 > args.max_p95_ms:
+        print(f"❌ End-to-end p95 {p95:.0f} ms exceeds {args.max_p95_ms:.0f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,107 @@
 # langchain_agents.py
 import os
+import queue
+import threading
+import time
+from functools import lru_cache
 from dotenv import load_dotenv
 load_dotenv()                         # loads .env into os.environ
 
-from typing import Dict, Any
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.schema import SystemMessage, HumanMessage
-from utils.helper import calculate_gpt4o_mini_cost
-import tiktoken
+from typing import AsyncIterator, Callable, Dict, Any, Iterator, List, Optional, Sequence, Tuple
+from utils.compliance import ComplianceVerdict, parse_compliance_text
+from utils.db_simulator import check_query_cost, execute_sql, normalize_sql, screen_query, validate_query
+from utils.helper import calculate_cost
+from utils.llm_backends import BackendRegistry, astream_chunks, stream_chunks
+from utils.llm_runtime import RateLimiter, RetryPolicy, acall_with_retries, call_with_retries
+from utils.metrics import CallMetric, recorder_from_env
+from utils.pipeline import PipelineResult, Stage, run_pipeline
+from utils.prompt_cache import PromptPrefix, PromptPrefixCache
+from utils.query_engine import QueryResult
+from utils.repair_loop import RepairOutcome, RepairStats, run_repair_loop
+from utils.schema_retriever import DEFAULT_TOP_K, get_retriever
+from utils.semantic_cache import SemanticCache, schema_digest
+from utils.sql_validator import ValidationReport
 
 # ---------------- Gemini config ----------------
-GEMINI_KEY = ""     # same .env file
+GEMINI_KEY = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY", "")     # same .env file
 MODEL_NAME = "gemini-2.5-flash"   # or gemini-2.0-flash [^45^]
+TOKENIZER_MODEL = "gpt-4o-mini"   # fallback tokenizer
 
-llm = ChatGoogleGenerativeAI(
-    model=MODEL_NAME,
-    temperature=0.2,
-    google_api_key=GEMINI_KEY
-)
+# Chat clients and the tokenizer are built on first use (get_llm / get_encoding), so
+# importing this module does not load a provider SDK or tiktoken. Each stage's model comes
+# from config/agents.yaml via the backend registry; assigning llm (e.g. a FakeChatModel in
+# benchmarks) sends every stage to that one client instead.
+llm = None
+ENC = None
+BACKENDS: Optional[BackendRegistry] = None
+_factory_lock = threading.Lock()
+
+
+def get_backends() -> BackendRegistry:
+    """Per-agent backends from agents.yaml; LLM_BACKEND / LLM_REPLAY env vars override"""
+    global BACKENDS
+    if BACKENDS is None:
+        with _factory_lock:
+            if BACKENDS is None:
+                BACKENDS = BackendRegistry.from_env(timeout=RETRY_POLICY.timeout)
+    return BACKENDS
+
+
+def get_llm(stage: str = "agent"):
+    return llm if llm is not None else get_backends().client(stage)
+
+
+def stage_model(stage: str) -> str:
+    """Model name a stage is billed and reported under"""
+    return MODEL_NAME if llm is not None else get_backends().spec(stage).pricing_model
+
+
+class _ApproxEncoding:
+    """~4 characters per token, for offline runs where the tiktoken files cannot be fetched"""
+
+    def encode(self, text: str) -> List[int]:
+        return [0] * ((len(text) + 3) // 4)
 
-ENC = tiktoken.encoding_for_model("gpt-4o-mini")  # fallback tokenizer
+
+def get_encoding():
+    global ENC
+    if ENC is None:
+        with _factory_lock:
+            if ENC is None:
+                try:
+                    import tiktoken
+                    ENC = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+                except Exception:  # BPE files are downloaded on first use; no network, no cache
+                    ENC = _ApproxEncoding()
+    return ENC
+
+
+# Explicit Gemini context caching is opt-in (it bills cache storage) and applies to stages
+# on google/ backends; without it the stable prefix still benefits from implicit caching.
+USE_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "0") == "1"
+PROMPT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+SCHEMA_NOTES_TOP_K = int(os.getenv("SCHEMA_NOTES_TOP_K", str(DEFAULT_TOP_K)))
+# Catalog/EXPLAIN validation first; the LLM validator only runs when it cannot decide
+LOCAL_VALIDATION = os.getenv("LOCAL_SQL_VALIDATION", "1") == "1"
+# Rule-based PHI/PII screen first; the LLM compliance officer only sees ambiguous queries
+COMPLIANCE_PRESCREEN = os.getenv("COMPLIANCE_PRESCREEN", "1") == "1"
+# Automatic SQL repair after a failed or empty execution
+REPAIR_MAX_ATTEMPTS = int(os.getenv("REPAIR_MAX_ATTEMPTS", "3"))
+REPAIR_TOKEN_BUDGET = int(os.getenv("REPAIR_TOKEN_BUDGET", "30000"))
+REPAIR_STATS = RepairStats()
+# Per-stage latency/token/cost telemetry: LLM_METRICS=sqlite,prometheus (files under .cache/) or off
+LLM_METRICS = recorder_from_env(os.getenv("LLM_METRICS", "sqlite"))
+
+# Shared by every sync and async agent call in this process
+RETRY_POLICY = RetryPolicy(
+    max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS", "4")),
+    timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+)
+LLM_LIMITER = RateLimiter(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+    rate_per_sec=float(os.getenv("LLM_RATE_PER_SEC", "0")) or None,
+    burst=int(os.getenv("LLM_RATE_BURST", "4")),
+)
 
 
 def load_schema_notes(file_path: str = "SchemaNotes.txt") -> str:
@@ -33,18 +115,342 @@ def load_schema_notes(file_path: str = "SchemaNotes.txt") -> str:
         return f"Error loading schema notes: {e}"
 
 
+def relevant_schema_notes(query: str, file_path: str = "SchemaNotes.txt") -> str:
+    """Notes for only the tables the query is about, via the offline BM25 index"""
+    retriever = get_retriever(file_path)
+    if retriever is None:
+        return load_schema_notes(file_path)
+    return retriever.relevant_notes(query, top_k=SCHEMA_NOTES_TOP_K)
+
+
 def count_tokens(text: str) -> int:
-    return len(ENC.encode(text))
+    return len(get_encoding().encode(text))
+
+
+@lru_cache(maxsize=256)
+def static_token_count(text: str) -> int:
+    """Token count of a prompt part that never changes (system prompts), encoded once"""
+    return count_tokens(text)
+
+
+def create_gemini_context_cache(prefix: PromptPrefix, model: str) -> str:
+    """Upload the static prefix as Gemini cached content for model and return the cache name"""
+    from google import genai
+    from google.genai import types
+    client = genai.Client(api_key=GEMINI_KEY or None)
+    cache = client.caches.create(
+        model=model,
+        config=types.CreateCachedContentConfig(
+            display_name=f"sqlrx-prefix-{prefix.digest[:12]}",
+            system_instruction=prefix.text,
+            ttl=f"{PROMPT_CACHE_TTL}s",
+        ),
+    )
+    return cache.name
+
+
+PREFIX_CACHE = PromptPrefixCache(
+    token_counter=count_tokens,
+    ttl_seconds=PROMPT_CACHE_TTL,
+    provider_factory=create_gemini_context_cache if USE_CONTEXT_CACHE else None,
+)
+
+# Answers to repeated/paraphrased questions survive restarts; SEMANTIC_CACHE=0 disables
+ANSWER_CACHE = SemanticCache(
+    ttl_seconds=float(os.getenv("SEMANTIC_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000")),
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.8")),
+) if os.getenv("SEMANTIC_CACHE", "1") == "1" else None
+
+
+def context_cache_model(stage: str) -> Optional[str]:
+    """Gemini model to serve stage's prefix from explicit context caching, or None when the
+    stage's backend is not Gemini (other clients would drop the cached prefix) or is replayed"""
+    if not USE_CONTEXT_CACHE or llm is not None:
+        return None
+    backends = get_backends()
+    spec = backends.spec(stage)
+    if spec.provider != "google" or backends.replay_mode == "replay":
+        return None
+    return spec.model
+
+
+def _prepare_call(system: str, human: str, prefix: Optional[PromptPrefix], stage: str = "agent"):
+    """Messages and invoke kwargs; a shared prefix goes first, unchanged, so it can be served from cache"""
+    from langchain_core.messages import HumanMessage, SystemMessage
+    invoke_kwargs = {}
+    if prefix is None:
+        messages = [SystemMessage(content=system), HumanMessage(content=human)]
+    else:
+        model = context_cache_model(stage)
+        cache_name = PREFIX_CACHE.provider_cache_name(prefix, model) if model else None
+        if cache_name:
+            # Cached content already carries the system instruction; role goes in the turn
+            messages = [HumanMessage(content=f"{system}\n\n{human}")]
+            invoke_kwargs["cached_content"] = cache_name
+        else:
+            messages = [SystemMessage(content=f"{prefix.text}\n\n{system}"), HumanMessage(content=human)]
+    return messages, invoke_kwargs
+
+
+def _content_text(content) -> str:
+    return "".join(str(item) for item in content) if isinstance(content, list) else str(content)
+
+
+def _finish_call(response, stage: str, system: str, human: str, prefix: Optional[PromptPrefix],
+                 started: float, first_token_ms: Optional[float] = None) -> Dict[str, Any]:
+    """Bill from the provider's usage_metadata; the local tokenizer is only a fallback estimate"""
+    usage = getattr(response, "usage_metadata", None) or {}
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+    if prefix is not None:
+        PREFIX_CACHE.stats.record(prefix, PREFIX_CACHE.touch(prefix), cached_tokens)
+    text = _content_text(response.content).strip()
+    if usage.get("input_tokens") is not None:
+        prompt_tokens, completion_tokens, source = usage["input_tokens"], usage.get("output_tokens", 0), "usage"
+    else:
+        prompt_tokens = (prefix.tokens if prefix else 0) + static_token_count(system) + count_tokens(human)
+        completion_tokens, source = count_tokens(text), "estimate"
+    model = stage_model(stage)
+    cost = calculate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+    latency_ms = (time.perf_counter() - started) * 1000
+    LLM_METRICS.record(CallMetric(stage, model, latency_ms, prompt_tokens, completion_tokens,
+                                  cached_tokens, cost, source, first_token_ms=first_token_ms))
+    result = {"text": text, "cost": cost, "tokens": prompt_tokens + completion_tokens,
+              "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "latency_ms": latency_ms}
+    if first_token_ms is not None:
+        result["first_token_ms"] = first_token_ms
+    return result
+
+
+def _record_failure(stage: str, started: float) -> None:
+    LLM_METRICS.record(CallMetric(stage, stage_model(stage), (time.perf_counter() - started) * 1000, status="error"))
+
+
+def run_agent(system: str, human: str, prefix: Optional[PromptPrefix] = None, stage: str = "agent") -> Dict[str, Any]:
+    """Blocking LLM call with retries, sharing the process-wide rate limiter with arun_agent"""
+    messages, invoke_kwargs = _prepare_call(system, human, prefix, stage)
+    started = time.perf_counter()
+    try:
+        response = call_with_retries(lambda: get_llm(stage).invoke(messages, **invoke_kwargs), RETRY_POLICY, LLM_LIMITER)
+    except BaseException:
+        _record_failure(stage, started)
+        raise
+    return _finish_call(response, stage, system, human, prefix, started)
+
+
+async def arun_agent(system: str, human: str, prefix: Optional[PromptPrefix] = None,
+                     stage: str = "agent") -> Dict[str, Any]:
+    """Async LLM call via ainvoke: jittered backoff, per-attempt timeout, cancellable by the caller"""
+    messages, invoke_kwargs = _prepare_call(system, human, prefix, stage)
+    started = time.perf_counter()
+    try:
+        response = await acall_with_retries(lambda: get_llm(stage).ainvoke(messages, **invoke_kwargs), RETRY_POLICY, LLM_LIMITER)
+    except BaseException:
+        _record_failure(stage, started)
+        raise
+    return _finish_call(response, stage, system, human, prefix, started)
+
+
+def _first_chunk(chunks: Iterator[Any]) -> Tuple[Any, Iterator[Any]]:
+    """Wait for the first chunk, so rate limits and timeouts surface (and are retried) before any text is shown"""
+    for first in chunks:
+        return first, chunks
+    return None, chunks
+
+
+async def _afirst_chunk(chunks: AsyncIterator[Any]) -> Tuple[Any, AsyncIterator[Any]]:
+    async for first in chunks:
+        return first, chunks
+    return None, chunks
+
+
+def _empty_response():
+    from langchain_core.messages import AIMessageChunk
+    return AIMessageChunk(content="")
+
+
+class AgentStream:
+    """One streamed agent call: iterate it (for, async for, st.write_stream) for text chunks.
+
+    Once the stream is exhausted, result holds what run_agent would have returned plus
+    first_token_ms. Retries cover the wait for the first chunk; text already shown is never
+    retried. The rate limiter slot is held until the stream is exhausted or closed.
+    prefetch() starts the call before anyone iterates.
+    """
+
+    def __init__(self, system: str, human: str, prefix: Optional[PromptPrefix] = None, stage: str = "agent",
+                 result: Optional[Dict[str, Any]] = None):
+        self.system = system
+        self.human = human
+        self.prefix = prefix
+        self.stage = stage
+        self.result = result
+        self._chunks: Optional[queue.Queue] = None
+
+    @classmethod
+    def completed(cls, result: Dict[str, Any]) -> "AgentStream":
+        """An answer that needs no LLM call (cached, decided locally), streamed as one chunk"""
+        return cls("", "", result=result)
+
+    def prefetch(self) -> "AgentStream":
+        """Start the call now on a background thread and return once the first chunk is in.
+
+        Used inside pipeline stages, so the wait for the first token overlaps sibling stages
+        instead of starting when the caller gets round to rendering. Errors before the first
+        chunk are raised here, where the stage records them; iterating drains the rest.
+        """
+        if self.result is not None or self._chunks is not None:
+            return self
+        self._chunks = queue.Queue()
+        first = threading.Event()
+        failure: List[BaseException] = []
+
+        def produce():
+            try:
+                for chunk in self._generate():
+                    self._chunks.put((True, chunk))
+                    first.set()
+                self._chunks.put((False, None))
+            except BaseException as e:
+                if not first.is_set():
+                    failure.append(e)
+                self._chunks.put((False, e))
+            finally:
+                first.set()
+
+        threading.Thread(target=produce, name=f"stream-{self.stage}", daemon=True).start()
+        first.wait()
+        if failure:
+            raise failure[0]
+        return self
+
+    def __iter__(self) -> Iterator[str]:
+        if self._chunks is None:
+            yield from self._generate()
+            return
+        while True:
+            more, item = self._chunks.get()
+            if not more:
+                if item is not None:
+                    raise item
+                return
+            yield item
+
+    def _generate(self) -> Iterator[str]:
+        if self.result is not None:
+            yield self.result["text"]
+            return
+        messages, invoke_kwargs = _prepare_call(self.system, self.human, self.prefix, self.stage)
+        started = time.perf_counter()
+        try:
+            response, chunks = call_with_retries(
+                lambda: _first_chunk(stream_chunks(get_llm(self.stage), messages, **invoke_kwargs)),
+                RETRY_POLICY, LLM_LIMITER, hold=True)
+        except BaseException:
+            _record_failure(self.stage, started)
+            raise
+        try:
+            first_token_ms = (time.perf_counter() - started) * 1000
+            if response is not None:
+                yield _content_text(response.content)
+            for chunk in chunks:
+                response = response + chunk
+                yield _content_text(chunk.content)
+        except BaseException:
+            _record_failure(self.stage, started)
+            raise
+        finally:
+            LLM_LIMITER.release()
+            if hasattr(chunks, "close"):
+                chunks.close()
+        self.result = _finish_call(response if response is not None else _empty_response(), self.stage,
+                                   self.system, self.human, self.prefix, started, first_token_ms)
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        if self.result is not None:
+            yield self.result["text"]
+            return
+        messages, invoke_kwargs = _prepare_call(self.system, self.human, self.prefix, self.stage)
+        started = time.perf_counter()
+        try:
+            response, chunks = await acall_with_retries(
+                lambda: _afirst_chunk(astream_chunks(get_llm(self.stage), messages, **invoke_kwargs)),
+                RETRY_POLICY, LLM_LIMITER, hold=True)
+        except BaseException:
+            _record_failure(self.stage, started)
+            raise
+        try:
+            first_token_ms = (time.perf_counter() - started) * 1000
+            if response is not None:
+                yield _content_text(response.content)
+            async for chunk in chunks:
+                response = response + chunk
+                yield _content_text(chunk.content)
+        except BaseException:
+            _record_failure(self.stage, started)
+            raise
+        finally:
+            LLM_LIMITER.release()
+            if hasattr(chunks, "aclose"):
+                await chunks.aclose()
+        self.result = _finish_call(response if response is not None else _empty_response(), self.stage,
+                                   self.system, self.human, self.prefix, started, first_token_ms)
+
+
+def stream_agent(system: str, human: str, prefix: Optional[PromptPrefix] = None, stage: str = "agent") -> AgentStream:
+    """run_agent, streamed via the client's stream/astream; nothing is sent until it is iterated"""
+    return AgentStream(system, human, prefix, stage)
+
+
+def llm_metrics_report() -> Dict[str, Dict[str, float]]:
+    """Per-stage calls, errors, mean latency and time to first token, tokens and cost since the process started"""
+    return LLM_METRICS.summary()
+
+
+def build_prompt_prefix(db_schema: str) -> PromptPrefix:
+    """Domain context and DB schema: identical for every agent on a given schema.
+
+    Schema notes are question-specific (see relevant_schema_notes) and go after the prefix.
+    """
+    return PREFIX_CACHE.prefix(
+        f"Healthcare Domain Context:\n{HEALTHCARE_CONTEXT}",
+        f"Database schema:\n{db_schema}",
+    )
+
+
+def prompt_cache_report() -> Dict[str, float]:
+    """Prefix tokens sent vs. read from the provider cache since the last reset (e.g. one pipeline run)"""
+    return PREFIX_CACHE.stats.snapshot()
+
+
+def reset_prompt_cache_stats() -> None:
+    PREFIX_CACHE.stats.reset()
+
+
+def answer_cache_report() -> Dict[str, float]:
+    """Exact/similar hits and misses of the persistent generate/review answer cache"""
+    return ANSWER_CACHE.stats.snapshot() if ANSWER_CACHE else {"lookups": 0, "hit_rate": 0.0}
 
 
-def run_agent(system: str, human: str) -> Dict[str, Any]:
-    messages = [SystemMessage(content=system), HumanMessage(content=human)]
-    response = llm.invoke(messages)
-    prompt_tokens = count_tokens(system + human)
-    completion_tokens = count_tokens(str(response.content))
-    cost = calculate_gpt4o_mini_cost(prompt_tokens, completion_tokens)
-    text = "".join(str(item) for item in response.content).strip() if isinstance(response.content, list) else str(response.content).strip()
-    return {"text": text, "cost": cost}
+# Cache kind -> stage whose model produced the answer; answers never cross models
+_ANSWER_STAGES = {"generate_sql": "generate", "review_sql": "review"}
+
+
+def _cached_answer(kind: str, text: str, db_schema: str, similar: bool) -> Optional[Dict[str, Any]]:
+    if ANSWER_CACHE is None:
+        return None
+    hit = ANSWER_CACHE.get(kind, schema_digest(db_schema), text, similar=similar,
+                           model=stage_model(_ANSWER_STAGES[kind]))
+    if hit is None:
+        return None
+    return {"text": hit.value["text"], "cost": 0.0, "cached": hit.tier}
+
+
+def _store_answer(kind: str, text: str, db_schema: str, result: Dict[str, Any], similar: bool) -> Dict[str, Any]:
+    if ANSWER_CACHE is not None and result.get("text"):
+        ANSWER_CACHE.put(kind, schema_digest(db_schema), text, {"text": result["text"]}, similar=similar,
+                         model=stage_model(_ANSWER_STAGES[kind]))
+    return result
 
 
 # ---------- Healthcare Domain Context ----------
@@ -79,29 +485,41 @@ Table Context:
 """
 
 # ---------- the three agent helpers ----------
-def generate_sql(user_input: str, db_schema: str) -> Dict[str, Any]:
-    schema_notes = load_schema_notes()
+def _generate_sql_prompt(user_input: str, db_schema: str) -> Tuple[str, str, PromptPrefix]:
     system = (
         "You are a highly skilled Senior Data Analyst specializing in healthcare SQL analytics. "
         "Your task is to generate a single, syntactically correct SQLite query that fulfills the user's request. "
-        "Strictly use ONLY the tables and columns provided in the schema below. "
+        "Strictly use ONLY the tables and columns provided in the schema above. "
         "Do NOT use any tables, columns, or SQL features not present in the schema. "
         "Use the healthcare domain context and detailed schema notes to understand medical terminology and relationships. "
         "Pay special attention to the column descriptions and sample data provided in the schema notes. "
         "Return ONLY the SQL query, with no explanations or extra text."
     )
     human = (
-        f"Healthcare Domain Context:\n{HEALTHCARE_CONTEXT}\n\n"
-        f"Detailed Schema Notes:\n{schema_notes}\n\n"
-        f"Database schema:\n{db_schema}\n\n"
+        f"Detailed Schema Notes:\n{relevant_schema_notes(user_input)}\n\n"
         f"User request:\n{user_input}\n\n"
         "Remember: Only output the SQL query. Use healthcare domain knowledge and detailed column information to interpret requests correctly."
     )
-    return run_agent(system, human)
+    return system, human, build_prompt_prefix(db_schema)
 
 
-def review_sql(sql: str, db_schema: str) -> Dict[str, Any]:
-    schema_notes = load_schema_notes()
+def generate_sql(user_input: str, db_schema: str) -> Dict[str, Any]:
+    cached = _cached_answer("generate_sql", user_input, db_schema, similar=True)
+    if cached:
+        return cached
+    result = run_agent(*_generate_sql_prompt(user_input, db_schema), stage="generate")
+    return _store_answer("generate_sql", user_input, db_schema, result, similar=True)
+
+
+async def agenerate_sql(user_input: str, db_schema: str) -> Dict[str, Any]:
+    cached = _cached_answer("generate_sql", user_input, db_schema, similar=True)
+    if cached:
+        return cached
+    result = await arun_agent(*_generate_sql_prompt(user_input, db_schema), stage="generate")
+    return _store_answer("generate_sql", user_input, db_schema, result, similar=True)
+
+
+def _review_sql_prompt(sql: str, db_schema: str) -> Tuple[str, str, PromptPrefix]:
     system = (
         "You are an expert SQL Code Reviewer specializing in healthcare data analytics. "
         "Your job is to review the provided SQLite query for correctness, efficiency, and best practices. "
@@ -112,38 +530,88 @@ def review_sql(sql: str, db_schema: str) -> Dict[str, Any]:
         "Do NOT include explanations or comments—return ONLY the SQL query."
     )
     human = (
-        f"Healthcare Domain Context:\n{HEALTHCARE_CONTEXT}\n\n"
-        f"Detailed Schema Notes:\n{schema_notes}\n\n"
-        f"Database schema:\n{db_schema}\n\n"
+        f"Detailed Schema Notes:\n{relevant_schema_notes(sql)}\n\n"
         f"SQL to review:\n{sql}\n\n"
         "Remember: Only output the SQL query. Consider healthcare data relationships and performance."
     )
-    return run_agent(system, human)
+    return system, human, build_prompt_prefix(db_schema)
 
 
-def check_compliance(sql: str) -> Dict[str, Any]:
+def review_sql(sql: str, db_schema: str) -> Dict[str, Any]:
+    # Reviews are keyed on the exact SQL: similar-looking queries can mean different things
+    # The reviewed SQL leaves here in this database's dialect and table names, without another LLM call
+    cached = _cached_answer("review_sql", sql, db_schema, similar=False)
+    if cached:
+        return {**cached, "text": normalize_sql(cached["text"])}
+    result = run_agent(*_review_sql_prompt(sql, db_schema), stage="review")
+    result = _store_answer("review_sql", sql, db_schema, result, similar=False)
+    return {**result, "text": normalize_sql(result["text"])}
+
+
+async def areview_sql(sql: str, db_schema: str) -> Dict[str, Any]:
+    cached = _cached_answer("review_sql", sql, db_schema, similar=False)
+    if cached:
+        return {**cached, "text": normalize_sql(cached["text"])}
+    result = await arun_agent(*_review_sql_prompt(sql, db_schema), stage="review")
+    result = _store_answer("review_sql", sql, db_schema, result, similar=False)
+    return {**result, "text": normalize_sql(result["text"])}
+
+
+def _check_compliance_prompt(sql: str, notes: Sequence[str] = ()) -> Tuple[str, str, PromptPrefix]:
     system = (
         "You are a Healthcare Data Privacy and Compliance Officer. "
         "Analyze the provided SQL query for compliance with healthcare data privacy regulations (HIPAA, GDPR) and best practices. "
         "Check for potential exposure of PHI (Protected Health Information) or PII (Personally Identifiable Information). "
         "Consider healthcare-specific compliance requirements for provider data, patient data, and pharmaceutical information. "
         "Return a concise markdown report stating 'Compliant' if there are no issues, "
-        "or list specific privacy or compliance violations if found. "
+        "or 'Non-compliant' followed by the specific privacy or compliance violations found. "
         "Be brief and clear, focusing on healthcare data protection."
     )
+    flagged = "".join(f"- {note}\n" for note in notes)
     human = (
-        f"Healthcare Domain Context:\n{HEALTHCARE_CONTEXT}\n\n"
         f"SQL query to check:\n{sql}\n\n"
-        "Respond with a short markdown report focusing on healthcare data privacy compliance."
+        + (f"An automated column-sensitivity screen flagged:\n{flagged}\n" if flagged else "")
+        + "Respond with a short markdown report focusing on healthcare data privacy compliance."
     )
-    return run_agent(system, human)
+    # Compliance needs no schema; its context prefix is still the leading part of the full one
+    return system, human, PREFIX_CACHE.prefix(f"Healthcare Domain Context:\n{HEALTHCARE_CONTEXT}")
 
 
-def interpret_healthcare_query(user_input: str, db_schema: str) -> Dict[str, Any]:
+def _compliance_prescreen(sql: str) -> Optional[ComplianceVerdict]:
+    """Rule-based verdict, or None when the pre-screen is off or the catalog is unavailable"""
+    if not COMPLIANCE_PRESCREEN:
+        return None
+    try:
+        return screen_query(sql)
+    except Exception:
+        return None
+
+
+def _compliance_result(verdict: ComplianceVerdict) -> Dict[str, Any]:
+    return {"text": verdict.text, "cost": 0.0, "status": verdict.status, "local": True}
+
+
+def check_compliance(sql: str) -> Dict[str, Any]:
+    """{"text", "cost", "status"}; gate execution on status == "compliant", never on the text"""
+    verdict = _compliance_prescreen(sql)
+    if verdict is not None and verdict.decided:
+        return _compliance_result(verdict)
+    result = run_agent(*_check_compliance_prompt(sql, verdict.reasons if verdict else ()), stage="compliance")
+    return {**result, "status": parse_compliance_text(result["text"])}
+
+
+async def acheck_compliance(sql: str) -> Dict[str, Any]:
+    verdict = _compliance_prescreen(sql)
+    if verdict is not None and verdict.decided:
+        return _compliance_result(verdict)
+    result = await arun_agent(*_check_compliance_prompt(sql, verdict.reasons if verdict else ()), stage="compliance")
+    return {**result, "status": parse_compliance_text(result["text"])}
+
+
+def _interpret_healthcare_query_prompt(user_input: str, db_schema: str) -> Tuple[str, str, PromptPrefix]:
     """
     Enhanced function to interpret healthcare queries with domain-specific understanding
     """
-    schema_notes = load_schema_notes()
     system = (
         "You are a Healthcare Data Analyst specializing in interpreting business questions into database queries. "
         "Your task is to understand the user's healthcare-related question and provide context about what data they're looking for. "
@@ -152,20 +620,29 @@ def interpret_healthcare_query(user_input: str, db_schema: str) -> Dict[str, Any
         "Provide a clear interpretation without generating the actual SQL query."
     )
     human = (
-        f"Healthcare Domain Context:\n{HEALTHCARE_CONTEXT}\n\n"
-        f"Detailed Schema Notes:\n{schema_notes}\n\n"
-        f"Database schema:\n{db_schema}\n\n"
+        f"Detailed Schema Notes:\n{relevant_schema_notes(user_input)}\n\n"
         f"User request:\n{user_input}\n\n"
         "Please interpret this healthcare query and explain what data the user is looking for."
     )
-    return run_agent(system, human)
+    return system, human, build_prompt_prefix(db_schema)
 
 
-def validate_healthcare_sql(sql: str, db_schema: str) -> Dict[str, Any]:
+def interpret_healthcare_query(user_input: str, db_schema: str) -> Dict[str, Any]:
+    return run_agent(*_interpret_healthcare_query_prompt(user_input, db_schema), stage="interpret")
+
+
+async def ainterpret_healthcare_query(user_input: str, db_schema: str) -> Dict[str, Any]:
+    return await arun_agent(*_interpret_healthcare_query_prompt(user_input, db_schema), stage="interpret")
+
+
+def stream_interpret_healthcare_query(user_input: str, db_schema: str) -> AgentStream:
+    return stream_agent(*_interpret_healthcare_query_prompt(user_input, db_schema), stage="interpret")
+
+
+def _validate_healthcare_sql_prompt(sql: str, db_schema: str, notes: Sequence[str] = ()) -> Tuple[str, str, PromptPrefix]:
     """
     Validate SQL query against healthcare data schema and best practices
     """
-    schema_notes = load_schema_notes()
     system = (
         "You are a Healthcare Database Validator. "
         "Your task is to validate the provided SQL query against the healthcare database schema. "
@@ -174,11 +651,138 @@ def validate_healthcare_sql(sql: str, db_schema: str) -> Dict[str, Any]:
         "Return a validation report indicating if the query is valid and any issues found. "
         "Be specific about what needs to be corrected if issues are found."
     )
+    local = "".join(f"- {note}\n" for note in notes)
     human = (
-        f"Healthcare Domain Context:\n{HEALTHCARE_CONTEXT}\n\n"
-        f"Detailed Schema Notes:\n{schema_notes}\n\n"
-        f"Database schema:\n{db_schema}\n\n"
+        f"Detailed Schema Notes:\n{relevant_schema_notes(sql)}\n\n"
         f"SQL query to validate:\n{sql}\n\n"
-        "Please validate this query and provide a detailed report."
+        + (f"Automated checks passed compilation but could not decide:\n{local}\n" if local else "")
+        + "Please validate this query and provide a detailed report."
+    )
+    return system, human, build_prompt_prefix(db_schema)
+
+
+def _local_validation(sql: str) -> Optional[ValidationReport]:
+    """Catalog + EXPLAIN verdict, or None when local validation is off or unavailable"""
+    if not LOCAL_VALIDATION:
+        return None
+    try:
+        return validate_query(sql)
+    except Exception:
+        return None
+
+
+def validate_healthcare_sql(sql: str, db_schema: str) -> Dict[str, Any]:
+    """Decided locally whenever possible; the LLM only sees queries the checks leave open"""
+    report = _local_validation(sql)
+    if report is not None and report.decided:
+        return {"text": report.text, "cost": 0.0, "local": report.status}
+    notes = report.undecided if report is not None else ()
+    return run_agent(*_validate_healthcare_sql_prompt(sql, db_schema, notes), stage="validate")
+
+
+async def avalidate_healthcare_sql(sql: str, db_schema: str) -> Dict[str, Any]:
+    report = _local_validation(sql)
+    if report is not None and report.decided:
+        return {"text": report.text, "cost": 0.0, "local": report.status}
+    notes = report.undecided if report is not None else ()
+    return await arun_agent(*_validate_healthcare_sql_prompt(sql, db_schema, notes), stage="validate")
+
+
+def stream_validate_healthcare_sql(sql: str, db_schema: str) -> AgentStream:
+    """The local checks run now; a report they cannot decide is streamed from the LLM when iterated"""
+    report = _local_validation(sql)
+    if report is not None and report.decided:
+        return AgentStream.completed({"text": report.text, "cost": 0.0, "local": report.status})
+    notes = report.undecided if report is not None else ()
+    return stream_agent(*_validate_healthcare_sql_prompt(sql, db_schema, notes), stage="validate")
+
+
+def _repair_sql_prompt(user_input: str, sql: str, error: str, db_schema: str) -> Tuple[str, str, PromptPrefix]:
+    system = (
+        "You are a highly skilled Senior Data Analyst fixing a SQLite query that failed. "
+        "Use the error message to find the cause, then return a corrected query that still answers the user's request. "
+        "Strictly use ONLY the tables and columns provided in the schema above, quoted exactly as they are defined. "
+        "Return ONLY the SQL query, with no explanations or extra text."
+    )
+    human = (
+        f"Detailed Schema Notes:\n{relevant_schema_notes(user_input or sql)}\n\n"
+        f"User request:\n{user_input}\n\n"
+        f"Failed SQL:\n{sql}\n\n"
+        f"Error:\n{error}\n\n"
+        "Remember: Only output the corrected SQL query."
+    )
+    return system, human, build_prompt_prefix(db_schema)
+
+
+def repair_sql(user_input: str, sql: str, error: str, db_schema: str) -> Dict[str, Any]:
+    result = run_agent(*_repair_sql_prompt(user_input, sql, error, db_schema), stage="repair")
+    return {**result, "text": normalize_sql(result["text"])}
+
+
+async def arepair_sql(user_input: str, sql: str, error: str, db_schema: str) -> Dict[str, Any]:
+    result = await arun_agent(*_repair_sql_prompt(user_input, sql, error, db_schema), stage="repair")
+    return {**result, "text": normalize_sql(result["text"])}
+
+
+def execute_with_repair(user_input: str, sql: str, db_schema: str,
+                        execute: Optional[Callable[[str], QueryResult]] = None,
+                        first_error: Optional[str] = None) -> RepairOutcome:
+    """Run sql and let the LLM repair it on errors or empty results; each fix is validated,
+    compliance-screened and cost-guarded locally before it runs"""
+    return run_repair_loop(
+        sql,
+        execute=execute or execute_sql,
+        repair=lambda bad_sql, error: repair_sql(user_input, bad_sql, error, db_schema),
+        validate=validate_query,
+        guard=check_query_cost,
+        compliance=check_compliance,
+        max_attempts=REPAIR_MAX_ATTEMPTS,
+        token_budget=REPAIR_TOKEN_BUDGET,
+        first_error=first_error,
+        stats=REPAIR_STATS,
     )
-    return run_agent(system, human)
+
+
+def repair_report() -> Dict[str, float]:
+    """Success rate, mean attempts and mean seconds to a correct answer of execute_with_repair"""
+    return REPAIR_STATS.snapshot()
+
+
+# ---------- concurrent pipeline ----------
+STAGE_TIMEOUT = float(os.getenv("PIPELINE_STAGE_TIMEOUT", "120"))
+
+
+def review_stages(db_schema: str, stream: bool = False) -> List[Stage]:
+    """review -> (validate || compliance): both only need the reviewed SQL.
+
+    With stream, validate yields an AgentStream for the caller to render as it arrives; the
+    call is already running (first chunk in) when the stage completes.
+    """
+    def validate(sql: str):
+        if stream:
+            return stream_validate_healthcare_sql(sql, db_schema).prefetch()
+        return validate_healthcare_sql(sql, db_schema)
+
+    return [
+        Stage("review", lambda r: review_sql(r["generate"]["text"], db_schema), deps=("generate",)),
+        Stage("validate", lambda r: validate(r["review"]["text"]), deps=("review",)),
+        Stage("compliance", lambda r: check_compliance(r["review"]["text"]), deps=("review",)),
+    ]
+
+
+def healthcare_pipeline_stages(user_input: str, db_schema: str) -> List[Stage]:
+    """Full DAG: interpret and generate both depend only on the prompt and run side by side"""
+    return [
+        Stage("interpret", lambda r: interpret_healthcare_query(user_input, db_schema)),
+        Stage("generate", lambda r: generate_sql(user_input, db_schema)),
+    ] + review_stages(db_schema)
+
+
+def run_healthcare_pipeline(user_input: str, db_schema: str) -> PipelineResult:
+    return run_pipeline(healthcare_pipeline_stages(user_input, db_schema), default_timeout=STAGE_TIMEOUT)
+
+
+def run_review_pipeline(generated_sql: str, db_schema: str, stream: bool = False) -> PipelineResult:
+    """Review, then validate and compliance-check concurrently, for already generated SQL"""
+    stages = [Stage("generate", lambda r: {"text": generated_sql, "cost": 0.0})] + review_stages(db_schema, stream)
+    return run_pipeline(stages, default_timeout=STAGE_TIMEOUT)
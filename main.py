@@ -1,11 +1,12 @@
 # main.py
-from utils.db_simulator import get_structured_schema, run_query, DB_PATH
+from utils.db_simulator import get_structured_schema, check_query_cost, create_pager, execute_sql, DB_PATH
+from utils.query_engine import QueryInterrupted
+from utils.repair_loop import EMPTY_RESULT_ERROR
 from langchain_agents import (
-    generate_sql, 
-    review_sql, 
-    check_compliance, 
-    interpret_healthcare_query,
-    validate_healthcare_sql
+    execute_with_repair,
+    run_healthcare_pipeline,
+    prompt_cache_report,
+    reset_prompt_cache_stats
 )
 
 def main():
@@ -52,49 +53,84 @@ def main():
         print(f"\n🔍 Processing query: {user_prompt}")
         print("-" * 60)
         
+        reset_prompt_cache_stats()
+        repair_cost = 0.0
         try:
-            # 1. Interpret the healthcare query
-            print("📖 Interpreting healthcare query...")
-            interpretation = interpret_healthcare_query(user_prompt, db_schema)
-            print(f"Interpretation: {interpretation['text']}")
+            # 1-5. Interpret/generate run concurrently, then review, then validate/compliance concurrently
+            print("⚙️  Running interpret → generate → review → validate/compliance pipeline...")
+            run = run_healthcare_pipeline(user_prompt, db_schema)
             
-            # 2. Generate SQL
-            print("\n💻 Generating SQL...")
-            gen = generate_sql(user_prompt, db_schema)
+            interpretation = run.value("interpret")
+            print(f"📖 Interpretation: {interpretation['text']}")
+            
+            gen = run.value("generate")
             raw_sql = gen["text"]
-            print(f"Generated SQL:\n{raw_sql}")
+            print(f"\n💻 Generated SQL:\n{raw_sql}")
             
-            # 3. Review SQL
-            print("\n🔍 Reviewing SQL...")
-            rev = review_sql(raw_sql, db_schema)
+            rev = run.value("review")
             reviewed_sql = rev["text"]
-            print(f"Reviewed SQL:\n{reviewed_sql}")
+            print(f"\n🔍 Reviewed SQL:\n{reviewed_sql}")
             
-            # 4. Validate SQL
-            print("\n✅ Validating SQL...")
-            validation = validate_healthcare_sql(reviewed_sql, db_schema)
-            print(f"Validation Report:\n{validation['text']}")
+            validation = run.value("validate")
+            print(f"\n✅ Validation Report:\n{validation['text']}")
             
-            # 5. Check compliance
-            print("\n🔒 Checking compliance...")
-            comp = check_compliance(reviewed_sql)
+            comp = run.value("compliance")
             compliance_report = comp["text"]
-            print(f"Compliance Report:\n{compliance_report}")
+            print(f"\n🔒 Compliance Report:\n{compliance_report}")
+            
+            print(f"\n⏱️  Pipeline wall time {run.wall_time:.1f}s vs {run.serial_time:.1f}s serial "
+                  f"(saved {run.time_saved:.1f}s)")
             
             # 6. Execute query if compliant
-            if "compliant" in compliance_report.lower():
+            if comp["status"] == "compliant":
                 print("\n🚀 Executing query...")
                 try:
-                    result = run_query(reviewed_sql)
-                    print(f"Query Results:\n{result}")
+                    verdict = check_query_cost(reviewed_sql)
+                    print(f"🛡️  Cost guard: {verdict.summary}")
+                    for reason in verdict.reasons:
+                        print(f"   • {reason}")
+                    if not verdict.allowed:
+                        raise RuntimeError("query rejected by the cost guard")
+                    executed_sql = verdict.sql
+                    try:
+                        result = execute_sql(executed_sql, max_rows=10)
+                        failure = EMPTY_RESULT_ERROR if result.row_count == 0 else None
+                    except QueryInterrupted:
+                        raise
+                    except Exception as e:
+                        result, failure = None, f"{type(e).__name__}: {e}"
+                    if failure:
+                        print(f"🔧 {failure}\n   Repairing the query automatically...")
+                        outcome = execute_with_repair(user_prompt, executed_sql, db_schema, first_error=failure,
+                                                      execute=lambda sql: execute_sql(sql, max_rows=10))
+                        if outcome.success:
+                            result, executed_sql = outcome.result, outcome.sql
+                            print(f"✅ Repaired after {len(outcome.attempts)} attempts ({outcome.seconds:.1f}s):\n{executed_sql}")
+                        elif result is None:
+                            raise RuntimeError(f"{failure} (repair stopped: {outcome.stop_reason}; "
+                                               f"last error: {outcome.last_error})")
+                        repair_cost = outcome.cost
+                    print(f"⏱️  {result.row_count}{'+' if result.truncated else ''} rows in {result.elapsed_ms:.1f} ms")
+                    pager = create_pager(executed_sql, page_size=10, first_result=result)
+                    for page in pager:
+                        print(f"Query Results (page {page.page + 1}):\n{page.to_dataframe().to_string(index=False)}")
+                        if not page.has_more or input("Press 'n' for the next page: ").strip().lower() != "n":
+                            break
+                except QueryInterrupted as e:
+                    print(f"⏹️  {e} after {e.elapsed_ms:,.0f} ms ({e.rows:,} rows read)")
                 except Exception as e:
                     print(f"❌ Query execution failed: {e}")
             else:
-                print("⚠️  Query failed compliance check. Not executing.")
+                print(f"⚠️  Query failed compliance check ({comp['status'].replace('_', ' ')}). Not executing.")
             
             # Show costs
-            total_cost = gen["cost"] + rev["cost"] + comp["cost"] + interpretation["cost"] + validation["cost"]
+            total_cost = (gen["cost"] + rev["cost"] + comp["cost"] + interpretation["cost"] + validation["cost"]
+                          + repair_cost)
             print(f"\n💰 Total LLM cost: ${total_cost:.6f}")
+            cache = prompt_cache_report()
+            print(f"🧠 Prompt prefix cache: {cache['tokens_saved']:,} of {cache['prefix_tokens']:,} prefix tokens "
+                  f"read from the provider cache ({cache['hit_rate']:.0%}) across {cache['calls']} calls; "
+                  f"~{cache['estimated_reused_tokens']:,} sent while warm (estimate)")
             
         except Exception as e:
             print(f"❌ Error processing query: {e}")
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+Columnar execution backend: the base tables converted once to Parquet and queried through
+DuckDB, for aggregate-heavy questions over wide tables that SQLite's row store reads slowly.
+Optional: needs the "columnar" extra (duckdb, pyarrow); without it every query runs on SQLite
+
+Run from the project directory:
+    python -m utils.columnar [--db dataset/data.sqlite] [--rebuild]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date, datetime, time as dt_time
+from decimal import Decimal
+from typing import Dict, Optional
+
+import sqlparse
+from sqlparse import sql as S
+from sqlparse import tokens as T
+
+from utils.connection_pool import get_pool
+from utils.dialect import local_target, translate_sql
+from utils.query_engine import (
+    DEFAULT_BATCH_SIZE, CancelToken, QueryBudget, QueryCancelled, QueryResult, QueryTimeout, execute_query,
+    is_select, sqlite_type_name, stream_rows, unique_columns,
+)
+from utils.schema_catalog import SchemaCatalog, load_catalog, quote_identifier
+
+COLUMNAR_DIR = os.path.join(".cache", "columnar")
+SNAPSHOT_FORMAT_VERSION = 2
+CONVERT_BATCH_SIZE = 50_000
+ENGINES = ("auto", "sqlite", "duckdb")
+# auto: aggregates over at least this many base rows go to DuckDB when a current snapshot exists
+COLUMNAR_MIN_ROWS = int(os.getenv("COLUMNAR_MIN_ROWS", "50000"))
+
+# Columns whose values all read as integers (or reals); recorded so SUM can keep SQLite's
+# result type. The snapshot itself stores every column as text, as data.sqlite does
+_INTEGER = re.compile(r"-?(0|[1-9]\d{0,17})")
+_REAL = re.compile(r"-?(0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?")
+_AGGREGATE = re.compile(r"(?is)\bgroup\s+by\b|\b(count|sum|avg|total|min|max)\s*\(")
+# DuckDB type names for the SQLite ones whose width or meaning differs
+_CAST_TYPES = {"REAL": "DOUBLE", "FLOAT": "DOUBLE", "DOUBLE": "DOUBLE"}
+_INTEGER_TYPES = {"INT", "INTEGER", "BIGINT", "SMALLINT", "TINYINT"}
+# Functions whose numeric arguments are parameters (precision, offsets), never compared with a column
+_NUMERIC_PARAMETERS = {"round", "substr", "substring"}
+# SQLite's text -> REAL conversion (CAST, SUM, AVG): the longest numeric prefix, else 0.0
+_SQLITE_REAL_MACRO = (
+    "CREATE MACRO sqlite_real(x) AS CASE WHEN x IS NULL THEN NULL ELSE COALESCE(TRY_CAST("
+    r"regexp_extract(x, '^\s*([-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?)', 1) AS DOUBLE), 0.0) END"
+)
+
+
+class SQLiteOnly(ValueError):
+    """The query's result depends on SQLite's typing rules in a way DuckDB would not reproduce"""
+
+
+def duckdb_available() -> bool:
+    try:
+        import duckdb  # noqa: F401
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _require_duckdb():
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("The columnar backend requires duckdb and pyarrow: pip install '.[columnar]'") from e
+    return duckdb
+
+
+# ---------- Parquet snapshot ----------
+def snapshot_dir(db_path: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(db_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(COLUMNAR_DIR, digest)
+
+
+def _text_array(pa, values: list):
+    """A batch of SQLite values as an Arrow string column (SQLite here stores everything as text)"""
+    try:
+        return pa.array(values, type=pa.string())
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+
+@dataclass
+class ColumnarSnapshot:
+    directory: str
+    fingerprint: Dict[str, int]
+    tables: Dict[str, Dict[str, object]] = field(default_factory=dict)   # name -> {"file", "types"}
+
+    def path(self, table: str) -> str:
+        return os.path.join(self.directory, self.tables[table]["file"])
+
+
+def convert_to_parquet(db_path: str, directory: Optional[str] = None,
+                       catalog: Optional[SchemaCatalog] = None) -> ColumnarSnapshot:
+    """Write every catalog table to <directory>/<n>.parquet plus a manifest keyed by the db fingerprint.
+
+    Columns stay text, so comparisons, sorting and MIN/MAX behave as on SQLite; the manifest
+    records which columns read entirely as integers or reals (see duckdb_sql).
+    """
+    duckdb = _require_duckdb()
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    catalog = catalog or load_catalog(db_path)
+    directory = directory or snapshot_dir(db_path)
+    staging = directory + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    snapshot = ColumnarSnapshot(directory, catalog.fingerprint)
+    typer = duckdb.connect()
+    try:
+        with get_pool(db_path).connection() as conn:
+            for n, table in enumerate(catalog.tables):
+                names = unique_columns([c.name for c in table.columns])
+                schema = pa.schema(pa.field(name, pa.string()) for name in names)
+                file_name = f"{n}.parquet"
+                text_path = os.path.join(staging, file_name)
+                with pq.ParquetWriter(text_path, schema) as writer:
+                    select = f"SELECT * FROM {quote_identifier(table.name)}"
+                    for _, batch in stream_rows(conn, select, batch_size=CONVERT_BATCH_SIZE):
+                        arrays = [_text_array(pa, list(values)) for values in zip(*batch)] if batch else \
+                            [pa.array([], type=pa.string()) for _ in names]
+                        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                source = "read_parquet('" + os.path.abspath(text_path).replace("'", "''") + "')"
+                checks = ", ".join(
+                    f"bool_and(regexp_full_match({quote_identifier(c)}, '{pattern.pattern}'))"
+                    for c in names for pattern in (_INTEGER, _REAL)
+                )
+                flags = typer.execute(f"SELECT {checks} FROM {source}").fetchone()
+                # None: no non-NULL value at all, which any type holds
+                types = ["INTEGER" if flags[2 * i] is not False else "REAL" if flags[2 * i + 1] is not False
+                         else "TEXT" for i in range(len(names))]
+                snapshot.tables[table.name] = {"file": file_name, "types": dict(zip(names, types))}
+    finally:
+        typer.close()
+    with open(os.path.join(staging, "manifest.json"), "w", encoding="utf-8") as fh:
+        json.dump({"format": SNAPSHOT_FORMAT_VERSION, "fingerprint": snapshot.fingerprint,
+                   "tables": snapshot.tables}, fh, indent=1)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(staging, directory)
+    return snapshot
+
+
+def current_snapshot(db_path: str, catalog: Optional[SchemaCatalog] = None) -> Optional[ColumnarSnapshot]:
+    """The on-disk snapshot if it was converted from the database as it is now"""
+    catalog = catalog or load_catalog(db_path)
+    directory = snapshot_dir(db_path)
+    try:
+        with open(os.path.join(directory, "manifest.json"), "r", encoding="utf-8") as fh:
+            manifest = json.load(fh)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("format") != SNAPSHOT_FORMAT_VERSION or manifest.get("fingerprint") != catalog.fingerprint:
+        return None
+    return ColumnarSnapshot(directory, manifest["fingerprint"], manifest["tables"])
+
+
+# ---------- DuckDB ----------
+_databases: Dict[str, tuple] = {}
+_databases_lock = threading.Lock()
+
+
+def _database(db_path: str, snapshot: ColumnarSnapshot):
+    """One in-memory DuckDB per snapshot with a view per table; queries run on cursors of it"""
+    duckdb = _require_duckdb()
+    with _databases_lock:
+        cached = _databases.get(db_path)
+        if cached is not None and cached[0] == snapshot.fingerprint:
+            return cached[1]
+        conn = duckdb.connect()
+        # SQLite semantics where DuckDB differs: integer division, NULLs sort as the smallest value
+        conn.execute("SET integer_division = true")
+        conn.execute("SET default_null_order = 'nulls_first_on_asc_last_on_desc'")
+        conn.execute(_SQLITE_REAL_MACRO)
+        for table in snapshot.tables:
+            path = os.path.abspath(snapshot.path(table)).replace("'", "''")
+            conn.execute(f"CREATE VIEW {quote_identifier(table)} AS SELECT * FROM read_parquet('{path}')")
+        # A superseded database is left to the garbage collector: cursors may still be reading it
+        _databases[db_path] = (snapshot.fingerprint, conn)
+        return conn
+
+
+def _unnamed_expressions(statement) -> Dict[int, str]:
+    """id(last token) -> text of each unaliased select expression; SQLite names such a column
+    by its text, DuckDB by its own rendering (count_star() for COUNT(*))"""
+    items = []
+    for token in statement.tokens:
+        if token.is_whitespace or token.match(T.Keyword, ("DISTINCT", "ALL")) or token.ttype in T.DML:
+            continue
+        if token.is_keyword and not isinstance(token, S.TokenList) and token.normalized == "FROM":
+            break
+        items.extend(token.get_identifiers() if isinstance(token, S.IdentifierList) else [token])
+    names = {}
+    for item in items:
+        if isinstance(item, S.Identifier) and item.has_alias():
+            continue
+        leaves = [t for t in item.flatten() if not t.is_whitespace]
+        plain = all(t.ttype in T.Name or t.ttype in T.String.Symbol or t.ttype in T.Keyword
+                    or t.ttype in T.Wildcard or t.match(T.Punctuation, ".") for t in leaves)
+        if leaves and not plain:
+            names[id(leaves[-1])] = item.value.strip()
+    return names
+
+
+def _unquote(name: str) -> str:
+    if len(name) > 1 and name[0] == name[-1] and name[0] in "\"`":
+        return name[1:-1].replace(name[0] * 2, name[0])
+    return name.strip("[]")
+
+
+def _function_name(function) -> str:
+    return function.get_name().lower() if isinstance(function, S.Function) else ""
+
+
+def _bare_column(parenthesis) -> Optional[str]:
+    """Column name if the parenthesis holds exactly one plain (optionally qualified) column reference"""
+    inner = [t for t in parenthesis.tokens[1:-1] if not t.is_whitespace]
+    if len(inner) != 1 or not isinstance(inner[0], S.Identifier) or inner[0].has_alias():
+        return None
+    leaves = [t for t in inner[0].flatten() if not t.is_whitespace]
+    if not all(t.ttype in T.Name or t.ttype in T.String.Symbol or t.match(T.Punctuation, ".") for t in leaves):
+        return None
+    return _unquote(leaves[-1].value)
+
+
+def _cast_parts(function) -> Optional[tuple]:
+    """(expression text, its column if it is a plain column reference, target type) of CAST(expression AS type)"""
+    parenthesis = next((t for t in function.tokens if isinstance(t, S.Parenthesis)), None)
+    if parenthesis is None:
+        return None
+    tokens = list(parenthesis.flatten())[1:-1]
+    as_index = max((i for i, t in enumerate(tokens) if t.match(T.Keyword, "AS")), default=None)
+    if as_index is None:
+        return None
+    expression = [t for t in tokens[:as_index] if not t.is_whitespace]
+    target = " ".join(t.value.upper() for t in tokens[as_index + 1:] if not t.is_whitespace)
+    column = None
+    if expression and all(t.ttype in T.Name or t.ttype in T.String.Symbol or t.match(T.Punctuation, ".")
+                          for t in expression):
+        column = _unquote(expression[-1].value)
+    return "".join(t.value for t in tokens[:as_index]).strip(), column, target
+
+
+def _typed_number(token) -> bool:
+    """COUNT(...) or CAST(... AS REAL): a number on both engines, so comparing it with a literal is safe"""
+    name = _function_name(token)
+    if name == "cast":
+        parts = _cast_parts(token)
+        return parts is not None and parts[2] in _CAST_TYPES
+    return name == "count"
+
+
+def sqlite_only_reason(sql: str) -> Optional[str]:
+    """Why DuckDB over text columns could answer sql differently from SQLite, or None.
+
+    SQLite never equates text with a number ('2017' = 2017 is false) and truncates casts to
+    integer; DuckDB converts one side and rounds. So a numeric literal is only allowed where
+    it is a LIMIT/OFFSET, a GROUP BY/ORDER BY position, a ROUND/SUBSTR parameter or compared
+    with COUNT(...) or a cast to REAL, and integer casts are left to SQLite.
+    """
+    statement = sqlparse.parse(sql)[0] if sql.strip() else None
+    if statement is None:
+        return None
+    leaves = [t for t in statement.flatten() if not t.is_whitespace and t.ttype not in T.Comment]
+    clause = None
+    for i, token in enumerate(leaves):
+        if token.is_keyword:
+            if token.normalized in ("GROUP BY", "ORDER BY", "WHERE", "HAVING", "FROM", "SELECT", "ON"):
+                clause = token.normalized
+            continue
+        if token.ttype not in T.Number:
+            continue
+        previous = leaves[i - 1] if i else None
+        following = leaves[i + 1] if i + 1 < len(leaves) else None
+        if previous is not None and previous.match(T.Keyword, ("LIMIT", "OFFSET")):
+            continue
+        if clause in ("GROUP BY", "ORDER BY") and previous is not None and \
+                (previous.normalized == clause or previous.match(T.Punctuation, ",")) and \
+                (following is None or following.is_keyword or following.match(T.Punctuation, (",", ")", ";"))):
+            continue
+        parent = token.parent
+        if isinstance(parent, S.IdentifierList):
+            parent = parent.parent
+        if isinstance(parent, S.Parenthesis) and _function_name(parent.parent) in _NUMERIC_PARAMETERS:
+            continue
+        if isinstance(parent, S.Comparison) and _typed_number(parent.left):
+            continue
+        return f"compares a column with the number {token.value}"
+    for token in statement.flatten():
+        if token.ttype in T.Name and token.value.lower() == "cast" and isinstance(token.parent.parent, S.Function):
+            parts = _cast_parts(token.parent.parent)
+            if parts is None or parts[2] in _INTEGER_TYPES:
+                return "casts to an integer"
+    return None
+
+
+def duckdb_sql(sql: str, column_types: Optional[Dict[str, str]] = None) -> str:
+    """Adapt SQLite-flavoured SQL to DuckDB over the text snapshot: ASCII-case-insensitive LIKE,
+    SQLite's text-to-number conversion in CAST/SUM/AVG/TOTAL of a column, and SQLite's names
+    for unaliased expression columns.
+
+    column_types maps the query's lower-cased column names to INTEGER/REAL/TEXT (see convert_to_parquet);
+    SUM of an all-integer column stays an integer. Raises SQLiteOnly for queries DuckDB
+    would answer differently (see sqlite_only_reason).
+    """
+    if not sql.strip():
+        return sql
+    reason = sqlite_only_reason(sql)
+    if reason:
+        raise SQLiteOnly(reason)
+    column_types = column_types or {}
+    statement = sqlparse.parse(sql)[0]
+    names = _unnamed_expressions(statement) if statement.get_type() == "SELECT" else {}
+
+    def replacement(function) -> Optional[str]:
+        name = _function_name(function)
+        if name == "cast":
+            expression, column, target = _cast_parts(function)
+            if target in _CAST_TYPES:
+                if column is not None and column.lower() in column_types:
+                    return f"sqlite_real({expression})"
+                return f"CAST({expression} AS {_CAST_TYPES[target]})"
+            return None
+        if name not in ("sum", "avg", "total"):
+            return None
+        parenthesis = next((t for t in function.tokens if isinstance(t, S.Parenthesis)), None)
+        column = _bare_column(parenthesis) if parenthesis is not None else None
+        if column is None or column.lower() not in column_types:
+            return None
+        argument = parenthesis.value[1:-1].strip()
+        if name == "sum" and column_types[column.lower()] == "INTEGER":
+            return f"sum(CAST({argument} AS BIGINT))"
+        if name == "total":
+            return f"coalesce(sum(sqlite_real({argument})), 0.0)"
+        return f"{name}(sqlite_real({argument}))"
+
+    def render(token) -> str:
+        if isinstance(token, S.Function):
+            replaced = replacement(token)
+            if replaced is not None:
+                last = [t for t in token.flatten() if not t.is_whitespace][-1]
+                return replaced + (f" AS {quote_identifier(names[id(last)])}" if id(last) in names else "")
+        if token.is_group:
+            return "".join(render(t) for t in token.tokens)
+        value = token.value
+        if token.normalized == "LIKE":
+            value = "ILIKE"
+        if id(token) in names:
+            value += f" AS {quote_identifier(names[id(token)])}"
+        return value
+
+    return render(statement)
+
+
+def _sqlite_value(value):
+    """What sqlite3 would have returned: floats for decimals, ISO text for dates"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime) else value.isoformat()
+    return value
+
+
+def _query_words(sql: str) -> set:
+    return {t.value.strip('"`[]').lower() for t in sqlparse.parse(sql)[0].flatten() if not t.is_whitespace}
+
+
+def _column_types(sql: str, snapshot: ColumnarSnapshot) -> Dict[str, str]:
+    """Lower-cased column name -> recorded type over the tables sql mentions; names whose
+    tables disagree are left out"""
+    words = _query_words(sql)
+    types: Dict[str, str] = {}
+    conflicting = set()
+    for table, entry in snapshot.tables.items():
+        if table.lower() not in words:
+            continue
+        for column, kind in entry["types"].items():
+            key = column.lower()
+            if types.setdefault(key, kind) != kind:
+                conflicting.add(key)
+    return {k: v for k, v in types.items() if k not in conflicting}
+
+
+def execute_columnar(db_path: str, sql: str, max_rows: Optional[int] = None,
+                     batch_size: int = DEFAULT_BATCH_SIZE, budget: Optional[QueryBudget] = None,
+                     token: Optional[CancelToken] = None, fallback: bool = True) -> QueryResult:
+    """execute_query on the DuckDB snapshot (converted on first use).
+
+    SQL DuckDB rejects is retried once transpiled from SQLite by utils.dialect; anything it
+    still cannot bind or run, or would answer differently (SQLiteOnly: text/number
+    comparisons, integer casts), is answered by SQLite when fallback is set. Budgets apply
+    the wall-clock timeout only; VM steps are an SQLite notion.
+    """
+    duckdb = _require_duckdb()
+    catalog = load_catalog(db_path)
+    snapshot = current_snapshot(db_path, catalog) or convert_to_parquet(db_path, catalog=catalog)
+    token = token or CancelToken()
+    budget = budget or QueryBudget()
+    token.started = start = time.perf_counter()
+    if max_rows is not None:
+        batch_size = min(batch_size, max_rows + 1)
+    cursor = _database(db_path, snapshot).cursor()
+    timer = None
+    if budget.timeout:
+        def expire():
+            token.reason = "timeout"
+            cursor.interrupt()
+        timer = threading.Timer(budget.timeout, expire)
+        timer.daemon = True
+        timer.start()
+    token._attach(cursor)
+    row_count = 0
+    truncated = False
+    try:
+        try:
+            cursor.execute(duckdb_sql(sql, _column_types(sql, snapshot)))
+        except duckdb.InterruptException:
+            raise
+        except duckdb.Error:
+            # One deterministic retry with SQLite functions and foreign table names transpiled
+            translation = translate_sql(sql, local_target(catalog, "duckdb"))
+            if translation.error or translation.sql == sql or token.cancelled:
+                raise
+            cursor.execute(duckdb_sql(translation.sql, _column_types(translation.sql, snapshot)))
+        columns = unique_columns([d[0] for d in cursor.description or ()])
+        column_types = ["NULL"] * len(columns)
+        data: Dict[str, list] = {c: [] for c in columns}
+        while not truncated:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            if max_rows is not None and row_count + len(batch) > max_rows:
+                batch = batch[:max_rows - row_count]
+                truncated = True
+            for i, column in enumerate(columns):
+                values = [_sqlite_value(row[i]) for row in batch]
+                data[column].extend(values)
+                if column_types[i] == "NULL":
+                    column_types[i] = next((sqlite_type_name(v) for v in values if v is not None), "NULL")
+            row_count += len(batch)
+            token.rows = row_count
+    except duckdb.InterruptException as e:
+        args = (token.elapsed_ms, 0, token.rows)
+        if token.reason == "timeout":
+            raise QueryTimeout(f"Query timed out after {budget.timeout:g}s", *args) from e
+        raise QueryCancelled("Query cancelled", *args) from e
+    except (duckdb.Error, SQLiteOnly):
+        if not fallback or token.cancelled:
+            raise
+        token._detach()
+        return execute_query(db_path, sql, max_rows, DEFAULT_BATCH_SIZE, budget, token)
+    finally:
+        if timer is not None:
+            timer.cancel()
+        token._detach()
+        cursor.close()
+    return QueryResult(
+        columns=columns,
+        column_types=column_types,
+        data=data,
+        row_count=row_count,
+        elapsed_ms=(time.perf_counter() - start) * 1000,
+        truncated=truncated,
+        engine="duckdb",
+    )
+
+
+def choose_engine(db_path: str, sql: str, catalog: SchemaCatalog, engine: Optional[str] = None) -> str:
+    """"sqlite" or "duckdb" for sql; engine (or QUERY_ENGINE) forces one, "auto" decides.
+
+    auto picks DuckDB for aggregates whose tables hold at least COLUMNAR_MIN_ROWS rows and
+    whose result cannot depend on SQLite's typing rules (sqlite_only_reason),
+    and only once `python -m utils.columnar` has a snapshot of the current database, so
+    conversion never happens on a user's query.
+    """
+    engine = engine or os.getenv("QUERY_ENGINE", "auto")
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown query engine {engine!r}; expected one of {', '.join(ENGINES)}")
+    if engine != "auto":
+        return engine
+    if not is_select(sql) or not _AGGREGATE.search(sql) or not duckdb_available() or sqlite_only_reason(sql):
+        return "sqlite"
+    words = _query_words(sql)
+    scanned = sum(t.row_count for t in catalog.tables if t.name.lower() in words)
+    if scanned < COLUMNAR_MIN_ROWS or current_snapshot(db_path, catalog) is None:
+        return "sqlite"
+    return "duckdb"
+
+
+def main():
+    from utils.db_simulator import DB_PATH
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--rebuild", action="store_true", help="Convert even if the snapshot is current")
+    args = parser.parse_args()
+
+    catalog = load_catalog(args.db)
+    snapshot = None if args.rebuild else current_snapshot(args.db, catalog)
+    if snapshot is not None:
+        print(f"✅ Parquet snapshot in {snapshot.directory} is current")
+        return
+    start = time.perf_counter()
+    snapshot = convert_to_parquet(args.db, catalog=catalog)
+    for table in catalog.tables:
+        types = list(snapshot.tables[table.name]["types"].values())
+        size = os.path.getsize(snapshot.path(table.name))
+        print(f"✅ {table.name:<28} {table.row_count:>10,} rows  {size / 1024:>9,.0f} KiB  "
+              f"text columns reading as {types.count('INTEGER')} integer / {types.count('REAL')} real / "
+              f"{types.count('TEXT')} text")
+    print(f"⚡ Converted in {time.perf_counter() - start:.2f}s into {snapshot.directory}")
+
+
+if __name__ == "__main__":
+    main()
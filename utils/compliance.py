@@ -0,0 +1,269 @@
+"""
+Rule-based PHI/PII pre-screen: a column-sensitivity registry built from the catalog and
+SchemaNotes.txt, and a token-level analyzer that finds which sensitive columns reach the
+result unaggregated. Only cases the rules cannot settle are escalated to the LLM.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import sqlparse
+from sqlparse import tokens as T
+
+from utils.index_advisor import analyze_query
+from utils.query_engine import is_select
+from utils.schema_catalog import SchemaCatalog
+from utils.schema_notes import NOTES_TABLES, SCHEMA_NOTES_PATH, split_schema_notes
+from utils.sql_tokens import CLAUSES, is_word, norm_identifier, significant_tokens
+
+# Sensitivity levels, most severe first:
+#   restricted   - patient-level identifiers (PHI); never returned row by row
+#   confidential - contact and location details, and day-level event dates of patient
+#                  records (quasi-identifiers); a human (or the LLM) decides
+#   internal     - provider identity (NPI registry data); returned with a note
+LEVELS = ("restricted", "confidential", "internal")
+
+# (tag, level, pattern over the normalized column name)
+SENSITIVITY_RULES: List[Tuple[str, str, str]] = [
+    ("patient_identifier", "restricted", r"patient_id|member_id|(^|_)ssn$|date_of_birth|(^|_)dob$|(^|_)claim_nbr$"),
+    ("contact", "confidential", r"phone|email|fax|address|postal_code|zip\d*(_cd)?$"),
+    ("person_name", "internal",
+     r"^(first|middle|last|family)_?name$|^(display)?name$|^initials$|_npi_names?$|_npi_nm$|_hcp_name$"
+     r"|_provider_(nm|name)$"),
+    ("provider_identifier", "internal", r"(^|_)npis?(_nbr)?$"),
+    ("demographic", "internal", r"^(gender|sex)$"),
+]
+
+# Day-granularity dates (the extracts' *_DD columns). In a table keyed by patient they date
+# an individual's claim or fill, which HIPAA counts as an identifier alongside diagnosis or drug
+EVENT_DATE_PATTERN = r"(^|_)dd$|(^|_)date$"
+
+# Aggregates whose result does not reveal an individual value (MIN/MAX/GROUP_CONCAT do)
+PROTECTIVE_AGGREGATES = {"COUNT", "SUM", "AVG", "TOTAL"}
+
+
+@dataclass
+class Sensitivity:
+    table: str
+    column: str
+    tag: str
+    level: str
+
+
+@dataclass
+class SensitivityRegistry:
+    """Sensitive columns per table, keyed on the normalized column name"""
+    tables: Dict[str, Dict[str, Sensitivity]] = field(default_factory=dict)
+
+    def lookup(self, table: str, column: str) -> Optional[Sensitivity]:
+        return self.tables.get(table, {}).get(norm_identifier(column))
+
+    def sensitive_columns(self, table: str) -> List[Sensitivity]:
+        return list(self.tables.get(table, {}).values())
+
+
+def classify_column(column: str, comment: str = "") -> Optional[Tuple[str, str]]:
+    """(tag, level) for a column name, using its SchemaNotes comment as a second signal"""
+    name = norm_identifier(column)
+    for tag, level, pattern in SENSITIVITY_RULES:
+        if re.search(pattern, name):
+            return tag, level
+    if re.search(r"(?i)\bpatient\b.{0,40}\bidentif", comment):
+        return "patient_identifier", "restricted"
+    return None
+
+
+def build_registry(catalog: SchemaCatalog, notes_path: str = SCHEMA_NOTES_PATH) -> SensitivityRegistry:
+    """Classify every catalog column; notes comments are matched through the extract's table name"""
+    try:
+        with open(notes_path, "r", encoding="utf-8") as fh:
+            sections = {s.name: s for s in split_schema_notes(fh.read())}
+    except OSError:
+        sections = {}
+    registry = SensitivityRegistry()
+    for table in catalog.tables:
+        section = sections.get(NOTES_TABLES.get(table.name, table.name))
+        comments = {norm_identifier(c): line for c, line in section.columns.items()} if section else {}
+        for column in table.columns:
+            found = classify_column(column.name, comments.get(norm_identifier(column.name), ""))
+            if found:
+                registry.tables.setdefault(table.name, {})[norm_identifier(column.name)] = Sensitivity(
+                    table.name, column.name, *found)
+        sensitive = registry.tables.get(table.name, {})
+        if any(s.level == "restricted" for s in sensitive.values()):
+            for column in table.columns:
+                key = norm_identifier(column.name)
+                if key not in sensitive and re.search(EVENT_DATE_PATTERN, key):
+                    sensitive[key] = Sensitivity(table.name, column.name, "event_date", "confidential")
+    return registry
+
+
+@dataclass
+class Finding:
+    sensitivity: Sensitivity
+    exposure: str                    # "output", "subquery", "lookup" or "filter"
+
+    @property
+    def label(self) -> str:
+        return f"{self.sensitivity.table}.{norm_identifier(self.sensitivity.column)} ({self.sensitivity.tag})"
+
+
+@dataclass
+class ComplianceVerdict:
+    status: str                      # "compliant", "non_compliant" or "needs_review"
+    findings: List[Finding] = field(default_factory=list)
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def compliant(self) -> bool:
+        return self.status == "compliant"
+
+    @property
+    def decided(self) -> bool:
+        return self.status != "needs_review"
+
+    @property
+    def text(self) -> str:
+        title = {"compliant": "✅ Compliant", "non_compliant": "❌ Non-compliant",
+                 "needs_review": "❔ Needs review"}[self.status]
+        lines = [f"**Compliance: {title}** (rule-based PHI/PII pre-screen)"]
+        lines += [f"- {reason}" for reason in self.reasons]
+        if not self.reasons:
+            lines.append("- No PHI or PII columns reach the result.")
+        return "\n".join(lines)
+
+
+def _function_name(leaves, i: int) -> Optional[str]:
+    """Name of the function whose argument list opens at leaves[i] ("("), if any"""
+    if i == 0:
+        return None
+    prev = leaves[i - 1]
+    if prev.ttype in T.Name or prev.is_keyword:
+        return prev.value.upper()
+    return None
+
+
+def _is_lookup(leaves, i: int) -> bool:
+    """column = 'literal' / IN ('...') / LIKE '...': the predicate singles out individuals"""
+    if i + 2 >= len(leaves):
+        return False
+    op, value = leaves[i + 1], leaves[i + 2]
+    if not (op.ttype in T.Operator.Comparison or op.match(T.Keyword, ("IN", "LIKE", "GLOB"))):
+        return False
+    if value.match(T.Punctuation, "(") and i + 3 < len(leaves):
+        value = leaves[i + 3]
+    return (value.ttype in T.Literal and value.ttype not in T.String.Symbol) or value.ttype in T.Name.Placeholder
+
+
+def find_exposures(sql: str, catalog: SchemaCatalog, registry: SensitivityRegistry) -> List[Finding]:
+    """Every sensitive column reference with how it is used; columns inside COUNT/SUM/AVG are safe"""
+    shape = analyze_query(sql, catalog)
+    tables = list(dict.fromkeys(shape.tables.values()))
+    leaves = significant_tokens(sql)
+    frames = [{"func": None, "clause": None, "subquery": False}]
+    findings: List[Finding] = []
+    # Event dates only identify someone in row-level output, not as a GROUP BY key of counts
+    grouped = any(t.match(T.Keyword, "GROUP BY") for t in leaves)
+
+    def record(sensitivity: Sensitivity, clause: Optional[str], i: int) -> None:
+        aggregated = any(f["func"] in PROTECTIVE_AGGREGATES for f in frames)
+        nested = any(f["subquery"] for f in frames)
+        if sensitivity.tag == "event_date" and (grouped or clause != "select"):
+            return
+        if clause == "select" and not aggregated:
+            findings.append(Finding(sensitivity, "subquery" if nested else "output"))
+        elif clause in ("where", "on") and _is_lookup(leaves, i):
+            findings.append(Finding(sensitivity, "lookup"))
+        elif clause in ("where", "on", "order"):
+            findings.append(Finding(sensitivity, "filter"))
+
+    for i, token in enumerate(leaves):
+        word = token.normalized.upper() if token.is_keyword else None
+        if token.match(T.Punctuation, "("):
+            frames.append({"func": _function_name(leaves, i), "clause": frames[-1]["clause"], "subquery": False})
+            continue
+        if token.match(T.Punctuation, ")"):
+            if len(frames) > 1:
+                frames.pop()
+            continue
+        if word and (word in CLAUSES or word.endswith("JOIN")):
+            frames[-1]["clause"] = "from" if word.endswith("JOIN") else CLAUSES[word]
+            if word == "SELECT" and len(frames) > 1:
+                frames[-1]["subquery"] = True
+            continue
+        clause = frames[-1]["clause"]
+        if token.match(T.Wildcard, "*") and clause == "select" and not leaves[i - 1].match(T.Punctuation, "("):
+            qualifier = leaves[i - 2].value if i > 1 and leaves[i - 1].match(T.Punctuation, ".") else None
+            scope = [shape.tables.get(norm_identifier(qualifier))] if qualifier else tables
+            for table in filter(None, scope):
+                for sensitivity in registry.sensitive_columns(table):
+                    record(sensitivity, clause, i)
+            continue
+        if clause == "from" or not is_word(token):
+            continue
+        if i + 1 < len(leaves) and leaves[i + 1].match(T.Punctuation, (".", "(")):
+            continue  # a qualifier or a function name, not a column
+        qualifier = leaves[i - 2].value if i > 1 and leaves[i - 1].match(T.Punctuation, ".") else None
+        scope = [shape.tables.get(norm_identifier(qualifier))] if qualifier else tables
+        for table in filter(None, scope):
+            sensitivity = registry.lookup(table, token.value)
+            if sensitivity is not None:
+                record(sensitivity, clause, i)
+                break
+    return findings
+
+
+def _unique(findings: List[Finding], *exposures: str, level: Optional[str] = None) -> List[str]:
+    return list(dict.fromkeys(f.label for f in findings
+                              if f.exposure in exposures and (level is None or f.sensitivity.level == level)))
+
+
+def screen_compliance(sql: str, catalog: SchemaCatalog, registry: SensitivityRegistry) -> ComplianceVerdict:
+    """Decide locally when the rules are clear-cut; "needs_review" asks the LLM to decide"""
+    statements = [s for s in sqlparse.split(sql) if s.strip().rstrip(";").strip()]
+    if len(statements) != 1 or not is_select(statements[0]):
+        return ComplianceVerdict("needs_review", reasons=["Only single read-only SELECT statements are pre-screened"])
+    try:
+        findings = find_exposures(statements[0], catalog, registry)
+    except Exception as e:  # sqlparse copes with most input, but never block on the pre-screen
+        return ComplianceVerdict("needs_review", reasons=[f"Could not analyze the query: {e}"])
+
+    verdict = ComplianceVerdict("compliant", findings)
+    restricted_out = _unique(findings, "output", level="restricted")
+    lookups = _unique(findings, "lookup", level="restricted")
+    restricted_nested = _unique(findings, "subquery", level="restricted")
+    dates = list(dict.fromkeys(f.label for f in findings if f.sensitivity.tag == "event_date"))
+    confidential = [label for label in _unique(findings, "output", "subquery", level="confidential")
+                    if label not in dates]
+    internal = _unique(findings, "output", "subquery", level="internal")
+    if restricted_out:
+        verdict.reasons.append(f"❌ Patient identifiers returned row by row: {', '.join(restricted_out)}; "
+                               "aggregate them (e.g. COUNT(DISTINCT ...)) instead")
+    if lookups:
+        verdict.reasons.append(f"❌ Filters single out individual patients: {', '.join(lookups)}")
+    if restricted_nested:
+        verdict.reasons.append(f"❔ Patient identifiers selected in a subquery: {', '.join(restricted_nested)}")
+    if confidential:
+        verdict.reasons.append(f"❔ Contact or location details returned: {', '.join(confidential)}")
+    if dates:
+        verdict.reasons.append(f"❔ Day-level dates of patient records returned row by row (quasi-identifiers "
+                               f"even without a patient ID): {', '.join(dates)}; group or truncate them to the year")
+    if internal:
+        verdict.reasons.append(f"ℹ️ Provider identity returned (public NPI registry data): {', '.join(internal)}")
+    if restricted_out or lookups:
+        verdict.status = "non_compliant"
+    elif restricted_nested or confidential or dates:
+        verdict.status = "needs_review"
+    return verdict
+
+
+def parse_compliance_text(text: str) -> str:
+    """Status from a free-text LLM report; "non-compliant" must never read as "compliant" """
+    lowered = text.lower()
+    if re.search(r"non[\s-]?compliant|not compliant|\bviolations?\b(?! found)|\bfail(ed|s)?\b", lowered):
+        if not re.search(r"\bno (compliance |privacy )?violations?\b", lowered):
+            return "non_compliant"
+    if re.search(r"\bcompliant\b", lowered):
+        return "compliant"
+    return "needs_review"
@@ -0,0 +1,129 @@
+"""
+Thread-safe, read-only SQLite connection pool shared by the db_simulator entry points
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator
+
+# PRAGMAs applied to every pooled connection. The analytics database is only
+# ever read by the app, so connections are opened read-only and query_only is
+# enforced as a second line of defence against generated DML.
+READ_PRAGMAS = {
+    "mmap_size": 256 * 1024 * 1024,   # map up to 256 MB of the file
+    "cache_size": -64 * 1024,          # 64 MB page cache per connection
+    "temp_store": "MEMORY",
+    "query_only": "ON",
+}
+
+DEFAULT_POOL_SIZE = 8
+
+
+class SQLiteConnectionPool:
+    """Fixed-size pool of read-only connections to a single SQLite file"""
+
+    def __init__(self, db_path: str, size: int = DEFAULT_POOL_SIZE, timeout: float = 30.0):
+        self.db_path = db_path
+        self.size = size
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self.journal_mode = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if not os.path.exists(self.db_path):
+            # mode=ro would fail with a vague "unable to open database file"
+            raise sqlite3.OperationalError(f"Database file '{self.db_path}' does not exist.")
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=self.timeout)
+        # WAL can only be switched on by a writer; when the file already uses it
+        # readers get concurrent access for free, so only report the mode here.
+        self.journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        for pragma, value in READ_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Take an idle connection, opening a new one while under the pool size"""
+        if self._closed:
+            raise RuntimeError("Connection pool is closed")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get(timeout=self.timeout)
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        """Return a connection to the pool, rolling back any open read transaction"""
+        if self._closed:
+            conn.close()
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (sqlite3.Error, queue.Full):
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+    def open_dedicated(self) -> sqlite3.Connection:
+        """A read-only connection outside the pool, for a cursor that outlives one call; the
+        caller closes it"""
+        return self._connect()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = 0
+
+
+_pools: Dict[str, SQLiteConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(db_path: str, size: int = DEFAULT_POOL_SIZE) -> SQLiteConnectionPool:
+    """Return the process-wide pool for db_path, creating it on first use"""
+    key = os.path.abspath(db_path)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = SQLiteConnectionPool(db_path, size=size)
+                _pools[key] = pool
+    return pool
+
+
+def close_all_pools() -> None:
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -0,0 +1,240 @@
+"""
+Pre-execution cost guard: estimates how many rows a query will visit from its
+EXPLAIN QUERY PLAN and the catalog's row counts, and decides to allow, auto-LIMIT or reject
+"""
+
+import math
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from sqlparse import tokens as T
+
+from utils.query_engine import PlanStep, is_select
+from utils.schema_catalog import SchemaCatalog
+from utils.sql_tokens import CLAUSES, is_word, norm_identifier, significant_tokens
+
+DEFAULT_LIMIT_COST = 1_000_000
+DEFAULT_REJECT_COST = 100_000_000
+DEFAULT_AUTO_LIMIT = 1000
+LARGE_TABLE_ROWS = 10_000
+
+# SQLite's own assumption for an equality lookup on an index without sqlite_stat1
+SEARCH_EQUALITY_ROWS = 10
+
+_CONTAINER = re.compile(r"^(CORRELATED )?(CO-ROUTINE|MATERIALIZE|SCALAR SUBQUERY|LIST SUBQUERY|"
+                        r"SUBQUERY|COMPOUND QUERY|LEFT-MOST SUBQUERY|UNION|MULTI-INDEX OR)\b\s*(\S*)")
+_TRAILING_LIMIT = re.compile(r"(?is)\blimit\s+\d+(\s*(,|offset)\s*\d+)?\s*;?\s*$")
+
+
+@dataclass
+class CostVerdict:
+    """Guard decision; sql is what should run (auto-limited when action == 'limit')"""
+    action: str                      # "allow", "limit" or "reject"
+    sql: str
+    estimated_cost: float
+    reasons: List[str] = field(default_factory=list)
+    plan: List[PlanStep] = field(default_factory=list)
+
+    @property
+    def allowed(self) -> bool:
+        return self.action != "reject"
+
+    @property
+    def summary(self) -> str:
+        label = {"allow": "Allowed", "limit": "Auto-limited", "reject": "Rejected"}[self.action]
+        return f"{label}: ~{self.estimated_cost:,.0f} estimated row visits"
+
+
+def _target(detail: str) -> str:
+    """Table or alias named by a SCAN/SEARCH step"""
+    name = re.sub(r"^(SCAN|SEARCH)\s+", "", detail)
+    return re.split(r"\s+(?:AS|USING|VIRTUAL)\b", name)[0].strip()
+
+
+def _step_rows(step: PlanStep, rows: int) -> Tuple[float, float]:
+    """(rows produced per outer loop, one-off setup cost) for a SCAN/SEARCH step"""
+    detail = step.detail
+    if detail.startswith("SCAN"):
+        return float(rows), 0.0
+    setup = float(rows) if "AUTOMATIC" in detail else 0.0
+    if re.search(r"[<>]", detail):
+        return max(1.0, rows / 4), setup
+    if "=" in detail:
+        return float(min(rows, SEARCH_EQUALITY_ROWS)), setup
+    return max(1.0, rows / 10), setup
+
+
+@dataclass
+class _Scope:
+    """One SELECT: what its FROM items read and which of them equality predicates link"""
+    depth: int
+    clause: Optional[str] = None
+    references: Dict[str, str] = field(default_factory=dict)     # alias/name -> table, CTE or subquery
+    links: List[Tuple[str, str]] = field(default_factory=list)
+    expect_alias: Optional[str] = None                            # FROM item that may get an alias next
+
+
+def _from_references(sql: str, catalog: SchemaCatalog) -> List[_Scope]:
+    """FROM items of every SELECT in sql, with CTE and subquery names kept as their own sources
+    (the plan names MATERIALIZE t and SCAN a for `WITH t AS (...) ... FROM t a`)"""
+    tables = {norm_identifier(t.name): t.name for t in catalog.tables}
+    columns = {t.name: {norm_identifier(c.name) for c in t.columns} for t in catalog.tables}
+    leaves = significant_tokens(sql)
+    scopes: List[_Scope] = []
+    stack: List[_Scope] = []
+    ctes: Dict[str, str] = {}
+    with_depth: Optional[int] = None
+    subquery_alias: Optional[int] = None   # depth whose FROM just closed a subquery
+    depth = 0
+
+    def resolve(qualifier: Optional[str], name: str) -> Optional[str]:
+        scope = stack[-1]
+        if qualifier is not None:
+            return norm_identifier(qualifier) if norm_identifier(qualifier) in scope.references else None
+        owners = [ref for ref, source in scope.references.items() if norm_identifier(name) in columns.get(source, ())]
+        return owners[0] if len(owners) == 1 else None
+
+    for i, token in enumerate(leaves):
+        word = token.normalized.upper() if token.is_keyword else None
+        if token.match(T.Punctuation, "("):
+            depth += 1
+        elif token.match(T.Punctuation, ")"):
+            depth -= 1
+            while stack and stack[-1].depth > depth:
+                stack.pop()
+            if stack and stack[-1].depth == depth and stack[-1].clause == "from":
+                subquery_alias = depth
+        elif word == "WITH":
+            with_depth = depth
+        elif word == "SELECT":
+            if with_depth == depth:
+                with_depth = None
+            stack.append(_Scope(depth))
+            scopes.append(stack[-1])
+        elif with_depth == depth and is_word(token) and word not in ("AS", "RECURSIVE"):
+            ctes[norm_identifier(token.value)] = token.value.strip('"`[]')
+        elif stack and stack[-1].clause in ("where", "on") and token.value in ("=", "==") and 0 < i < len(leaves) - 1:
+            left_qualifier = leaves[i - 3].value if i >= 3 and leaves[i - 2].match(T.Punctuation, ".") else None
+            right_qualifier = leaves[i + 1].value if i + 3 < len(leaves) and leaves[i + 2].match(T.Punctuation, ".") else None
+            right_token = leaves[i + 3] if right_qualifier is not None else leaves[i + 1]
+            left = resolve(left_qualifier, leaves[i - 1].value) if is_word(leaves[i - 1]) else None
+            right = resolve(right_qualifier, right_token.value) if is_word(right_token) else None
+            if left and right:
+                stack[-1].links.append((left, right))
+        elif stack and stack[-1].depth == depth:
+            scope = stack[-1]
+            if word and (word in CLAUSES or word.endswith("JOIN")):
+                scope.clause = "from" if word.endswith("JOIN") else CLAUSES[word]
+                scope.expect_alias, subquery_alias = None, None
+            elif scope.clause != "from" or word == "AS":
+                continue
+            elif token.match(T.Punctuation, ","):
+                scope.expect_alias = None
+            elif subquery_alias == depth and is_word(token):
+                scope.references[norm_identifier(token.value)] = token.value.strip('"`[]')
+                subquery_alias = None
+            elif is_word(token) and scope.expect_alias is None:
+                source = tables.get(norm_identifier(token.value)) or ctes.get(norm_identifier(token.value))
+                if source:
+                    scope.references[norm_identifier(token.value)] = source
+                    scope.expect_alias = norm_identifier(token.value)
+            elif is_word(token):
+                # Once aliased, the item is known by its alias only
+                scope.references[norm_identifier(token.value)] = scope.references.pop(scope.expect_alias)
+                scope.expect_alias = None
+    return scopes
+
+
+def estimate_plan_cost(plan: List[PlanStep], table_rows: Dict[str, int],
+                       aliases: Optional[Dict[str, str]] = None) -> Tuple[float, List[str]]:
+    """Row visits for plan: loops at one level multiply, subqueries add (or multiply when
+    correlated), and temp B-trees cost n·log n over the rows they sort. aliases maps the
+    names plans use to the table, CTE or subquery they read"""
+    children: Dict[int, List[PlanStep]] = defaultdict(list)
+    for step in plan:
+        children[step.parent].append(step)
+    notes: List[str] = []
+    derived_rows: Dict[str, float] = {}
+
+    def level(parent: int) -> Tuple[float, float]:
+        loop, extra, sorts = 1.0, 0.0, 0
+        for step in children.get(parent, []):
+            container = _CONTAINER.match(step.detail)
+            if step.detail.startswith(("SCAN", "SEARCH")):
+                target = _target(step.detail)
+                table = (aliases or {}).get(target.lower(), target)
+                rows = table_rows.get(target.lower())
+                if rows is None:
+                    rows = derived_rows.get(target.lower(), derived_rows.get(table.lower(), SEARCH_EQUALITY_ROWS))
+                per_loop, setup = _step_rows(step, int(rows))
+                if step.is_full_scan and rows >= LARGE_TABLE_ROWS:
+                    notes.append(f"Full scan of {table} (~{rows:,} rows)")
+                loop *= max(per_loop, 1.0)
+                extra += setup
+            elif container:
+                cost, rows = level(step.id)
+                extra += cost * loop if container.group(1) else cost
+                if container.group(3):
+                    derived_rows[container.group(3).lower()] = rows
+            elif step.uses_temp_btree:
+                sorts += 1
+                notes.append(step.detail.capitalize().replace("b-tree", "B-tree"))
+        return loop + extra + sorts * loop * math.log2(loop + 1), loop
+
+    cost, _ = level(0)
+    return cost, notes
+
+
+def _disconnected_tables(sql: str, scopes: List[_Scope]) -> List[str]:
+    """FROM items (tables, CTEs or subqueries) with no join predicate linking them to the
+    first one in the same SELECT (a cartesian product)"""
+    if re.search(r"(?i)\bnatural\s+join\b|\busing\s*\(", sql):
+        return []
+    disconnected = []
+    for scope in scopes:
+        references = list(scope.references)
+        if len(references) < 2:
+            continue
+        edges = defaultdict(set)
+        for left, right in scope.links:
+            edges[left].add(right)
+            edges[right].add(left)
+        seen, stack = {references[0]}, [references[0]]
+        while stack:
+            for neighbour in edges[stack.pop()] - seen:
+                seen.add(neighbour)
+                stack.append(neighbour)
+        for reference in references:
+            if reference not in seen:
+                source = scope.references[reference]
+                disconnected.append(source if norm_identifier(source) == reference else f"{source} AS {reference}")
+    return disconnected
+
+
+def assess_query(sql: str, plan: List[PlanStep], catalog: SchemaCatalog,
+                 limit_cost: float = DEFAULT_LIMIT_COST, reject_cost: float = DEFAULT_REJECT_COST,
+                 auto_limit: Optional[int] = DEFAULT_AUTO_LIMIT) -> CostVerdict:
+    """Reject cartesian products and anything above reject_cost; cap unbounded results
+    above limit_cost with a LIMIT; allow the rest"""
+    if not is_select(sql):
+        return CostVerdict("allow", sql, 0.0, plan=plan)
+    table_rows = {t.name.lower(): t.row_count or 0 for t in catalog.tables}
+    scopes = _from_references(sql, catalog)
+    aliases = {alias: source for scope in scopes for alias, source in scope.references.items()}
+    for alias, source in aliases.items():
+        if source.lower() in table_rows:
+            table_rows.setdefault(alias, table_rows[source.lower()])
+    cost, reasons = estimate_plan_cost(plan, table_rows, aliases)
+
+    disconnected = _disconnected_tables(sql, scopes)
+    if disconnected:
+        reasons.insert(0, f"No join predicate for {', '.join(disconnected)} (cartesian product)")
+    if cost >= reject_cost or (disconnected and cost >= limit_cost):
+        return CostVerdict("reject", sql, cost, reasons, plan)
+    if cost >= limit_cost and auto_limit and not _TRAILING_LIMIT.search(sql):
+        limited = f"SELECT * FROM (\n{sql.strip().rstrip(';').strip()}\n) LIMIT {int(auto_limit)}"
+        reasons.append(f"Result capped at {auto_limit:,} rows")
+        return CostVerdict("limit", limited, cost, reasons, plan)
+    return CostVerdict("allow", sql, cost, reasons, plan)
@@ -1,8 +1,53 @@
+import os
 import sqlite3
 import pandas as pd
+from typing import Dict, List, Optional, Tuple, Union
+from utils.columnar import choose_engine, execute_columnar
+from utils.compliance import ComplianceVerdict, SensitivityRegistry, build_registry, screen_compliance
+from utils.connection_pool import get_pool
+from utils.cost_guard import CostVerdict, assess_query
+from utils.dialect import Target, Translation, local_target, translate_sql
+from utils.execution_service import Job, get_execution_service
+from utils.exporters import export_to_tempfile
+from utils.index_advisor import QUERY_LOG
+from utils.query_engine import (
+    DEFAULT_PAGE_SIZE, CancelToken, PlanStep, QueryBudget, QueryHandle, QueryInterrupted, QueryPager,
+    QueryResult, QueryTimeout, execute_query, explain_plan, submit_query,
+)
+from utils.rollups import RoutingStats, fresh_rollups, rewrite_query
+from utils.schema_catalog import load_catalog
+from utils.sql_validator import ValidationReport, validate_sql
 
 DB_PATH = "dataset/data.sqlite"
 
+# Planner-based guard thresholds, in estimated row visits
+QUERY_COST_LIMIT = float(os.getenv("QUERY_COST_LIMIT", "1000000"))
+QUERY_COST_REJECT = float(os.getenv("QUERY_COST_REJECT", "100000000"))
+QUERY_AUTO_LIMIT = int(os.getenv("QUERY_AUTO_LIMIT", "1000"))
+
+# Every query runs under this budget unless the caller passes its own; 0 disables a limit
+DEFAULT_BUDGET = QueryBudget(
+    timeout=float(os.getenv("QUERY_TIMEOUT", "30")) or None,
+    max_vm_steps=int(os.getenv("QUERY_MAX_VM_STEPS", "0")) or None,
+)
+# Full exports read every row, so they get a longer clock but the same step limit
+EXPORT_BUDGET = QueryBudget(
+    timeout=float(os.getenv("EXPORT_TIMEOUT", "300")) or None,
+    max_vm_steps=DEFAULT_BUDGET.max_vm_steps,
+)
+
+# "process": submit_sql runs on the shared worker-process pool (utils.execution_service);
+# "thread": on a background thread of this process
+QUERY_EXECUTION = os.getenv("QUERY_EXECUTION", "process")
+
+# Aggregates the materialized rollups can answer exactly are run against them while they are
+# fresh (python -m utils.rollups builds and refreshes them); ROLLUP_ROUTING=0 always reads the base tables
+ROLLUP_ROUTING = os.getenv("ROLLUP_ROUTING", "1") == "1"
+ROLLUP_STATS = RoutingStats()
+# Generated SQL is mapped onto this database's table/column names and SQLite dialect before it
+# runs (utils.dialect, needs sqlglot); SQL_TRANSLATION=0 runs it exactly as written
+SQL_TRANSLATION = os.getenv("SQL_TRANSLATION", "1") == "1"
+
 # def setup_sample_db():
 #     # Fixed: Use the correct DB_PATH instead of hardcoded filename
 #     conn = sqlite3.connect(DB_PATH)
@@ -184,8 +229,9 @@ DB_PATH = "dataset/data.sqlite"
 
 import re
 
-def run_query(query: str) -> str:
-# 1️⃣ Remove any leading/trailing junk (markdown fences, stray words, etc.)
+def clean_sql(query: str) -> str:
+    """Strip markdown fences and stray leading words from LLM-generated SQL"""
+    # 1️⃣ Remove any leading/trailing junk (markdown fences, stray words, etc.)
     query = re.sub(r'(?is)^\s*```(?:sql)?\s*', '', query)  # leading ```sql
     query = re.sub(r'(?is)\s*```\s*$', '', query)         # trailing ```
     query = query.strip()                                 # remove leading/trailing whitespace
@@ -194,83 +240,199 @@ def run_query(query: str) -> str:
     tokens = query.split()
     if tokens and tokens[0].lower() not in {"select", "insert", "update", "delete", "with"}:
         query = " ".join(tokens[1:]).lstrip()
+    return query
+
+_targets: Dict[str, Tuple[Dict[str, int], Target]] = {}
 
-    # 3️⃣ Execute the cleaned SQL
+def dialect_target(dialect: str = "sqlite") -> Target:
+    """Translation target for DB_PATH in dialect, rebuilt only when the catalog changes"""
+    catalog = load_catalog(DB_PATH)
+    cached = _targets.get(dialect)
+    if cached is None or cached[0] != catalog.fingerprint:
+        cached = _targets[dialect] = (catalog.fingerprint, local_target(catalog, dialect))
+    return cached[1]
+
+def translate_query(query: str) -> Translation:
+    """The cleaned query with warehouse/UI table names and foreign dialect mapped onto DB_PATH"""
+    sql = clean_sql(query)
+    if not SQL_TRANSLATION:
+        return Translation(sql)
     try:
-        import sqlite3, pandas as pd
-        conn = sqlite3.connect("dataset/data.sqlite")
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        return df.head().to_string(index=False)
+        return translate_sql(sql, dialect_target())
+    except Exception as e:
+        return Translation(sql, error=str(e))  # translation is a convenience; the SQL still runs as written
+
+def normalize_sql(query: str) -> str:
+    """clean_sql plus dialect translation: what the agents hand on for validation and execution"""
+    return translate_query(query).sql
+
+def _log_outcome(sql: str, elapsed_ms: float, result: Optional[QueryResult] = None,
+                 error: Optional[BaseException] = None) -> None:
+    """Feed the index advisor (python -m utils.index_advisor), including partial timings"""
+    if result is not None:
+        QUERY_LOG.record(sql, result.elapsed_ms)
+    elif isinstance(error, QueryInterrupted):
+        QUERY_LOG.record(sql, error.elapsed_ms, "timeout" if isinstance(error, QueryTimeout) else "cancelled")
+    else:
+        QUERY_LOG.record(sql, elapsed_ms, "error")
+
+def route_query(sql: str) -> str:
+    """The SQL to actually run for cleaned sql: rewritten onto a fresh rollup when one covers it"""
+    if not ROLLUP_ROUTING:
+        return sql
+    try:
+        catalog = load_catalog(DB_PATH)
+        rewrite = rewrite_query(sql, catalog, fresh_rollups(DB_PATH, catalog))
+    except Exception:
+        return sql  # routing is an optimization; the base tables always answer
+    ROLLUP_STATS.record(rewrite)
+    return rewrite.sql
+
+def query_engine(sql: str, engine: Optional[str] = None) -> str:
+    """"sqlite" or "duckdb" for cleaned sql (see utils.columnar.choose_engine; QUERY_ENGINE sets the default)"""
+    return choose_engine(DB_PATH, sql, load_catalog(DB_PATH), engine)
+
+def _plan(sql: str, engine: Optional[str]):
+    """(SQL to run, executor): a fresh rollup beats an automatic engine choice, not a forced one"""
+    chosen = query_engine(sql, engine)
+    if chosen == "duckdb" and (engine or os.getenv("QUERY_ENGINE", "auto")) == "duckdb":
+        return sql, execute_columnar
+    routed = route_query(sql)
+    if routed != sql or chosen == "sqlite":
+        return routed, execute_query
+    return sql, execute_columnar
+
+def execute_sql(query: str, max_rows: Optional[int] = DEFAULT_PAGE_SIZE, budget: Optional[QueryBudget] = None,
+                token: Optional[CancelToken] = None, engine: Optional[str] = None) -> QueryResult:
+    """Execute cleaned SQL and return a typed QueryResult (schema, column arrays, timing).
+
+    engine ("auto", "sqlite" or "duckdb") overrides QUERY_ENGINE for this query.
+    Raises QueryTimeout / QueryCancelled when the budget runs out or token is cancelled.
+    """
+    sql = clean_sql(query)
+    token = token or CancelToken()
+    try:
+        run_sql, execute = _plan(sql, engine)
+        result = execute(DB_PATH, run_sql, max_rows=max_rows, budget=budget or DEFAULT_BUDGET, token=token)
+    except Exception as e:
+        _log_outcome(sql, token.elapsed_ms, error=e)
+        raise
+    _log_outcome(sql, token.elapsed_ms, result)
+    return result
+
+def submit_sql(query: str, max_rows: Optional[int] = DEFAULT_PAGE_SIZE, budget: Optional[QueryBudget] = None,
+               user: str = "default", engine: Optional[str] = None) -> Union[Job, QueryHandle]:
+    """Like execute_sql, but off the calling thread so the caller can poll progress() and cancel.
+
+    With QUERY_EXECUTION=process SQLite queries join user's queue on the worker-process pool,
+    which runs at most QUERY_MAX_PER_USER of that user's queries at a time; DuckDB queries
+    run on a background thread, since DuckDB parallelizes each query itself.
+    """
+    sql = clean_sql(query)
+    run_sql, execute = _plan(sql, engine)
+    if execute is execute_query and QUERY_EXECUTION == "process":
+        handle = get_execution_service(DB_PATH).submit(user, run_sql, max_rows=max_rows,
+                                                       budget=budget or DEFAULT_BUDGET)
+    else:
+        handle = submit_query(DB_PATH, run_sql, max_rows=max_rows, budget=budget or DEFAULT_BUDGET, execute=execute)
+    handle.future.add_done_callback(
+        lambda f: _log_outcome(sql, handle.progress()["elapsed_ms"],
+                               None if f.exception() else f.result(), f.exception())
+    )
+    return handle
+
+def explain_query_plan(query: str) -> List[PlanStep]:
+    """EXPLAIN QUERY PLAN for the cleaned query, without executing it"""
+    with get_pool(DB_PATH).connection() as conn:
+        return explain_plan(conn, clean_sql(query))
+
+def check_query_cost(query: str) -> CostVerdict:
+    """Plan the cleaned query and allow, auto-LIMIT or reject it before anything runs"""
+    sql = clean_sql(query)
+    plan = explain_query_plan(sql)
+    return assess_query(sql, plan, load_catalog(DB_PATH), limit_cost=QUERY_COST_LIMIT,
+                        reject_cost=QUERY_COST_REJECT, auto_limit=QUERY_AUTO_LIMIT)
+
+def validate_query(query: str) -> ValidationReport:
+    """Deterministic schema validation of the cleaned query (compiled, never executed)"""
+    with get_pool(DB_PATH).connection() as conn:
+        return validate_sql(conn, clean_sql(query), load_catalog(DB_PATH))
+
+_registry: Optional[Tuple[Dict[str, int], SensitivityRegistry]] = None
+
+def sensitivity_registry() -> SensitivityRegistry:
+    """Column sensitivity tags for DB_PATH, rebuilt only when the catalog changes"""
+    global _registry
+    catalog = load_catalog(DB_PATH)
+    if _registry is None or _registry[0] != catalog.fingerprint:
+        _registry = (catalog.fingerprint, build_registry(catalog))
+    return _registry[1]
+
+def screen_query(query: str) -> ComplianceVerdict:
+    """Rule-based PHI/PII verdict for the cleaned query; nothing is executed"""
+    return screen_compliance(clean_sql(query), load_catalog(DB_PATH), sensitivity_registry())
+
+def run_query(query: str, engine: Optional[str] = None) -> str:
+    # 3️⃣ Execute the cleaned SQL, reading only the rows that are shown
+    try:
+        return execute_sql(query, max_rows=5, engine=engine).to_dataframe().to_string(index=False)
     except Exception as e:
         return f"Query failed: {e}"
 
+def create_pager(query: str, page_size: int = DEFAULT_PAGE_SIZE,
+                 first_result: Optional[QueryResult] = None) -> QueryPager:
+    """Return a lazy pager over the cleaned query; pages are fetched on demand"""
+    first_page = first_result.to_page(page_size) if first_result is not None else None
+    return QueryPager(DB_PATH, route_query(clean_sql(query)), page_size=page_size, first_page=first_page, budget=DEFAULT_BUDGET)
+
+def export_results(query: str, fmt: str, budget: Optional[QueryBudget] = None,
+                   token: Optional[CancelToken] = None) -> str:
+    """Stream the full result of query into a temporary CSV/JSONL/Parquet file and return its path;
+    raises QueryTimeout / QueryCancelled like execute_sql"""
+    return export_to_tempfile(DB_PATH, route_query(clean_sql(query)), fmt, budget=budget or EXPORT_BUDGET, token=token)
+
 def get_db_schema(db_path):
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        schema = ""
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        for table_name, in tables:
-            cursor.execute(f"SELECT sql FROM sqlite_master WHERE type='table' AND name='{table_name}';")
-            create_stmt = cursor.fetchone()[0]
-            schema += create_stmt + ";\n\n"
-        conn.close()
-        return schema
+        catalog = load_catalog(db_path)
+        return "".join(table.sql + ";\n\n" for table in catalog.tables)
     except Exception as e:
         return f"Error retrieving schema: {e}"
 
 def get_structured_schema(db_path):
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
         print("Retrieving structured schema...")
-        # Get all tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+        # Served from the on-disk catalog unless the database file changed
+        catalog = load_catalog(db_path)
         
-        if not tables:
+        if not catalog.tables:
             return "No tables found in the database. Make sure the database exists and has been created."
         
         lines = ["=== DATABASE SCHEMA ===\n"]
         
-        for table_name, in tables:
-            lines.append(f"TABLE: {table_name}")
-            lines.append("-" * (len(table_name) + 7))
-            
-            # Get detailed column information
-            cursor.execute(f'PRAGMA table_info("{table_name}")')
-            columns = cursor.fetchall()
+        for table in catalog.tables:
+            lines.append(f"TABLE: {table.name}")
+            lines.append("-" * (len(table.name) + 7))
             
-            for col in columns:
-                cid, name, data_type, not_null, default_value, pk = col
-                
+            for col in table.columns:
                 # Build column description
-                col_desc = f"  {name} {data_type}"
+                col_desc = f"  {col.name} {col.type}"
                 
-                if pk:
+                if col.pk:
                     col_desc += " PRIMARY KEY"
-                if not_null and not pk:
+                if col.not_null and not col.pk:
                     col_desc += " NOT NULL"
-                if default_value is not None:
-                    col_desc += f" DEFAULT {default_value}"
+                if col.default is not None:
+                    col_desc += f" DEFAULT {col.default}"
                     
                 lines.append(col_desc)
             
-            # Get foreign key constraints
-            cursor.execute(f'PRAGMA foreign_key_list("{table_name}")')
-            foreign_keys = cursor.fetchall()
-            
-            if foreign_keys:
+            if table.foreign_keys:
                 lines.append("  FOREIGN KEYS:")
-                for fk in foreign_keys:
-                    id, seq, table, from_col, to_col, on_update, on_delete, match = fk
-                    lines.append(f"    {from_col} -> {table}({to_col})")
+                for fk in table.foreign_keys:
+                    lines.append(f"    {fk.column} -> {fk.ref_table}({fk.ref_column})")
             
             lines.append("")  # Empty line between tables
         
-        conn.close()
         return '\n'.join(lines)
     
     except Exception as e:
@@ -283,11 +445,8 @@ def check_database_exists(db_path):
         return False, f"Database file '{db_path}' does not exist."
     
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        conn.close()
+        with get_pool(db_path).connection() as conn:
+            tables = conn.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()
         
         if not tables:
             return False, "Database file exists but contains no tables."
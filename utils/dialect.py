@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Dialect translation: generated SQL rewritten for the target engine's dialect and physical
+table/column names with sqlglot, deterministically and without another LLM round-trip.
+SchemaNotes and the UI call a table `default.as_lsf_v1` or `as_lsf_payments` where
+data.sqlite has "Payments to HCPs"; every known name of a table maps to the one that exists.
+Needs sqlglot (a declared dependency): the BOM-prefixed columns of data.sqlite only resolve
+through it; when it is missing SQL passes through unchanged with the error set
+
+Run from the project directory:
+    python -m utils.dialect "SELECT ... FROM default.as_lsf_v1" [--write duckdb | --warehouse]
+"""
+
+import argparse
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from utils.schema_catalog import SchemaCatalog
+from utils.schema_notes import NOTES_TABLES, SCHEMA_NOTES_PATH, notes_column_types
+
+# Dialect the agents are prompted to write; read with this parser before translating
+SOURCE_DIALECT = os.getenv("SQL_SOURCE_DIALECT", "sqlite")
+# The warehouse SchemaNotes documents: ClickHouse tables in the default database
+WAREHOUSE_DIALECT = os.getenv("SQL_WAREHOUSE_DIALECT", "clickhouse")
+WAREHOUSE_SCHEMA = os.getenv("SQL_WAREHOUSE_SCHEMA", "default")
+
+# Names the UI and older prompts use for an extract, besides its file and SchemaNotes names
+TABLE_ALIASES = {
+    "Payments to HCPs": ("as_lsf_payments",),
+    "Provider details": ("as_providers",),
+    "Referral patterns": ("as_providers_referrals",),
+    "Pharmacy claims": ("fct_pharmacy_claims",),
+}
+
+_SIMPLE_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+def name_key(name: str) -> str:
+    """Spelling-insensitive key: "Payments to HCPs" and payments_to_hcps agree, as do npi and the
+    BOM-prefixed, quoted first column name of an extract"""
+    return re.sub(r"[^0-9a-z]+", "_", name.replace("\ufeff", "").replace('"', "").lower()).strip("_")
+
+
+@dataclass
+class Target:
+    """Where translated SQL runs: its dialect plus every known table name -> (schema, physical table)"""
+    dialect: str
+    tables: Dict[str, Tuple[Optional[str], str]] = field(default_factory=dict)
+    columns: Dict[str, Dict[str, str]] = field(default_factory=dict)   # physical table -> key -> column
+
+
+def _file_name(table: str) -> str:
+    """The extract file a table was loaded from, whether it is named after the file or the notes"""
+    return next((f for f, notes in NOTES_TABLES.items() if notes == table), table)
+
+
+def _aliases(file_name: str) -> List[str]:
+    return [file_name, NOTES_TABLES.get(file_name, ""), *TABLE_ALIASES.get(file_name, ())]
+
+
+def local_target(catalog: SchemaCatalog, dialect: str = "sqlite") -> Target:
+    """The tables of this database (data.sqlite, or its DuckDB snapshot), under any of their names"""
+    target = Target(dialect)
+    for table in catalog.tables:
+        target.tables[name_key(table.name)] = (None, table.name)
+        target.columns[table.name] = {name_key(c.name): c.name for c in table.columns}
+    for table in catalog.tables:
+        for alias in _aliases(_file_name(table.name)):
+            if alias:
+                target.tables.setdefault(name_key(alias), (None, table.name))
+    return target
+
+
+def warehouse_target(notes_path: str = SCHEMA_NOTES_PATH) -> Target:
+    """The warehouse tables SchemaNotes documents (default.as_lsf_v1, ...) and their columns"""
+    target = Target(WAREHOUSE_DIALECT)
+    notes = notes_column_types(notes_path)
+    for file_name, notes_name in NOTES_TABLES.items():
+        if notes_name not in notes:
+            continue
+        for alias in _aliases(file_name):
+            target.tables.setdefault(name_key(alias), (WAREHOUSE_SCHEMA, notes_name))
+        target.columns[notes_name] = {name_key(c): c for c in notes[notes_name].types}
+    return target
+
+
+@dataclass
+class Translation:
+    sql: str
+    changes: List[str] = field(default_factory=list)
+    error: Optional[str] = None
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.changes)
+
+
+def _identifier(exp, name: str):
+    return exp.to_identifier(name, quoted=not _SIMPLE_IDENTIFIER.fullmatch(name))
+
+
+def translate_sql(sql: str, target: Target, read: str = SOURCE_DIALECT) -> Translation:
+    """Map table and column names onto target and render sql in its dialect.
+
+    Tables are matched by any known name (file, SchemaNotes, UI, any spelling); a column is
+    renamed only when it is not a column of its table(s) but matches exactly one of them up
+    to spelling. Returns the input untouched, with error set, when it cannot be parsed.
+    """
+    try:
+        import sqlglot
+        from sqlglot import exp
+    except ImportError:
+        return Translation(sql, error="sqlglot is not installed: pip install sqlglot")
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=read) if s is not None]
+    except sqlglot.errors.SqlglotError as e:
+        return Translation(sql, error=str(e).splitlines()[0])
+    if len(statements) != 1:
+        return Translation(sql, error="expected a single statement")
+    tree = statements[0]
+    changes = []
+
+    ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+    qualifiers = {c.table.lower() for c in tree.find_all(exp.Column) if c.table}
+    scopes: List[Tuple[set, Dict[str, str]]] = []     # (names a column may be qualified with, columns)
+    for table in tree.find_all(exp.Table):
+        if not table.name or (table.name.lower() in ctes and not table.db):
+            continue
+        mapped = target.tables.get(name_key(table.name))
+        if mapped is None:
+            continue
+        schema, physical = mapped
+        original = table.name
+        if (original, table.db or None) != (physical, schema):
+            changes.append(f"table {table.sql(dialect=read)} -> {'.'.join(filter(None, (schema, physical)))}")
+            table.set("this", _identifier(exp, physical))
+            table.set("db", _identifier(exp, schema) if schema else None)
+            table.set("catalog", None)
+            if not table.alias and original.lower() in qualifiers and original != physical:
+                table.set("alias", exp.TableAlias(this=_identifier(exp, original)))
+        names = {n.lower() for n in (table.alias, original, physical) if n}
+        scopes.append((names, target.columns.get(physical, {})))
+
+    renamed = {}
+    for column in list(tree.find_all(exp.Column)):
+        if isinstance(column.this, exp.Star) or not column.name:
+            continue
+        candidates = [cols for names, cols in scopes if not column.table or column.table.lower() in names]
+        if not candidates or any(column.name in cols.values() for cols in candidates):
+            continue
+        matches = {cols[name_key(column.name)] for cols in candidates if name_key(column.name) in cols}
+        if len(matches) == 1:
+            physical = matches.pop()
+            changes.append(f"column {column.name} -> {physical}")
+            renamed[id(column)] = column.name
+            column.set("this", _identifier(exp, physical))
+    # A renamed bare select column keeps the name the query asked for in the result
+    for select in tree.find_all(exp.Select):
+        for item in list(select.expressions):
+            if id(item) in renamed:
+                item.replace(exp.alias_(item.copy(), renamed[id(item)], quoted=None))
+    changes = list(dict.fromkeys(changes))
+
+    if not changes and target.dialect == read:
+        return Translation(sql)
+    if target.dialect != read:
+        changes.append(f"dialect {read} -> {target.dialect}")
+    return Translation(tree.sql(dialect=target.dialect), changes)
+
+
+def main():
+    from utils.db_simulator import DB_PATH
+    from utils.schema_catalog import load_catalog
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("sql")
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--read", default=SOURCE_DIALECT)
+    parser.add_argument("--write", default="sqlite", help="Dialect of the local engine (sqlite, duckdb)")
+    parser.add_argument("--warehouse", action="store_true", help="Translate for the SchemaNotes warehouse instead")
+    args = parser.parse_args()
+
+    target = warehouse_target() if args.warehouse else local_target(load_catalog(args.db), args.write)
+    translation = translate_sql(args.sql, target, read=args.read)
+    if translation.error:
+        print(f"⚠️  {translation.error}")
+    for change in translation.changes:
+        print(f"🔁 {change}")
+    print(translation.sql)
+
+
+if __name__ == "__main__":
+    main()
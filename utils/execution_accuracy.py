@@ -0,0 +1,85 @@
+"""
+Execution accuracy for NL->SQL: a predicted query is correct when its result set matches the
+gold result, regardless of column names, column order, extra columns or (unless the
+question asks for an ordering) row order
+"""
+
+import itertools
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+FLOAT_DIGITS = 4
+
+
+@dataclass
+class Match:
+    correct: bool
+    reason: str = ""
+
+
+def normalize_value(value: Any) -> Any:
+    """1 == 1.0 and float noise below FLOAT_DIGITS is ignored; text is stripped"""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        rounded = round(float(value), FLOAT_DIGITS)
+        return 0.0 if rounded == 0 else rounded
+    if isinstance(value, bytes):
+        return value.hex()
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+
+def _column(rows: Sequence[Sequence[Any]], index: int) -> Counter:
+    return Counter(row[index] for row in rows)
+
+
+def _mappings(predicted: List[Tuple], expected: List[Tuple], width: int, expected_width: int):
+    """Assignments expected column -> predicted column whose value multisets agree"""
+    candidates = [[p for p in range(width) if _column(predicted, p) == _column(expected, e)]
+                  for e in range(expected_width)]
+    if any(not c for c in candidates):
+        return
+    for combo in itertools.product(*candidates):
+        if len(set(combo)) == len(combo):
+            yield combo
+
+
+def compare_results(predicted_rows: Sequence[Sequence[Any]], expected_rows: Sequence[Sequence[Any]],
+                    order_by: Sequence[int] = (), allow_extra_columns: bool = True) -> Match:
+    """Compare two result sets.
+
+    order_by lists expected column indexes whose sequence must match (the ORDER BY keys);
+    rows tied on those keys may come in any order. Extra predicted columns are accepted by
+    default, since a model often adds a label column next to the asked-for values.
+    """
+    predicted = [tuple(normalize_value(v) for v in row) for row in predicted_rows]
+    expected = [tuple(normalize_value(v) for v in row) for row in expected_rows]
+    if len(predicted) != len(expected):
+        return Match(False, f"{len(predicted)} rows, expected {len(expected)}")
+    if not expected:
+        return Match(True)
+    width, expected_width = len(predicted[0]), len(expected[0])
+    if width < expected_width or (width > expected_width and not allow_extra_columns):
+        return Match(False, f"{width} columns, expected {expected_width}")
+
+    target = Counter(expected)
+    for combo in _mappings(predicted, expected, width, expected_width):
+        projected = [tuple(row[p] for p in combo) for row in predicted]
+        if Counter(projected) != target:
+            continue
+        if order_by and [tuple(r[k] for k in order_by) for r in projected] != \
+                [tuple(r[k] for k in order_by) for r in expected]:
+            return Match(False, "right rows in the wrong order")
+        return Match(True)
+    return Match(False, "values differ")
+
+
+def score_result(result: Optional[Any], expected: Dict[str, Any]) -> Match:
+    """Score a QueryResult (or None after a failed run) against a gold {"columns", "rows", "order_by"}"""
+    if result is None:
+        return Match(False, "no result")
+    order_by = [expected["columns"].index(c) for c in expected.get("order_by", ())]
+    return compare_results(result.rows(), expected["rows"], order_by)
@@ -0,0 +1,265 @@
+"""
+Out-of-process query execution: a process pool behind a per-user job queue, with live
+progress and results handed back as Arrow IPC in shared memory instead of pickled frames
+"""
+
+import itertools
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+import types
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from multiprocessing import shared_memory
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from utils.query_engine import (
+    DEFAULT_BATCH_SIZE, CancelToken, QueryBudget, QueryCancelled, QueryResult, execute_query,
+)
+
+DEFAULT_WORKERS = max(2, min(4, os.cpu_count() or 2))
+DEFAULT_PER_USER = 2
+PROGRESS_INTERVAL = 0.1
+
+
+# ---------- worker side ----------
+def _pack_result(result: QueryResult) -> Tuple[str, Any]:
+    """Write the columns as one Arrow IPC stream into a shared-memory block; the parent
+    maps it instead of unpickling a large frame"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return "pickle", result
+    try:
+        table = pa.Table.from_arrays([pa.array(result.data[c]) for c in result.columns], names=result.columns)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # A column mixing SQLite storage classes has no Arrow type; keep the values exact
+        return "pickle", result
+    # Size the stream first, then serialize straight into the shared block
+    sizer = pa.MockOutputStream()
+    with pa.ipc.new_stream(sizer, table.schema) as writer:
+        writer.write_table(table)
+    size = sizer.size()
+    block = shared_memory.SharedMemory(create=True, size=max(1, size))
+    try:
+        target = pa.py_buffer(block.buf)
+        sink = pa.FixedSizeBufferWriter(target)
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        sink.close()
+        del writer, sink, target  # release the exported view so the block can be closed
+    except BaseException:
+        block.close()
+        block.unlink()
+        raise
+    block.close()
+    meta = {
+        "column_types": result.column_types,
+        "row_count": result.row_count,
+        "elapsed_ms": result.elapsed_ms,
+        "truncated": result.truncated,
+    }
+    return "arrow", (block.name, size, meta)
+
+
+def _run_job(job_id: int, db_path: str, sql: str, max_rows: Optional[int], budget: Optional[QueryBudget],
+             cancel_event, progress) -> Tuple[str, Any]:
+    """Executed in a pool process; reports progress and honours cancellation every 100 ms"""
+    token = CancelToken()
+    finished = threading.Event()
+
+    def report():
+        while not finished.wait(PROGRESS_INTERVAL):
+            if cancel_event.is_set():
+                token.cancel()
+            try:
+                progress[job_id] = {"elapsed_ms": token.elapsed_ms, "vm_steps": token.vm_steps, "rows": token.rows}
+            except Exception:
+                return  # manager gone: the parent is shutting down
+
+    watcher = threading.Thread(target=report, daemon=True)
+    watcher.start()
+    try:
+        if cancel_event.is_set():
+            raise QueryCancelled("Query cancelled", 0.0, 0, 0)
+        result = execute_query(db_path, sql, max_rows, DEFAULT_BATCH_SIZE, budget, token)
+    finally:
+        finished.set()
+        watcher.join()
+    return _pack_result(result)
+
+
+# ---------- server side ----------
+@contextmanager
+def _bare_main():
+    """Spawned processes re-run the parent's __main__ file, which under Streamlit is the app
+    script itself; the workers only need this module, so launch them against an empty one"""
+    main = sys.modules.get("__main__")
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+
+def _unpack_result(kind: str, payload: Any) -> QueryResult:
+    if kind == "pickle":
+        return payload
+    import pyarrow as pa
+
+    name, size, meta = payload
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        # Arrow reads the block in place; to_pylist() copies out before it is released
+        source = pa.py_buffer(block.buf[:size])
+        reader = pa.ipc.open_stream(source)
+        table = reader.read_all()
+        columns = table.column_names
+        data = {name: column.to_pylist() for name, column in zip(columns, table.columns)}
+        del table, reader, source
+    finally:
+        block.close()
+        block.unlink()
+    return QueryResult(
+        columns=columns,
+        column_types=meta["column_types"],
+        data=data,
+        row_count=meta["row_count"],
+        elapsed_ms=meta["elapsed_ms"],
+        truncated=meta["truncated"],
+    )
+
+
+@dataclass
+class Job:
+    """A queued or running query; same polling surface as query_engine.QueryHandle"""
+    id: int
+    user: str
+    sql: str
+    service: "ExecutionService"
+    future: Future = field(default_factory=Future)
+    cancel_event: Any = None
+    status: str = "queued"           # queued, running, done, failed, cancelled
+    submitted: float = field(default_factory=time.perf_counter)
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def result(self, timeout: Optional[float] = None) -> QueryResult:
+        return self.future.result(timeout)
+
+    def cancel(self) -> None:
+        self.service.cancel(self)
+
+    def progress(self) -> Dict[str, float]:
+        stats = dict(self.service.progress_of(self))
+        if self.status == "queued":
+            stats["queued_ms"] = (time.perf_counter() - self.submitted) * 1000
+        return stats
+
+
+class ExecutionService:
+    """Process pool plus a FIFO job queue that admits at most per_user running jobs per user"""
+
+    def __init__(self, db_path: str, max_workers: int = DEFAULT_WORKERS, per_user: int = DEFAULT_PER_USER):
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.per_user = per_user
+        # spawn: forking the threaded Streamlit server is unsafe
+        context = mp.get_context("spawn")
+        self._pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        with _bare_main():
+            self._manager = context.Manager()
+        self._progress = self._manager.dict()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._queued: Dict[str, Deque[Tuple[Job, Optional[int], Optional[QueryBudget]]]] = {}
+        self._running: Dict[str, int] = {}
+
+    def submit(self, user: str, sql: str, max_rows: Optional[int] = None,
+               budget: Optional[QueryBudget] = None) -> Job:
+        job = Job(id=next(self._ids), user=user, sql=sql, service=self,
+                  cancel_event=self._manager.Event())
+        with self._lock:
+            self._queued.setdefault(user, deque()).append((job, max_rows, budget))
+        self._dispatch(user)
+        return job
+
+    def _dispatch(self, user: str) -> None:
+        with self._lock:
+            queue = self._queued.get(user)
+            while queue and self._running.get(user, 0) < self.per_user:
+                job, max_rows, budget = queue.popleft()
+                if job.status == "cancelled":
+                    continue
+                self._running[user] = self._running.get(user, 0) + 1
+                job.status = "running"
+                with _bare_main():  # workers start lazily on submit
+                    future = self._pool.submit(_run_job, job.id, self.db_path, job.sql, max_rows, budget,
+                                               job.cancel_event, self._progress)
+                future.add_done_callback(lambda f, job=job: self._finish(job, f))
+
+    def _finish(self, job: Job, future: Future) -> None:
+        try:
+            job.future.set_result(_unpack_result(*future.result()))
+            job.status = "done"
+        except QueryCancelled as e:
+            job.status = "cancelled"
+            job.future.set_exception(e)
+        except BaseException as e:
+            job.status = "failed"
+            job.future.set_exception(e)
+        finally:
+            self._progress.pop(job.id, None)
+            with self._lock:
+                self._running[job.user] -= 1
+            self._dispatch(job.user)
+
+    def cancel(self, job: Job) -> None:
+        with self._lock:
+            if job.status == "queued":
+                job.status = "cancelled"
+                queue = self._queued.get(job.user, ())
+                for entry in [entry for entry in queue if entry[0] is job]:
+                    queue.remove(entry)
+                job.future.set_exception(QueryCancelled("Query cancelled before it started", 0.0, 0, 0))
+                return
+        job.cancel_event.set()
+
+    def progress_of(self, job: Job) -> Dict[str, float]:
+        return self._progress.get(job.id, {"elapsed_ms": 0.0, "vm_steps": 0, "rows": 0})
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "running": sum(self._running.values()),
+                "queued": sum(len(q) for q in self._queued.values()),
+                "workers": self.max_workers,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._manager.shutdown()
+
+
+_services: Dict[str, ExecutionService] = {}
+_services_lock = threading.Lock()
+
+
+def get_execution_service(db_path: str) -> ExecutionService:
+    """Process-wide service per database file, started on first use"""
+    key = os.path.abspath(db_path)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = ExecutionService(
+                db_path,
+                max_workers=int(os.getenv("QUERY_WORKERS", str(DEFAULT_WORKERS))),
+                per_user=int(os.getenv("QUERY_MAX_PER_USER", str(DEFAULT_PER_USER))),
+            )
+            _services[key] = service
+        return service
@@ -0,0 +1,172 @@
+"""
+Chunked result exporters that write CSV, JSONL and Parquet straight from the SQLite cursor,
+under the same QueryBudget and CancelToken as every other query path
+"""
+
+import csv
+import io
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Union
+
+from utils.connection_pool import get_pool
+from utils.query_engine import DEFAULT_BATCH_SIZE, CancelToken, QueryBudget, budgeted, stream_rows, unique_columns
+
+Destination = Union[str, os.PathLike, io.IOBase]
+
+
+@contextmanager
+def _open_destination(dest: Destination, binary: bool) -> Iterator[io.IOBase]:
+    """Open a path for writing, or pass an already-open file object through untouched"""
+    if isinstance(dest, (str, os.PathLike)):
+        mode = "wb" if binary else "w"
+        kwargs = {} if binary else {"encoding": "utf-8", "newline": ""}
+        with open(dest, mode, **kwargs) as fh:
+            yield fh
+    else:
+        yield dest
+
+
+def _json_default(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def _infer_arrow_type(pa, values):
+    """Arrow type of the first batch; all-NULL columns fall back to string"""
+    inferred = pa.array(values).type
+    return pa.string() if inferred == pa.null() else inferred
+
+
+class _SchemaMismatch(Exception):
+    """A later batch does not fit a column's Arrow type; the export restarts with it widened"""
+
+    def __init__(self, column: str, widened):
+        super().__init__(column)
+        self.column = column
+        self.widened = widened
+
+
+def _widen(pa, arrow_type, values):
+    """Integers that meet floats widen to float64; any other mix becomes string"""
+    numbers = all(v is None or (isinstance(v, (int, float)) and not isinstance(v, bool)) for v in values)
+    return pa.float64() if pa.types.is_integer(arrow_type) and numbers else pa.string()
+
+
+def _to_arrow(pa, values, arrow_type, column: str):
+    try:
+        return pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, OverflowError):
+        if arrow_type == pa.string():
+            return pa.array([None if v is None else str(v) for v in values], type=arrow_type)
+        raise _SchemaMismatch(column, _widen(pa, arrow_type, values))
+
+
+def export_csv(db_path: str, sql: str, dest: Destination, batch_size: int = DEFAULT_BATCH_SIZE,
+               budget: Optional[QueryBudget] = None, token: Optional[CancelToken] = None) -> int:
+    """Write the query result as CSV one fetchmany batch at a time; returns the row count"""
+    rows_written = 0
+    with get_pool(db_path).connection() as conn, budgeted(conn, budget, token), \
+            _open_destination(dest, binary=False) as fh:
+        writer = csv.writer(fh)
+        header_written = False
+        for columns, batch in stream_rows(conn, sql, batch_size=batch_size):
+            if not header_written:
+                writer.writerow(columns)
+                header_written = True
+            writer.writerows(batch)
+            rows_written += len(batch)
+    return rows_written
+
+
+def export_jsonl(db_path: str, sql: str, dest: Destination, batch_size: int = DEFAULT_BATCH_SIZE,
+                 budget: Optional[QueryBudget] = None, token: Optional[CancelToken] = None) -> int:
+    """Write one JSON object per row; returns the row count"""
+    rows_written = 0
+    with get_pool(db_path).connection() as conn, budgeted(conn, budget, token), \
+            _open_destination(dest, binary=False) as fh:
+        keys = None
+        for columns, batch in stream_rows(conn, sql, batch_size=batch_size):
+            if keys is None:
+                keys = unique_columns(columns)
+            fh.writelines(
+                json.dumps(dict(zip(keys, row)), default=_json_default) + "\n" for row in batch
+            )
+            rows_written += len(batch)
+    return rows_written
+
+
+def _write_parquet(pa, pq, conn, sql: str, fh, batch_size: int, widened: Dict[str, object]) -> int:
+    rows_written = 0
+    writer: Optional["pq.ParquetWriter"] = None
+    try:
+        for columns, batch in stream_rows(conn, sql, batch_size=batch_size):
+            names = unique_columns(columns)
+            arrays = [[row[i] for row in batch] for i in range(len(names))]
+            if writer is None:
+                schema = pa.schema(
+                    pa.field(name, widened.get(name) or _infer_arrow_type(pa, values))
+                    for name, values in zip(names, arrays)
+                )
+                writer = pq.ParquetWriter(fh, schema)
+            # SQLite is dynamically typed, so every batch is coerced to the file's schema
+            table = pa.Table.from_arrays(
+                [_to_arrow(pa, values, f.type, f.name) for values, f in zip(arrays, writer.schema)],
+                schema=writer.schema,
+            )
+            writer.write_table(table)
+            rows_written += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows_written
+
+
+def export_parquet(db_path: str, sql: str, dest: Destination, batch_size: int = DEFAULT_BATCH_SIZE,
+                   budget: Optional[QueryBudget] = None, token: Optional[CancelToken] = None) -> int:
+    """Write each batch as a Parquet row group; requires the optional pyarrow package.
+
+    The schema comes from the first batch. A column whose later values do not fit it
+    (integers then text) is widened, to float64 or string, and the export starts over.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet export requires pyarrow: pip install '.[columnar]'") from e
+
+    widened: Dict[str, object] = {}
+    with get_pool(db_path).connection() as conn, budgeted(conn, budget, token), \
+            _open_destination(dest, binary=True) as fh:
+        start = fh.tell()
+        while True:
+            try:
+                return _write_parquet(pa, pq, conn, sql, fh, batch_size, widened)
+            except _SchemaMismatch as e:
+                widened[e.column] = e.widened
+                fh.seek(start)
+                fh.truncate()
+
+
+EXPORTERS: Dict[str, Dict[str, Union[str, Callable]]] = {
+    "CSV": {"writer": export_csv, "extension": "csv", "mime": "text/csv"},
+    "JSONL": {"writer": export_jsonl, "extension": "jsonl", "mime": "application/x-ndjson"},
+    "Parquet": {"writer": export_parquet, "extension": "parquet", "mime": "application/vnd.apache.parquet"},
+}
+
+
+def export_to_tempfile(db_path: str, sql: str, fmt: str, budget: Optional[QueryBudget] = None,
+                       token: Optional[CancelToken] = None) -> str:
+    """Export into a temporary file and return its path, for UI download buttons"""
+    spec = EXPORTERS[fmt]
+    fd, path = tempfile.mkstemp(prefix="query_results_", suffix=f".{spec['extension']}")
+    os.close(fd)
+    try:
+        spec["writer"](db_path, sql, path, budget=budget, token=token)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
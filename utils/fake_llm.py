@@ -0,0 +1,132 @@
+"""
+Offline stand-ins for the chat model: same invoke/ainvoke/stream/astream surface, configurable latency,
+transient failures and a canned SQL answer (or gold answers per question, for accuracy
+benchmarks), for load tests without network access
+"""
+
+import asyncio
+import hashlib
+import random
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+FAKE_SQL = 'SELECT life_science_firm_name, SUM(amount) AS total_amount FROM "Payments to HCPs" GROUP BY life_science_firm_name ORDER BY total_amount DESC LIMIT 5'
+
+
+class FakeTransientError(RuntimeError):
+    """Mimics a provider 429/503; treated as retryable by utils.llm_runtime"""
+
+
+class FakeChatModel:
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1, failure_rate: float = 0.0,
+                 response: str = FAKE_SQL, seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.response = response
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _plan(self):
+        with self._lock:
+            self.calls += 1
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.failure_rate
+        return delay, fail
+
+    def _reply(self, messages: List[Any]) -> str:
+        return self.response
+
+    def _message(self, messages: List[Any]) -> AIMessage:
+        reply = self._reply(messages)
+        prompt_chars = sum(len(str(getattr(m, "content", m))) for m in messages)
+        input_tokens, output_tokens = prompt_chars // 4, len(reply) // 4
+        return AIMessage(
+            content=reply,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+        )
+
+    def _chunks(self, messages: List[Any]) -> List[AIMessageChunk]:
+        """The reply word by word; usage rides on the last chunk, as providers send it"""
+        message = self._message(messages)
+        words = re.findall(r"\s*\S+", message.content) or [""]
+        chunks = [AIMessageChunk(content=word) for word in words[:-1]]
+        return chunks + [AIMessageChunk(content=words[-1], usage_metadata=message.usage_metadata)]
+
+    def invoke(self, messages: List[Any], **kwargs) -> AIMessage:
+        delay, fail = self._plan()
+        time.sleep(delay)
+        if fail:
+            raise FakeTransientError("fake provider overloaded")
+        return self._message(messages)
+
+    async def ainvoke(self, messages: List[Any], **kwargs) -> AIMessage:
+        delay, fail = self._plan()
+        await asyncio.sleep(delay)
+        if fail:
+            raise FakeTransientError("fake provider overloaded")
+        return self._message(messages)
+
+    def stream(self, messages: List[Any], **kwargs) -> Iterator[AIMessageChunk]:
+        """The latency is the wait for the first chunk; the rest follow at once"""
+        delay, fail = self._plan()
+        time.sleep(delay)
+        if fail:
+            raise FakeTransientError("fake provider overloaded")
+        yield from self._chunks(messages)
+
+    async def astream(self, messages: List[Any], **kwargs) -> AsyncIterator[AIMessageChunk]:
+        delay, fail = self._plan()
+        await asyncio.sleep(delay)
+        if fail:
+            raise FakeTransientError("fake provider overloaded")
+        for chunk in self._chunks(messages):
+            yield chunk
+
+
+class OracleChatModel(FakeChatModel):
+    """Answers each agent prompt as a perfect model would for known questions: gold SQL for
+    generate/repair, the SQL unchanged for review, "Compliant"/"Valid" for the checkers.
+
+    error_rate makes generate return a broken query (a misspelled table) for that share of
+    questions, chosen per question and seed, so validation and the repair loop are exercised.
+    """
+
+    def __init__(self, answers: Dict[str, str], error_rate: float = 0.0, latency: float = 0.0,
+                 jitter: float = 0.0, failure_rate: float = 0.0, seed: Optional[int] = None):
+        super().__init__(latency, jitter, failure_rate, response="", seed=seed)
+        self.answers = {question.strip(): sql for question, sql in answers.items()}
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def _broken(self, question: str) -> bool:
+        digest = hashlib.sha256(f"{self.seed}:{question}".encode("utf-8")).digest()
+        return int.from_bytes(digest[:4], "big") / 2 ** 32 < self.error_rate
+
+    def _reply(self, messages: List[Any]) -> str:
+        prompt = str(getattr(messages[-1], "content", messages[-1]))
+        review = re.search(r"SQL to review:\n(.*?)\n\nRemember", prompt, re.S)
+        if review:
+            return review.group(1)
+        if "SQL query to check:" in prompt:
+            return "**Compliant**: no PHI or PII is exposed."
+        if "SQL query to validate:" in prompt:
+            return "**Valid**: tables, columns and joins match the schema."
+        request = re.search(r"User request:\n(.*?)\n\n", prompt, re.S)
+        sql = self.answers.get(request.group(1).strip()) if request else None
+        if "Please interpret" in prompt:
+            return f"The user asks: {request.group(1).strip() if request else 'an unknown question'}"
+        if sql is None:
+            return "-- The request cannot be answered with the available schema"
+        if "Failed SQL:" not in prompt and self._broken(request.group(1).strip()):
+            return re.sub(r'(FROM\s+")([^"]+?).(")', r"\1\2\3", sql, count=1)
+        return sql
@@ -1,4 +1,5 @@
 import re
+import warnings
 
 def extract_token_counts(token_usage_str):
     prompt = completion = 0
@@ -11,6 +12,44 @@ def extract_token_counts(token_usage_str):
     return prompt, completion
 
 def calculate_gpt4o_mini_cost(prompt_tokens, completion_tokens):
-    input_cost = (prompt_tokens / 1000) * 0.00015
-    output_cost = (completion_tokens / 1000) * 0.0006
-    return input_cost + output_cost
+    return calculate_cost("gpt-4o-mini", prompt_tokens, completion_tokens)
+
+
+# USD per 1M tokens: (input, output, cached input). Register others with register_model_price.
+MODEL_PRICING = {
+    "gemini-2.5-flash": (0.30, 2.50, 0.075),
+    "gemini-2.5-flash-lite": (0.10, 0.40, 0.025),
+    "gemini-2.5-pro": (1.25, 10.00, 0.31),
+    "gemini-2.0-flash": (0.10, 0.40, 0.025),
+    "gpt-4o-mini": (0.15, 0.60, 0.075),
+    # Self-hosted and offline backends (utils.llm_backends) cost nothing per token
+    "local/": (0.0, 0.0, 0.0),
+    "fake/": (0.0, 0.0, 0.0),
+}
+
+def register_model_price(model, input_per_million, output_per_million, cached_input_per_million=None):
+    """Add or override a model's price; cached input defaults to the full input price"""
+    cached = input_per_million if cached_input_per_million is None else cached_input_per_million
+    MODEL_PRICING[model] = (input_per_million, output_per_million, cached)
+
+_UNPRICED = set()
+
+def model_price(model):
+    """Exact match first, then the longest known prefix ("gemini-2.5-flash-001" -> "gemini-2.5-flash").
+    An unknown model prices as free with one warning: the provider has billed the call by now"""
+    if model in MODEL_PRICING:
+        return MODEL_PRICING[model]
+    matches = [name for name in MODEL_PRICING if model.startswith(name)]
+    if not matches:
+        if model not in _UNPRICED:
+            _UNPRICED.add(model)
+            warnings.warn(f"No pricing for model {model!r}, its cost is reported as 0; "
+                          "add it with register_model_price", RuntimeWarning, stacklevel=2)
+        return (0.0, 0.0, 0.0)
+    return MODEL_PRICING[max(matches, key=len)]
+
+def calculate_cost(model, prompt_tokens, completion_tokens, cached_tokens=0):
+    """USD cost of one call; cached_tokens is the part of prompt_tokens served from context cache"""
+    input_price, output_price, cached_price = model_price(model)
+    fresh = max(prompt_tokens - cached_tokens, 0)
+    return (fresh * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+Index advisor: learns hot filter, join and sort columns from the executed-query log,
+checks SQLite's plans for full scans, and proposes covering indexes whose benefit is
+measured by replaying the log on a sampled temporary copy before and after.
+Logging is opt-in: set QUERY_LOG to a path (e.g. .cache/query_log.jsonl) to record executions
+
+Run from the project directory:
+    python -m utils.index_advisor [--db dataset/data.sqlite] [--log .cache/query_log.jsonl] [--top 5]
+                                  [--sample-rows 200000] [--apply]
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import sqlparse
+from sqlparse import tokens as T
+
+from utils.query_engine import PlanStep, explain_plan
+from utils.schema_catalog import SchemaCatalog, load_catalog, quote_identifier
+from utils.sql_tokens import CLAUSES, is_word, norm_identifier, significant_tokens
+
+QUERY_LOG_PATH = os.getenv("QUERY_LOG", "")     # empty: executions are not logged
+QUERY_LOG_MAX_BYTES = 5 * 1024 * 1024
+MAX_INDEX_COLUMNS = 6
+# Rows per table in the replay copy; larger tables are sampled at an even rowid stride
+REPLAY_SAMPLE_ROWS = 200_000
+
+_EQUALITY_OPS = {"=", "==", "IN", "IS"}
+_RANGE_OPS = {"<", ">", "<=", ">=", "BETWEEN", "LIKE", "GLOB"}
+
+
+def parameterize_sql(sql: str) -> str:
+    """sql with filter literals replaced by ? and whitespace collapsed: the query's shape
+    without the patient IDs, names or dates it looked up. LIMIT/OFFSET and positional
+    GROUP BY / ORDER BY numbers are kept, since they change what the statement means"""
+    out = []
+    clause = None
+    for token in sqlparse.parse(sql)[0].flatten():
+        if token.ttype in T.Comment:
+            out.append(" ")
+            continue
+        word = token.normalized.upper() if token.is_keyword else None
+        if word and (word in CLAUSES or word.endswith("JOIN")):
+            clause = "from" if word.endswith("JOIN") else CLAUSES[word]
+        literal = token.ttype in T.Literal and token.ttype not in T.String.Symbol
+        out.append("?" if literal and clause in ("where", "on") else token.value)
+    return " ".join("".join(out).split())
+
+
+class QueryLog:
+    """JSONL log of executed SQL shapes (parameterized, see parameterize_sql); the advisor's
+    input. The file rotates to one .1 backup once it reaches max_bytes; without a path
+    nothing is recorded"""
+
+    def __init__(self, path: Optional[str] = QUERY_LOG_PATH, max_entries: int = 5000, max_bytes: int = QUERY_LOG_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def record(self, sql: str, elapsed_ms: float, status: str = "ok") -> None:
+        """status is "ok", "timeout", "cancelled" or "error"; elapsed is partial for the latter"""
+        if not self.path:
+            return
+        try:
+            shape = parameterize_sql(sql)
+        except Exception:
+            return  # never log text we could not strip of its literals
+        entry = json.dumps({"sql": shape, "elapsed_ms": round(elapsed_ms, 3), "status": status, "ts": time.time()})
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as fh:
+                    fh.write(entry + "\n")
+                    full = fh.tell() >= self.max_bytes
+                if full:
+                    os.replace(self.path, self.path + ".1")
+            except OSError:
+                pass  # logging must never fail a query
+
+    def entries(self) -> List[Dict]:
+        lines: List[str] = []
+        if not self.path:
+            return []
+        for path in (self.path + ".1", self.path):
+            try:
+                with open(path, "r", encoding="utf-8") as fh:
+                    lines.extend(fh.readlines())
+            except OSError:
+                continue
+        lines = lines[-self.max_entries:]
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+
+QUERY_LOG = QueryLog()
+
+
+@dataclass
+class QueryShape:
+    """Which columns a query filters, joins, sorts and reads, per base table"""
+    tables: Dict[str, str] = field(default_factory=dict)            # alias/name -> table
+    equality: List[Tuple[str, str]] = field(default_factory=list)
+    ranges: List[Tuple[str, str]] = field(default_factory=list)
+    joins: List[Tuple[Tuple[str, str], Tuple[str, str]]] = field(default_factory=list)
+    ordering: List[Tuple[str, str]] = field(default_factory=list)
+    used: Dict[str, Set[str]] = field(default_factory=lambda: defaultdict(set))
+    star: bool = False
+    placeholders: List[Optional[Tuple[str, str]]] = field(default_factory=list)  # column each ? is compared to
+
+
+class _ColumnResolver:
+    def __init__(self, catalog: SchemaCatalog):
+        self.tables = {norm_identifier(t.name): t.name for t in catalog.tables}
+        self.columns = {t.name: {norm_identifier(c.name): c.name for c in t.columns} for t in catalog.tables}
+
+    def table(self, name: str) -> Optional[str]:
+        return self.tables.get(norm_identifier(name))
+
+    def column(self, shape: QueryShape, qualifier: Optional[str], name: str) -> Optional[Tuple[str, str]]:
+        key = norm_identifier(name)
+        if qualifier is not None:
+            table = shape.tables.get(norm_identifier(qualifier))
+            real = self.columns.get(table, {}).get(key) if table else None
+            return (table, real) if real else None
+        owners = {t for t in shape.tables.values() if key in self.columns.get(t, {})}
+        if len(owners) == 1:
+            table = owners.pop()
+            return table, self.columns[table][key]
+        return None
+
+
+def analyze_query(sql: str, catalog: SchemaCatalog) -> QueryShape:
+    """Token-level pass over the statement: tables and aliases first, then predicates"""
+    resolver = _ColumnResolver(catalog)
+    shape = QueryShape()
+    leaves = significant_tokens(sql)
+
+    # Pass 1: base tables and aliases named after FROM / JOIN
+    clause = None
+    expect_alias: Optional[str] = None
+    for token in leaves:
+        word = token.normalized.upper() if token.is_keyword else None
+        if word and (word in CLAUSES or word.endswith("JOIN")):
+            clause = "from" if word.endswith("JOIN") else CLAUSES[word]
+            expect_alias = None
+            continue
+        if clause != "from":
+            continue
+        if token.match(T.Punctuation, ","):
+            expect_alias = None
+        elif word == "AS":
+            continue
+        elif is_word(token):
+            table = resolver.table(token.value)
+            if expect_alias is None and table:
+                shape.tables[norm_identifier(token.value)] = table
+                expect_alias = table
+            elif expect_alias is not None:
+                shape.tables[norm_identifier(token.value)] = expect_alias
+                expect_alias = None
+
+    # Pass 2: column references grouped into (clause, atom) with operators between them
+    atoms: List[Tuple[str, object]] = []
+    slots: List[int] = []
+    clause = None
+    i = 0
+    while i < len(leaves):
+        token = leaves[i]
+        word = token.normalized.upper() if token.is_keyword else None
+        if word and (word in CLAUSES or word.endswith("JOIN")):
+            clause = "from" if word.endswith("JOIN") else CLAUSES[word]
+            atoms.append((clause, None))
+            i += 1
+            continue
+        if token.ttype in T.Operator.Comparison or word in _EQUALITY_OPS | _RANGE_OPS:
+            atoms.append((clause, token.normalized.upper()))
+            i += 1
+            continue
+        if token.match(T.Wildcard, "*") and clause == "select" and not leaves[i - 1].match(T.Punctuation, "("):
+            shape.star = True  # COUNT(*) reads no columns
+        if clause != "from" and is_word(token):
+            qualifier = None
+            if i + 2 < len(leaves) and leaves[i + 1].match(T.Punctuation, "."):
+                qualifier, token = token.value, leaves[i + 2]
+                i += 2
+            column = resolver.column(shape, qualifier, token.value)
+            if column:
+                shape.used[column[0]].add(column[1])
+                atoms.append((clause, column))
+                i += 1
+                continue
+        if token.ttype in T.Name.Placeholder:
+            slots.append(len(atoms))
+            atoms.append((clause, "?"))
+        elif token.ttype in T.Literal and token.ttype not in T.String.Symbol:
+            atoms.append((clause, "?"))
+        elif token.match(T.Keyword, ("AND", "OR")) or token.match(T.Punctuation, (",", "(", ")")):
+            atoms.append((clause, None))
+        i += 1
+
+    for j, (clause, atom) in enumerate(atoms):
+        if clause == "order" and isinstance(atom, tuple):
+            shape.ordering.append(atom)
+        if clause not in ("where", "on") or not isinstance(atom, str) or atom == "?":
+            continue
+        left = atoms[j - 1][1] if j > 0 else None
+        right = atoms[j + 1][1] if j + 1 < len(atoms) else None
+        if isinstance(left, tuple) and isinstance(right, tuple):
+            if atom in _EQUALITY_OPS:
+                shape.joins.append((left, right))
+            continue
+        column = left if isinstance(left, tuple) else right if isinstance(right, tuple) else None
+        if column is None:
+            continue
+        (shape.equality if atom in _EQUALITY_OPS else shape.ranges).append(column)
+
+    # A placeholder binds to the column on the other side of its operator: `? < col` looks
+    # ahead, otherwise the nearest column before it (`col IN (?, ?)`, `col BETWEEN ? AND ?`)
+    for j in slots:
+        ahead = atoms[j + 1:j + 3]
+        if len(ahead) == 2 and ahead[0][1] not in (None, "?") and isinstance(ahead[1][1], tuple):
+            shape.placeholders.append(ahead[1][1])
+            continue
+        before = (atom for c, atom in reversed(atoms[:j]) if c == atoms[j][0])
+        shape.placeholders.append(next((atom for atom in before if isinstance(atom, tuple)), None))
+    return shape
+
+
+@dataclass
+class IndexCandidate:
+    table: str
+    columns: Tuple[str, ...]
+    queries: int = 0
+    reasons: Set[str] = field(default_factory=set)
+
+    @property
+    def name(self) -> str:
+        return re.sub(r"\W+", "_", f"idx_{self.table}_{'_'.join(norm_identifier(c) for c in self.columns)}").lower()
+
+    @property
+    def ddl(self) -> str:
+        return (f"CREATE INDEX IF NOT EXISTS {quote_identifier(self.name)} ON {quote_identifier(self.table)} "
+                f"({', '.join(quote_identifier(c) for c in self.columns)})")
+
+
+@dataclass
+class Recommendation:
+    candidate: IndexCandidate
+    baseline_ms: float
+    indexed_ms: float
+    plans_improved: int
+
+    @property
+    def benefit_ms(self) -> float:
+        return self.baseline_ms - self.indexed_ms
+
+    @property
+    def speedup(self) -> float:
+        return self.baseline_ms / self.indexed_ms if self.indexed_ms else 0.0
+
+
+def _scanned_tables(plan: List[PlanStep], shape: QueryShape) -> Set[str]:
+    scanned = set()
+    for step in plan:
+        if step.is_full_scan:
+            target = re.split(r"\s+(?:AS|USING)\b", step.detail[len("SCAN "):])[0].strip()
+            table = shape.tables.get(norm_identifier(target))
+            if table:
+                scanned.add(table)
+    return scanned
+
+
+def candidates_for(shape: QueryShape, plan: List[PlanStep], hot: Counter) -> List[IndexCandidate]:
+    """Per fully scanned table: equality/join keys by log-wide frequency, one range column,
+    then sort and read columns to make the index covering when it stays narrow"""
+    proposals = []
+    join_columns = [c for pair in shape.joins for c in pair]
+    for table in _scanned_tables(plan, shape):
+        equality = [c for t, c in shape.equality + join_columns if t == table]
+        ranges = [c for t, c in shape.ranges if t == table]
+        ordering = [c for t, c in shape.ordering if t == table]
+        keys = sorted(dict.fromkeys(equality), key=lambda c: -hot[(table, c)])
+        reasons = {"filter"} if any(t == table for t, _ in shape.equality) else set()
+        if any(t == table for t, _ in join_columns):
+            reasons.add("join")
+        if ranges:
+            keys.append(ranges[0])
+            reasons.add("range")
+        elif ordering and not keys:
+            keys.extend(dict.fromkeys(ordering))
+            reasons.add("sort")
+        if not keys:
+            continue
+        rest = [c for c in dict.fromkeys(ordering + sorted(shape.used.get(table, ()))) if c not in keys]
+        if not shape.star and len(keys) + len(rest) <= MAX_INDEX_COLUMNS:
+            keys.extend(rest)
+            reasons.add("covering")
+        proposals.append(IndexCandidate(table, tuple(keys[:MAX_INDEX_COLUMNS]), reasons=reasons))
+    return proposals
+
+
+def _existing_index_prefixes(conn: sqlite3.Connection) -> Set[Tuple[str, Tuple[str, ...]]]:
+    prefixes = set()
+    for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+        for index in conn.execute("SELECT name FROM pragma_index_list(?)", (table,)).fetchall():
+            columns = tuple(r[0] for r in conn.execute(
+                "SELECT name FROM pragma_index_info(?) ORDER BY seqno", (index[0],)))
+            for n in range(1, len(columns) + 1):
+                prefixes.add((table, columns[:n]))
+    return prefixes
+
+
+def _sample_params(conn: sqlite3.Connection, shape: QueryShape, samples: Dict[Tuple[str, str], object]) -> List:
+    """A real value for each placeholder, taken from the middle non-NULL row of its column in
+    the replay copy, so replay reads the rows a logged lookup would; NULL (which matches
+    nothing) only when the column is unknown. samples caches values across queries"""
+    params = []
+    for column in shape.placeholders:
+        if column is not None and column not in samples:
+            table, name = quote_identifier(column[0]), quote_identifier(column[1])
+            count = conn.execute(f"SELECT COUNT({name}) FROM {table}").fetchone()[0]
+            row = conn.execute(f"SELECT {name} FROM {table} WHERE {name} IS NOT NULL LIMIT 1 OFFSET ?",
+                               (count // 2,)).fetchone()
+            samples[column] = row[0] if row else None
+        params.append(samples.get(column) if column is not None else None)
+    return params
+
+
+def _timed_replay(conn: sqlite3.Connection, workload: List[Tuple[str, int]], params: Dict[str, List],
+                  repeats: int, budget_s: float) -> Tuple[float, Dict[str, List[PlanStep]]]:
+    """Weighted wall time of the workload in ms; a query over budget is interrupted"""
+    total = 0.0
+    plans = {}
+    for sql, weight in workload:
+        plans[sql] = explain_plan(conn, sql, params[sql])
+        best = None
+        for _ in range(repeats):
+            deadline = time.perf_counter() + budget_s
+            conn.set_progress_handler(lambda: time.perf_counter() > deadline, 10_000)
+            start = time.perf_counter()
+            try:
+                conn.execute(sql, params[sql]).fetchall()
+            except sqlite3.OperationalError:
+                pass  # interrupted: charged at the budget
+            finally:
+                conn.set_progress_handler(None, 0)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        total += (best or 0.0) * weight * 1000
+    return total, plans
+
+
+def _replay_copy(db_path: str, path: str, sample_rows: int) -> sqlite3.Connection:
+    """Copy of db_path at path with the same tables and indexes; tables over sample_rows keep
+    every n-th row, so replay stays bounded in disk and time on large extracts"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("ATTACH DATABASE ? AS src", (os.path.abspath(db_path),))
+    objects = conn.execute("SELECT type, name, sql FROM src.sqlite_master WHERE sql IS NOT NULL "
+                           "AND name NOT LIKE 'sqlite_%' ORDER BY type = 'index'").fetchall()
+    analyzed = conn.execute("SELECT 1 FROM src.sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    conn.execute("BEGIN")
+    for kind, name, ddl in objects:
+        if kind not in ("table", "index"):
+            continue
+        conn.execute(ddl)
+        if kind == "table":
+            table = quote_identifier(name)
+            rows = conn.execute(f"SELECT COUNT(*) FROM src.{table}").fetchone()[0]
+            stride = max(1, -(-rows // sample_rows)) if sample_rows else 1
+            where = f" WHERE rowid % {stride} = 0" if stride > 1 else ""
+            conn.execute(f"INSERT INTO main.{table} SELECT * FROM src.{table}{where}")
+    conn.execute("COMMIT")
+    conn.execute("DETACH DATABASE src")
+    if analyzed:
+        conn.execute("ANALYZE")
+    return conn
+
+
+def advise(db_path: str, queries: Optional[Iterable[str]] = None, top: int = 5, repeats: int = 3,
+           budget_s: float = 5.0, sample_rows: int = REPLAY_SAMPLE_ROWS,
+           log: Optional[QueryLog] = None) -> List[Recommendation]:
+    """Rank index candidates for the given (or logged, QUERY_LOG by default) queries by
+    measured replay benefit.
+
+    Replay runs on a temporary file copy (sampled above sample_rows per table; 0 copies
+    everything), so timings are relative; filter values are sampled from the filtered columns.
+    """
+    catalog = load_catalog(db_path)
+    logged = (e["sql"] for e in (log or QUERY_LOG).entries())
+    counts = Counter(parameterize_sql(q) for q in (queries if queries is not None else logged))
+    with tempfile.TemporaryDirectory(prefix="index-advisor-") as scratch:
+        replay = _replay_copy(db_path, os.path.join(scratch, "replay.sqlite"), sample_rows)
+        try:
+            return _advise(replay, catalog, counts, top, repeats, budget_s)
+        finally:
+            replay.close()
+
+
+def _advise(replay: sqlite3.Connection, catalog: SchemaCatalog, counts: Counter, top: int, repeats: int,
+            budget_s: float) -> List[Recommendation]:
+    shapes: Dict[str, QueryShape] = {}
+    params: Dict[str, List] = {}
+    samples: Dict[Tuple[str, str], object] = {}
+    hot: Counter = Counter()
+    for sql, weight in counts.items():
+        try:
+            shape = analyze_query(sql, catalog)
+            params[sql] = _sample_params(replay, shape, samples)
+            explain_plan(replay, sql, params[sql])
+            shapes[sql] = shape
+        except (sqlite3.Error, IndexError, ValueError):
+            continue  # invalid or non-SELECT statements are ignored
+        for column in shapes[sql].equality + [c for pair in shapes[sql].joins for c in pair]:
+            hot[column] += weight
+
+    existing = _existing_index_prefixes(replay)
+    merged: Dict[Tuple[str, Tuple[str, ...]], IndexCandidate] = {}
+    touches: Dict[Tuple[str, Tuple[str, ...]], List[str]] = defaultdict(list)
+    for sql, shape in shapes.items():
+        for candidate in candidates_for(shape, explain_plan(replay, sql, params[sql]), hot):
+            key = (candidate.table, candidate.columns)
+            if key in existing:
+                continue
+            merged.setdefault(key, candidate).queries += counts[sql]
+            merged[key].reasons |= candidate.reasons
+            touches[key].append(sql)
+    # An index whose columns are a prefix of a wider candidate on the same table is redundant:
+    # fold its queries into the widest such candidate
+    keys = []
+    for key in sorted(merged, key=lambda k: -len(k[1])):
+        wider = next((k for k in keys if k[0] == key[0] and k[1][:len(key[1])] == key[1]), None)
+        if wider is None:
+            keys.append(key)
+            continue
+        merged[wider].queries += merged[key].queries
+        merged[wider].reasons |= merged[key].reasons
+        touches[wider].extend(sql for sql in touches[key] if sql not in touches[wider])
+
+    recommendations = []
+    for key in keys:
+        candidate = merged[key]
+        workload = [(sql, counts[sql]) for sql in touches[key]]
+        baseline, before = _timed_replay(replay, workload, params, repeats, budget_s)
+        replay.execute(candidate.ddl)
+        try:
+            indexed, after = _timed_replay(replay, workload, params, repeats, budget_s)
+        finally:
+            replay.execute(f"DROP INDEX {quote_identifier(candidate.name)}")
+        improved = sum(
+            1 for sql in before
+            if _scanned_tables(before[sql], shapes[sql]) - _scanned_tables(after[sql], shapes[sql])
+        )
+        recommendations.append(Recommendation(candidate, baseline, indexed, improved))
+    recommendations.sort(key=lambda r: r.benefit_ms, reverse=True)
+    return [r for r in recommendations if r.plans_improved][:top]
+
+
+def apply_recommendations(db_path: str, recommendations: List[Recommendation]) -> None:
+    """Create the recommended indexes on the real database and refresh its statistics"""
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            for rec in recommendations:
+                conn.execute(rec.candidate.ddl)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
+
+
+def main():
+    from utils.db_simulator import DB_PATH
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--log", default=QUERY_LOG_PATH, help="Query log to analyze (default: $QUERY_LOG)")
+    parser.add_argument("--sql", action="append", help="Analyze this query instead of the log (repeatable)")
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--sample-rows", type=int, default=REPLAY_SAMPLE_ROWS,
+                        help="Rows per table in the replay copy (0: copy everything)")
+    parser.add_argument("--apply", action="store_true", help="Create the recommended indexes")
+    args = parser.parse_args()
+    if not args.sql and not args.log:
+        parser.error("no queries: pass --sql, or --log / QUERY_LOG pointing at a query log")
+
+    recommendations = advise(args.db, args.sql, top=args.top, repeats=args.repeats, sample_rows=args.sample_rows,
+                             log=QueryLog(args.log))
+    if not recommendations:
+        print("✅ No index would remove a full scan from the logged queries")
+        return
+    for rec in recommendations:
+        c = rec.candidate
+        print(f"💡 {c.ddl};")
+        print(f"   {', '.join(sorted(c.reasons))} · {c.queries} logged run(s) · plans improved: "
+              f"{rec.plans_improved} · {rec.baseline_ms:.2f} ms -> {rec.indexed_ms:.2f} ms "
+              f"({rec.speedup:.1f}x)")
+    if args.apply:
+        apply_recommendations(args.db, recommendations)
+        print(f"⚡ Created {len(recommendations)} index(es) on {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Streaming CSV -> SQLite loader for the dataset/ extracts
+
+Reads each CSV in chunks, types columns from SchemaNotes.txt (inferring the rest in a first
+pass over the whole file, skipped when the notes type every column), bulk-inserts with executemany in one transaction per table under relaxed
+durability PRAGMAs, and builds indexes only once the data is in. Header BOMs and quotes are
+stripped, so a re-ingested data.sqlite spells the first column plainly where the shipped one
+keeps the extract's BOM and quotes; dialect translation maps either spelling, and the NL->SQL
+gold results follow the data: rerun python -m benchmarks.nl2sql --refresh-expected.
+
+Run from the project directory:
+    python -m utils.ingest [CSV ...] [--db dataset/data.sqlite] [--chunk-size 50000] [--naming file|notes]
+"""
+
+import argparse
+import csv
+import glob
+import os
+import re
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.rollups import refresh_rollups
+from utils.schema_catalog import quote_identifier
+from utils.schema_notes import NOTES_TABLES, SCHEMA_NOTES_PATH, NotesTable, notes_column_types
+
+DEFAULT_DB_PATH = os.path.join("dataset", "data.sqlite")
+DEFAULT_CHUNK_SIZE = 50_000
+
+# Large, durable-enough-to-rebuild load settings; restored after the load
+LOAD_PRAGMAS = {
+    "synchronous": "OFF",
+    "journal_mode": "MEMORY",
+    "temp_store": "MEMORY",
+    "cache_size": "-262144",
+}
+
+
+@dataclass
+class TableSpec:
+    name: str
+    columns: List[Tuple[str, str]]
+    index_columns: List[Tuple[str, ...]] = field(default_factory=list)
+
+
+@dataclass
+class LoadStats:
+    table: str
+    rows: int
+    seconds: float
+    index_seconds: float = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+def widen_affinity(affinity: str, value: str) -> str:
+    """affinity widened just enough to also hold value (INTEGER -> REAL -> TEXT)"""
+    if value == "" or affinity == "TEXT":
+        return affinity
+    if re.fullmatch(r"-?\d+", value):
+        if len(value.lstrip("-")) > 1 and value.lstrip("-").startswith("0"):
+            return "TEXT"  # codes like ZIPs and NDCs: numeric affinity would drop the zeros
+        if affinity == "INTEGER" and len(value.lstrip("-")) <= 18:
+            return affinity
+    try:
+        float(value)
+    except ValueError:
+        return "TEXT"
+    return "REAL"
+
+
+def infer_affinity(values: Iterable[str]) -> str:
+    """Narrowest affinity that fits every non-empty value"""
+    return infer_affinities(([value] for value in values), [0])[0]
+
+
+def infer_affinities(rows: Iterable[List[str]], columns: List[int]) -> Dict[int, str]:
+    """Narrowest affinity per column index over every row, in one pass that stops early
+    once all of them are TEXT"""
+    affinities = {i: "INTEGER" for i in columns}
+    pending = set(columns)
+    for row in rows:
+        for i in [i for i in pending if i < len(row)]:
+            affinities[i] = widen_affinity(affinities[i], row[i])
+            if affinities[i] == "TEXT":
+                pending.discard(i)
+        if not pending:
+            break
+    return affinities
+
+
+def build_spec(name: str, header: List[str], rows: Iterable[List[str]],
+               notes: NotesTable) -> TableSpec:
+    """Columns typed from notes, the rest inferred from rows (consumed only if needed)"""
+    untyped = [i for i, column in enumerate(header) if not notes.types.get(column)]
+    inferred = infer_affinities(rows, untyped) if untyped else {}
+    columns = [(column, notes.types.get(column) or inferred[i]) for i, column in enumerate(header)]
+    names = {c for c, _ in columns}
+    index_columns: List[Tuple[str, ...]] = []
+    order_by = [c for c in notes.order_by if c in names]
+    if order_by:
+        index_columns.append(tuple(order_by[:2]))
+    for column, _ in columns:
+        # NPI / project id columns are the join keys between the extracts
+        if re.search(r"npi$|projectId$", column, re.IGNORECASE) and not any(idx[0] == column for idx in index_columns):
+            index_columns.append((column,))
+    return TableSpec(name=name, columns=columns, index_columns=index_columns)
+
+
+def read_chunks(reader: Iterator[List[str]], chunk_size: int) -> Iterator[List[List[str]]]:
+    while True:
+        chunk = list(islice(reader, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _converter(columns: List[Tuple[str, str]]):
+    """Empty strings become NULL in numeric columns; SQLite affinity converts the rest"""
+    numeric = [i for i, (_, affinity) in enumerate(columns) if affinity != "TEXT"]
+    width = len(columns)
+
+    def convert(row: List[str]) -> List[Optional[str]]:
+        if len(row) != width:
+            row = (row + [""] * width)[:width]
+        for i in numeric:
+            if row[i] == "":
+                row[i] = None
+        return row
+
+    return convert
+
+
+def load_csv(conn: sqlite3.Connection, csv_path: str, table: str, notes: NotesTable,
+             chunk_size: int = DEFAULT_CHUNK_SIZE) -> LoadStats:
+    """Replace table with the contents of csv_path; indexes are created afterwards.
+
+    Affinities must fit every row, not just the first chunk: a later "007" in a column
+    typed INTEGER would be stored as 7. Untyped columns therefore cost one extra read.
+    """
+    start = time.perf_counter()
+    rows = 0
+    # utf-8-sig drops the BOM the extracts carry on their first header
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as fh:
+        reader = csv.reader(fh)
+        spec = build_spec(table, next(reader), reader, notes)
+    with open(csv_path, "r", encoding="utf-8-sig", newline="") as fh:
+        reader = csv.reader(fh)
+        next(reader)
+        convert = _converter(spec.columns)
+        column_sql = ", ".join(f"{quote_identifier(c)} {affinity}" for c, affinity in spec.columns)
+        insert_sql = (f"INSERT INTO {quote_identifier(table)} VALUES "
+                      f"({', '.join('?' for _ in spec.columns)})")
+        conn.execute("BEGIN")
+        try:
+            conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table)}")
+            conn.execute(f"CREATE TABLE {quote_identifier(table)} ({column_sql})")
+            for chunk in read_chunks(reader, chunk_size):
+                conn.executemany(insert_sql, map(convert, chunk))
+                rows += len(chunk)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    stats = LoadStats(table=table, rows=rows, seconds=time.perf_counter() - start)
+
+    index_start = time.perf_counter()
+    for columns in spec.index_columns:
+        index_name = re.sub(r"\W+", "_", f"idx_{table}_{'_'.join(columns)}").lower()
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {quote_identifier(index_name)} ON {quote_identifier(table)} "
+            f"({', '.join(quote_identifier(c) for c in columns)})"
+        )
+    stats.index_seconds = time.perf_counter() - index_start
+    return stats
+
+
+def ingest(csv_paths: List[str], db_path: str = DEFAULT_DB_PATH, chunk_size: int = DEFAULT_CHUNK_SIZE,
+           naming: str = "file", notes_path: str = SCHEMA_NOTES_PATH) -> List[LoadStats]:
+    """Load every CSV into db_path; tables are named after the file stem or its notes table"""
+    all_types = notes_column_types(notes_path)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    previous = {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in LOAD_PRAGMAS}
+    results = []
+    try:
+        for name, value in LOAD_PRAGMAS.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        for csv_path in csv_paths:
+            stem = os.path.splitext(os.path.basename(csv_path))[0]
+            notes_table = NOTES_TABLES.get(stem)
+            table = notes_table if naming == "notes" and notes_table else stem
+            results.append(load_csv(conn, csv_path, table, all_types.get(notes_table) or NotesTable(), chunk_size))
+        conn.execute("ANALYZE")
+    finally:
+        for name, value in previous.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        conn.close()
+    # Tables were dropped and reloaded, so rowid watermarks mean nothing: rebuild the rollups
+    refresh_rollups(db_path, full=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("csv", nargs="*", help="CSV files (default: dataset/*.csv)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--naming", choices=("file", "notes"), default="file",
+                        help="Name tables after the CSV file (as the app expects) or the SchemaNotes table")
+    parser.add_argument("--notes", default=SCHEMA_NOTES_PATH)
+    args = parser.parse_args()
+
+    csv_paths = args.csv or sorted(glob.glob(os.path.join("dataset", "*.csv")))
+    if not csv_paths:
+        print("❌ No CSV files found")
+        sys.exit(1)
+
+    print(f"📥 Loading {len(csv_paths)} file(s) into {args.db}")
+    total_start = time.perf_counter()
+    results = ingest(csv_paths, args.db, args.chunk_size, args.naming, args.notes)
+    for stats in results:
+        print(f"✅ {stats.table:<28} {stats.rows:>10,} rows  {stats.seconds:7.2f}s  "
+              f"{stats.rows_per_sec:>10,.0f} rows/s  (indexes {stats.index_seconds:.2f}s)")
+    total_rows = sum(s.rows for s in results)
+    elapsed = time.perf_counter() - total_start
+    print(f"⚡ {total_rows:,} rows in {elapsed:.2f}s ({total_rows / elapsed if elapsed else 0:,.0f} rows/s)")
+    if os.path.abspath(args.db) == os.path.abspath(DEFAULT_DB_PATH):
+        print("ℹ️  Refresh the NL->SQL gold results for the new data: python -m benchmarks.nl2sql --refresh-expected")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+"""
+LLM backend registry: every agent in config/agents.yaml names its model as "provider/model"
+and gets its own chat client, built once on first use. Hosted providers sit next to a local
+llama.cpp backend for cheap stages, the offline fake model, and a record/replay wrapper that
+serves earlier responses from disk for deterministic, network-free runs. Clients without
+stream/astream are streamed as one chunk (see stream_chunks).
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+AGENTS_CONFIG_PATH = os.path.join("config", "agents.yaml")
+REPLAY_DIR = os.path.join(".cache", "llm_replay")
+DEFAULT_MODEL = "google/gemini-2.5-flash"
+DEFAULT_TEMPERATURE = 0.2
+HOSTED_PROVIDERS = ("google", "openai")
+REPLAY_MODES = ("record", "replay", "auto")
+
+# run_agent stage -> agents.yaml entry whose model serves it
+STAGE_AGENTS = {
+    "generate": "query_generator_agent",
+    "repair": "query_generator_agent",
+    "review": "query_reviewer_agent",
+    "validate": "query_reviewer_agent",
+    "compliance": "compliance_checker_agent",
+    "interpret": "result_interpreter_agent",
+}
+
+# agents.yaml keys describing the persona rather than the backend
+_PERSONA_KEYS = {"role", "goal", "backstory", "allow_delegation", "verbose", "model", "temperature"}
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    provider: str
+    model: str
+    temperature: float = DEFAULT_TEMPERATURE
+    options: Tuple[Tuple[str, Any], ...] = ()     # extra agents.yaml keys, e.g. model_path
+
+    @classmethod
+    def parse(cls, value: str, temperature: float = DEFAULT_TEMPERATURE, **options) -> "ModelSpec":
+        """"google/gemini-2.5-flash", "local/qwen2.5-coder-1.5b", "fake/sql"; a bare name is Gemini"""
+        provider, sep, model = value.strip().partition("/")
+        if not sep:
+            provider, model = "google", value.strip()
+        return cls(provider.lower(), model, float(temperature), tuple(sorted(options.items())))
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+    @property
+    def pricing_model(self) -> str:
+        """Key into utils.helper.MODEL_PRICING; self-hosted and offline backends price as free"""
+        return self.model if self.provider in HOSTED_PROVIDERS else self.name
+
+    def option(self, key: str, default: Any = None) -> Any:
+        return dict(self.options).get(key, default)
+
+
+class ReplayMiss(LookupError):
+    """No recorded response for this prompt in replay-only mode"""
+
+
+# ---------- messages ----------
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+def _message_dicts(messages: List[Any]) -> List[Dict[str, str]]:
+    return [{"role": _ROLES.get(getattr(m, "type", "human"), "user"), "content": str(getattr(m, "content", m))}
+            for m in messages]
+
+
+def _ai_message(content: str, usage: Optional[Dict[str, Any]]):
+    from langchain_core.messages import AIMessage
+    return AIMessage(content=content, usage_metadata=usage) if usage else AIMessage(content=content)
+
+
+def _ai_chunk(content: str, usage: Optional[Dict[str, Any]]):
+    from langchain_core.messages import AIMessageChunk
+    return AIMessageChunk(content=content, usage_metadata=usage) if usage else AIMessageChunk(content=content)
+
+
+def stream_chunks(client, messages: List[Any], **kwargs) -> Iterator[Any]:
+    """client.stream, or the whole invoke response as a single chunk for clients that cannot stream"""
+    if hasattr(client, "stream"):
+        yield from client.stream(messages, **kwargs)
+    else:
+        yield client.invoke(messages, **kwargs)
+
+
+async def astream_chunks(client, messages: List[Any], **kwargs) -> AsyncIterator[Any]:
+    if hasattr(client, "astream"):
+        async for chunk in client.astream(messages, **kwargs):
+            yield chunk
+    else:
+        yield await client.ainvoke(messages, **kwargs)
+
+
+# ---------- backends ----------
+class LlamaCppChatModel:
+    """Local GGUF model through llama-cpp-python; loaded on the first call, one call at a time"""
+
+    def __init__(self, model_path: str, temperature: float = DEFAULT_TEMPERATURE, n_ctx: int = 8192,
+                 n_threads: Optional[int] = None, max_tokens: int = 1024):
+        self.model_path = model_path
+        self.temperature = temperature
+        self.n_ctx = n_ctx
+        self.n_threads = n_threads
+        self.max_tokens = max_tokens
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _llama(self):
+        if self._model is None:
+            try:
+                from llama_cpp import Llama
+            except ImportError as e:
+                raise ImportError("The local backend needs llama-cpp-python: pip install llama-cpp-python") from e
+            self._model = Llama(model_path=self.model_path, n_ctx=self.n_ctx, n_threads=self.n_threads,
+                                verbose=False)
+        return self._model
+
+    def invoke(self, messages: List[Any], **kwargs):
+        with self._lock:
+            reply = self._llama().create_chat_completion(
+                messages=_message_dicts(messages), temperature=self.temperature, max_tokens=self.max_tokens)
+        usage = reply.get("usage") or {}
+        return _ai_message(reply["choices"][0]["message"]["content"] or "", {
+            "input_tokens": usage.get("prompt_tokens", 0),
+            "output_tokens": usage.get("completion_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0),
+        })
+
+    async def ainvoke(self, messages: List[Any], **kwargs):
+        return await asyncio.to_thread(self.invoke, messages, **kwargs)
+
+    def stream(self, messages: List[Any], **kwargs) -> Iterator[Any]:
+        """Streamed completions carry no usage; run_agent estimates the tokens instead"""
+        with self._lock:
+            for part in self._llama().create_chat_completion(
+                    messages=_message_dicts(messages), temperature=self.temperature, max_tokens=self.max_tokens,
+                    stream=True):
+                content = part["choices"][0].get("delta", {}).get("content")
+                if content:
+                    yield _ai_chunk(content, None)
+
+    async def astream(self, messages: List[Any], **kwargs) -> AsyncIterator[Any]:
+        chunks = self.stream(messages, **kwargs)
+        done = object()
+        while (chunk := await asyncio.to_thread(next, chunks, done)) is not done:
+            yield chunk
+
+
+class ReplayChatModel:
+    """Record responses of an inner model to disk, keyed on model and prompt, and play them back.
+
+    mode "record" always calls the inner model and saves; "replay" only reads (a miss raises
+    ReplayMiss, so no network call is ever made); "auto" replays when it can and records
+    otherwise. The recorded usage is returned too, so cost accounting replays exactly.
+    latency_scale > 0 sleeps for that share of the recorded latency, for realistic load tests.
+    """
+
+    def __init__(self, inner_factory: Callable[[], Any], label: str, directory: str = REPLAY_DIR,
+                 mode: str = "auto", latency_scale: float = 0.0):
+        if mode not in REPLAY_MODES:
+            raise ValueError(f"Replay mode must be one of {', '.join(REPLAY_MODES)}, got {mode!r}")
+        self.inner_factory = inner_factory
+        self.label = label
+        self.directory = directory
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._inner = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.recorded = 0
+
+    def _client(self):
+        with self._lock:
+            if self._inner is None:
+                self._inner = self.inner_factory()
+            return self._inner
+
+    def key(self, messages: List[Any]) -> str:
+        # cached_content names change per cache upload and are left out of the key
+        payload = json.dumps({"model": self.label, "messages": _message_dicts(messages)}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _load(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, key: str, messages: List[Any], response, latency_ms: float) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        record = {
+            "model": self.label,
+            "messages": _message_dicts(messages),
+            "content": response.content if isinstance(response.content, str) else str(response.content),
+            "usage_metadata": dict(getattr(response, "usage_metadata", None) or {}) or None,
+            "latency_ms": latency_ms,
+            "recorded_at": time.time(),
+        }
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(record, fh, indent=1)
+        os.replace(tmp, path)
+        with self._lock:
+            self.recorded += 1
+
+    def _lookup(self, messages: List[Any]) -> Tuple[str, Optional[Dict[str, Any]]]:
+        key = self.key(messages)
+        record = self._load(key) if self.mode != "record" else None
+        if record is None and self.mode == "replay":
+            raise ReplayMiss(f"No recorded {self.label} response for prompt {key[:12]} in {self.directory}")
+        if record is not None:
+            with self._lock:
+                self.hits += 1
+        return key, record
+
+    def _delay(self, record: Dict[str, Any]) -> float:
+        return self.latency_scale * record.get("latency_ms", 0.0) / 1000
+
+    def invoke(self, messages: List[Any], **kwargs):
+        key, record = self._lookup(messages)
+        if record is not None:
+            time.sleep(self._delay(record))
+            return _ai_message(record["content"], record.get("usage_metadata"))
+        started = time.perf_counter()
+        response = self._client().invoke(messages, **kwargs)
+        self._save(key, messages, response, (time.perf_counter() - started) * 1000)
+        return response
+
+    async def ainvoke(self, messages: List[Any], **kwargs):
+        key, record = self._lookup(messages)
+        if record is not None:
+            await asyncio.sleep(self._delay(record))
+            return _ai_message(record["content"], record.get("usage_metadata"))
+        started = time.perf_counter()
+        response = await self._client().ainvoke(messages, **kwargs)
+        self._save(key, messages, response, (time.perf_counter() - started) * 1000)
+        return response
+
+    def stream(self, messages: List[Any], **kwargs) -> Iterator[Any]:
+        """A recorded response replays as one chunk; a new one is streamed through and saved whole"""
+        key, record = self._lookup(messages)
+        if record is not None:
+            time.sleep(self._delay(record))
+            yield _ai_chunk(record["content"], record.get("usage_metadata"))
+            return
+        started = time.perf_counter()
+        response = None
+        for chunk in stream_chunks(self._client(), messages, **kwargs):
+            response = chunk if response is None else response + chunk
+            yield chunk
+        if response is not None:
+            self._save(key, messages, response, (time.perf_counter() - started) * 1000)
+
+    async def astream(self, messages: List[Any], **kwargs) -> AsyncIterator[Any]:
+        key, record = self._lookup(messages)
+        if record is not None:
+            await asyncio.sleep(self._delay(record))
+            yield _ai_chunk(record["content"], record.get("usage_metadata"))
+            return
+        started = time.perf_counter()
+        response = None
+        async for chunk in astream_chunks(self._client(), messages, **kwargs):
+            response = chunk if response is None else response + chunk
+            yield chunk
+        if response is not None:
+            self._save(key, messages, response, (time.perf_counter() - started) * 1000)
+
+
+def _google(spec: ModelSpec):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    kwargs = {}
+    api_key = os.getenv(spec.option("api_key_env", "GOOGLE_API_KEY")) or os.getenv("GEMINI_API_KEY")
+    if api_key:
+        kwargs["google_api_key"] = api_key
+    if spec.option("timeout"):
+        kwargs["timeout"] = float(spec.option("timeout"))
+    return ChatGoogleGenerativeAI(model=spec.model, temperature=spec.temperature, **kwargs)
+
+
+def _openai(spec: ModelSpec):
+    from langchain_openai import ChatOpenAI
+    kwargs = {}
+    if spec.option("timeout"):
+        kwargs["timeout"] = float(spec.option("timeout"))
+    return ChatOpenAI(model=spec.model, temperature=spec.temperature, **kwargs)
+
+
+def _local(spec: ModelSpec):
+    model_path = spec.option("model_path") or os.getenv("LOCAL_MODEL_PATH")
+    if not model_path:
+        raise ValueError(f"Backend {spec.name} needs a model_path (agents.yaml) or LOCAL_MODEL_PATH to a GGUF file")
+    return LlamaCppChatModel(model_path, spec.temperature, n_ctx=int(spec.option("n_ctx", 8192)),
+                             n_threads=spec.option("n_threads"), max_tokens=int(spec.option("max_tokens", 1024)))
+
+
+def _fake(spec: ModelSpec):
+    from utils.fake_llm import FAKE_SQL, FakeChatModel
+    return FakeChatModel(latency=float(spec.option("latency", 0.0)), jitter=float(spec.option("jitter", 0.0)),
+                         failure_rate=float(spec.option("failure_rate", 0.0)),
+                         response=spec.option("response", FAKE_SQL), seed=spec.option("seed"))
+
+
+_FACTORIES: Dict[str, Callable[[ModelSpec], Any]] = {
+    "google": _google,
+    "openai": _openai,
+    "local": _local,
+    "fake": _fake,
+}
+
+
+def register_backend(provider: str, factory: Callable[[ModelSpec], Any]) -> Optional[Callable[[ModelSpec], Any]]:
+    """Add a provider: factory(spec) returns an object with invoke/ainvoke(messages, **kwargs),
+    optionally stream/astream. Returns the factory it replaced, if any"""
+    previous = _FACTORIES.get(provider.lower())
+    _FACTORIES[provider.lower()] = factory
+    return previous
+
+
+def unregister_backend(provider: str) -> None:
+    _FACTORIES.pop(provider.lower(), None)
+
+
+def create_client(spec: ModelSpec):
+    factory = _FACTORIES.get(spec.provider)
+    if factory is None:
+        raise ValueError(f"Unknown LLM backend {spec.provider!r} in {spec.name}; "
+                         f"known: {', '.join(sorted(_FACTORIES))}")
+    return factory(spec)
+
+
+# ---------- registry ----------
+def load_agent_specs(path: str = AGENTS_CONFIG_PATH) -> Dict[str, ModelSpec]:
+    """ModelSpec per agents.yaml entry; entries without a model use the default.
+    A missing file means defaults; a malformed one raises ValueError naming the file and key"""
+    import yaml
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            config = yaml.safe_load(fh) or {}
+    except OSError:
+        return {}
+    except yaml.YAMLError as e:
+        raise ValueError(f"{path} is not valid YAML: {e}") from e
+    if not isinstance(config, dict):
+        raise ValueError(f"{path}: expected agent names mapped to their settings, got {type(config).__name__}")
+    specs = {}
+    for agent, entry in config.items():
+        entry = entry or {}
+        if not isinstance(entry, dict):
+            raise ValueError(f"{path}: {agent}: expected a mapping of settings, got {type(entry).__name__}")
+        model = entry.get("model", DEFAULT_MODEL)
+        if not isinstance(model, str) or not model.strip():
+            raise ValueError(f"{path}: {agent}.model must be \"provider/model\", got {model!r}")
+        try:
+            temperature = float(entry.get("temperature", DEFAULT_TEMPERATURE))
+        except (TypeError, ValueError):
+            raise ValueError(f"{path}: {agent}.temperature must be a number, got {entry['temperature']!r}") from None
+        options = {k: v for k, v in entry.items() if k not in _PERSONA_KEYS}
+        specs[agent] = ModelSpec.parse(model, temperature, **options)
+    return specs
+
+
+class BackendRegistry:
+    """Stage -> agent -> ModelSpec -> client; agents on the same spec share one client.
+    timeout (seconds) bounds each request of the hosted clients unless agents.yaml sets one"""
+
+    def __init__(self, agents: Dict[str, ModelSpec], default: Optional[ModelSpec] = None,
+                 replay_mode: Optional[str] = None, replay_dir: str = REPLAY_DIR, replay_latency_scale: float = 0.0,
+                 timeout: Optional[float] = None):
+        self.agents = agents
+        self.default = default or ModelSpec.parse(DEFAULT_MODEL)
+        self.replay_mode = replay_mode
+        self.replay_dir = replay_dir
+        self.replay_latency_scale = replay_latency_scale
+        self.timeout = timeout
+        self._clients: Dict[ModelSpec, Any] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, path: str = AGENTS_CONFIG_PATH, override: Optional[str] = None,
+                    replay_mode: Optional[str] = None, replay_dir: str = REPLAY_DIR,
+                    replay_latency_scale: float = 0.0, timeout: Optional[float] = None) -> "BackendRegistry":
+        """override ("fake/sql", "local/qwen", ...) points every agent at one backend"""
+        agents = load_agent_specs(path)
+        if override:
+            forced = ModelSpec.parse(override)
+            agents = {name: ModelSpec(forced.provider, forced.model, spec.temperature, spec.options)
+                      for name, spec in agents.items()}
+            return cls(agents, forced, replay_mode, replay_dir, replay_latency_scale, timeout)
+        return cls(agents, None, replay_mode, replay_dir, replay_latency_scale, timeout)
+
+    @classmethod
+    def from_env(cls, path: str = AGENTS_CONFIG_PATH, timeout: Optional[float] = None) -> "BackendRegistry":
+        """LLM_BACKEND overrides every agent; LLM_REPLAY=record|replay|auto wraps them in replay"""
+        return cls.from_config(
+            path,
+            override=os.getenv("LLM_BACKEND") or None,
+            replay_mode=os.getenv("LLM_REPLAY") or None,
+            replay_dir=os.getenv("LLM_REPLAY_DIR", REPLAY_DIR),
+            replay_latency_scale=float(os.getenv("LLM_REPLAY_LATENCY_SCALE", "0")),
+            timeout=timeout,
+        )
+
+    def spec(self, stage: str) -> ModelSpec:
+        return self.agents.get(STAGE_AGENTS.get(stage, stage), self.default)
+
+    def client(self, stage: str):
+        spec = self.spec(stage)
+        with self._lock:
+            client = self._clients.get(spec)
+            if client is None:
+                built = spec
+                if self.timeout and spec.option("timeout") is None:
+                    built = ModelSpec(spec.provider, spec.model, spec.temperature,
+                                      tuple(sorted({**dict(spec.options), "timeout": self.timeout}.items())))
+                if self.replay_mode:
+                    client = ReplayChatModel(lambda: create_client(built), spec.name, self.replay_dir,
+                                             self.replay_mode, self.replay_latency_scale)
+                else:
+                    client = create_client(built)
+                self._clients[spec] = client
+            return client
+
+    def describe(self) -> Dict[str, str]:
+        """Model per stage, for logs and the UI"""
+        return {stage: self.spec(stage).name for stage in STAGE_AGENTS}
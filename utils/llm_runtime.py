@@ -0,0 +1,151 @@
+"""
+Resilient LLM invocation: jittered exponential backoff, a process-wide concurrency
+limiter with a token bucket for provider rate limits, and per-call timeouts
+"""
+
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Provider exceptions are matched by name so google/openai SDKs stay optional imports
+RETRYABLE_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "RateLimitError", "ServiceUnavailable",
+    "DeadlineExceeded", "InternalServerError", "APITimeoutError", "APIConnectionError",
+    "ConnectError", "ReadTimeout", "FakeTransientError",
+}
+
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    return any(cls.__name__ in RETRYABLE_ERROR_NAMES for cls in type(exc).__mro__)
+
+
+@dataclass
+class RetryPolicy:
+    max_attempts: int = 4
+    base_delay: float = 0.5
+    max_delay: float = 8.0
+    timeout: Optional[float] = 60.0
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff for the given 1-based attempt"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class RateLimiter:
+    """Process-wide limiter shared by sync threads and any number of event loops.
+
+    Bounds in-flight calls with a semaphore and smooths request starts with a token
+    bucket (rate_per_sec, burst). Async waiters poll instead of blocking the loop.
+    """
+
+    def __init__(self, max_concurrency: int = 8, rate_per_sec: Optional[float] = None, burst: int = 1):
+        self.max_concurrency = max_concurrency
+        self.rate_per_sec = rate_per_sec
+        self.burst = max(1, burst)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+
+    def _take_token(self) -> float:
+        """Consume a token if available; otherwise return seconds until one is"""
+        if not self.rate_per_sec:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate_per_sec)
+            self._refilled = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate_per_sec
+
+    def acquire(self) -> None:
+        self._slots.acquire()
+        try:
+            while (wait := self._take_token()) > 0:
+                time.sleep(wait)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def acquire_async(self) -> None:
+        delay = 0.002
+        while not self._slots.acquire(blocking=False):
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        try:
+            while (wait := self._take_token()) > 0:
+                await asyncio.sleep(wait)
+        except BaseException:
+            # Includes CancelledError: never leak a slot on cancellation
+            self._slots.release()
+            raise
+
+    def release(self) -> None:
+        self._slots.release()
+
+
+def call_with_retries(fn: Callable[[], T], policy: RetryPolicy, limiter: Optional[RateLimiter] = None,
+                      on_retry: Optional[Callable[[int, BaseException], None]] = None, hold: bool = False) -> T:
+    """Blocking variant: a blocking call cannot be abandoned from here, so policy.timeout is the
+    provider client's own request timeout (BackendRegistry passes it to the hosted clients).
+
+    With hold, a successful attempt keeps its limiter slot and the caller releases it: a stream
+    occupies the slot until its last chunk, not just until the first.
+    """
+    for attempt in range(1, policy.max_attempts + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            result = fn()
+        except BaseException as e:
+            if limiter:
+                limiter.release()
+            if not isinstance(e, Exception) or attempt == policy.max_attempts or not is_retryable(e):
+                raise
+            if on_retry:
+                on_retry(attempt, e)
+        else:
+            if limiter and not hold:
+                limiter.release()
+            return result
+        time.sleep(policy.backoff(attempt))
+    raise RuntimeError("unreachable")
+
+
+async def acall_with_retries(fn: Callable[[], Awaitable[T]], policy: RetryPolicy,
+                             limiter: Optional[RateLimiter] = None,
+                             on_retry: Optional[Callable[[int, BaseException], None]] = None,
+                             hold: bool = False) -> T:
+    """Async variant: each attempt is bounded by policy.timeout and cancellable by the caller;
+    hold as for call_with_retries"""
+    for attempt in range(1, policy.max_attempts + 1):
+        if limiter:
+            await limiter.acquire_async()
+        try:
+            if policy.timeout:
+                result = await asyncio.wait_for(fn(), timeout=policy.timeout)
+            else:
+                result = await fn()
+        except BaseException as e:
+            # Includes CancelledError, which is re-raised without a retry
+            if limiter:
+                limiter.release()
+            if not isinstance(e, Exception) or attempt == policy.max_attempts or not is_retryable(e):
+                raise
+            if on_retry:
+                on_retry(attempt, e)
+        else:
+            if limiter and not hold:
+                limiter.release()
+            return result
+        await asyncio.sleep(policy.backoff(attempt))
+    raise RuntimeError("unreachable")
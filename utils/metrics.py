@@ -0,0 +1,214 @@
+"""
+Per-stage LLM telemetry: latency (and time to first token for streamed calls), token and
+cost for every agent call, kept as in-process
+aggregates and exported to a local SQLite table and/or a Prometheus text-format file
+(suitable for node_exporter's textfile collector)
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import warnings
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+METRICS_DB_PATH = os.path.join(".cache", "llm_metrics.sqlite")
+PROMETHEUS_PATH = os.path.join(".cache", "llm_metrics.prom")
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_calls (
+    ts REAL NOT NULL,
+    stage TEXT NOT NULL,
+    model TEXT NOT NULL,
+    status TEXT NOT NULL,
+    latency_ms REAL NOT NULL,
+    prompt_tokens INTEGER NOT NULL,
+    completion_tokens INTEGER NOT NULL,
+    cached_tokens INTEGER NOT NULL,
+    cost REAL NOT NULL,
+    token_source TEXT NOT NULL,
+    first_token_ms REAL
+);
+CREATE INDEX IF NOT EXISTS llm_calls_stage_ts ON llm_calls (stage, ts);
+"""
+
+
+@dataclass
+class CallMetric:
+    stage: str
+    model: str
+    latency_ms: float
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost: float = 0.0
+    token_source: str = "usage"      # "usage" (provider usage_metadata) or "estimate" (tokenizer)
+    status: str = "ok"               # "ok" or "error"
+    ts: float = field(default_factory=time.time)
+    first_token_ms: Optional[float] = None   # streamed calls only: wait until the first chunk
+
+
+@dataclass
+class _Series:
+    calls: int = 0
+    latency_sum: float = 0.0
+    buckets: List[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost: float = 0.0
+    streamed: int = 0
+    first_token_sum: float = 0.0
+    first_token_buckets: List[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRecorder:
+    """Thread-safe; either sink may be None, the in-memory aggregates are always kept"""
+
+    def __init__(self, sqlite_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        self.sqlite_path = sqlite_path
+        self.prometheus_path = prometheus_path
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str, str], _Series] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._sink_failed = False
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.sqlite_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.sqlite_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+            # Tables created before first_token_ms was recorded
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(llm_calls)")}
+            if "first_token_ms" not in columns:
+                self._conn.execute("ALTER TABLE llm_calls ADD COLUMN first_token_ms REAL")
+        return self._conn
+
+    def record(self, metric: CallMetric) -> None:
+        with self._lock:
+            series = self._series.setdefault((metric.stage, metric.model, metric.status), _Series())
+            series.calls += 1
+            seconds = metric.latency_ms / 1000
+            series.latency_sum += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    series.buckets[i] += 1
+            series.prompt_tokens += metric.prompt_tokens
+            series.completion_tokens += metric.completion_tokens
+            series.cached_tokens += metric.cached_tokens
+            series.cost += metric.cost
+            if metric.first_token_ms is not None:
+                series.streamed += 1
+                first_token = metric.first_token_ms / 1000
+                series.first_token_sum += first_token
+                for i, bound in enumerate(LATENCY_BUCKETS):
+                    if first_token <= bound:
+                        series.first_token_buckets[i] += 1
+            try:
+                if self.sqlite_path:
+                    row = asdict(metric)
+                    self._connection().execute(
+                        f"INSERT INTO llm_calls ({', '.join(row)}) VALUES ({', '.join('?' for _ in row)})",
+                        tuple(row.values()),
+                    )
+                if self.prometheus_path:
+                    self._write_prometheus()
+            except (OSError, sqlite3.Error) as e:
+                # Telemetry must never fail a call the provider has already billed
+                if not self._sink_failed:
+                    self._sink_failed = True
+                    warnings.warn(f"LLM metrics sink unavailable, keeping in-memory aggregates only: {e}",
+                                  RuntimeWarning, stacklevel=2)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Per stage: calls, errors, mean latency, mean time to first token of streamed calls, tokens and cost"""
+        with self._lock:
+            stages: Dict[str, Dict[str, float]] = {}
+            for (stage, _, status), s in self._series.items():
+                agg = stages.setdefault(stage, {"calls": 0, "errors": 0, "latency_ms": 0.0, "prompt_tokens": 0,
+                                                "completion_tokens": 0, "cached_tokens": 0, "cost": 0.0,
+                                                "streamed": 0, "first_token_ms": 0.0})
+                agg["calls"] += s.calls
+                agg["errors"] += s.calls if status == "error" else 0
+                agg["latency_ms"] += s.latency_sum * 1000
+                agg["streamed"] += s.streamed
+                agg["first_token_ms"] += s.first_token_sum * 1000
+                for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "cost"):
+                    agg[key] += getattr(s, key)
+            for agg in stages.values():
+                agg["latency_ms"] = agg["latency_ms"] / agg["calls"] if agg["calls"] else 0.0
+                agg["first_token_ms"] = agg["first_token_ms"] / agg["streamed"] if agg["streamed"] else 0.0
+            return stages
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            return self._render()
+
+    def _render(self) -> str:
+        lines = []
+
+        def family(name: str, kind: str, help_text: str) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        items = sorted(self._series.items())
+        family("llm_calls_total", "counter", "LLM agent calls by stage, model and outcome")
+        for (stage, model, status), s in items:
+            lines.append(f'llm_calls_total{{stage="{_label(stage)}",model="{_label(model)}",status="{status}"}} {s.calls}')
+        family("llm_call_duration_seconds", "histogram", "Wall time of LLM agent calls, retries included")
+        for (stage, model, status), s in items:
+            labels = f'stage="{_label(stage)}",model="{_label(model)}",status="{status}"'
+            for bound, count in zip(LATENCY_BUCKETS, s.buckets):
+                lines.append(f'llm_call_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'llm_call_duration_seconds_bucket{{{labels},le="+Inf"}} {s.calls}')
+            lines.append(f"llm_call_duration_seconds_sum{{{labels}}} {s.latency_sum:.6f}")
+            lines.append(f"llm_call_duration_seconds_count{{{labels}}} {s.calls}")
+        family("llm_time_to_first_token_seconds", "histogram", "Wait until the first chunk of streamed LLM agent calls")
+        for (stage, model, status), s in items:
+            if not s.streamed:
+                continue
+            labels = f'stage="{_label(stage)}",model="{_label(model)}",status="{status}"'
+            for bound, count in zip(LATENCY_BUCKETS, s.first_token_buckets):
+                lines.append(f'llm_time_to_first_token_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'llm_time_to_first_token_seconds_bucket{{{labels},le="+Inf"}} {s.streamed}')
+            lines.append(f"llm_time_to_first_token_seconds_sum{{{labels}}} {s.first_token_sum:.6f}")
+            lines.append(f"llm_time_to_first_token_seconds_count{{{labels}}} {s.streamed}")
+        for name, attr, help_text in (
+            ("llm_prompt_tokens_total", "prompt_tokens", "Prompt tokens billed"),
+            ("llm_completion_tokens_total", "completion_tokens", "Completion tokens billed"),
+            ("llm_cached_tokens_total", "cached_tokens", "Prompt tokens served from the provider's context cache"),
+            ("llm_cost_usd_total", "cost", "Estimated spend in USD"),
+        ):
+            family(name, "counter", help_text)
+            for (stage, model, status), s in items:
+                lines.append(f'{name}{{stage="{_label(stage)}",model="{_label(model)}",status="{status}"}} '
+                             f"{getattr(s, attr):.9g}")
+        return "\n".join(lines) + "\n"
+
+    def _write_prometheus(self) -> None:
+        # Written to a temp file and renamed so a scraper never reads half a file
+        directory = os.path.dirname(self.prometheus_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.prometheus_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            fh.write(self._render())
+        os.replace(tmp, self.prometheus_path)
+
+
+def recorder_from_env(setting: str) -> MetricsRecorder:
+    """setting is a comma list of sinks: "sqlite", "prometheus" (or "off" for memory only)"""
+    sinks = {s.strip().lower() for s in setting.split(",")}
+    return MetricsRecorder(
+        sqlite_path=METRICS_DB_PATH if "sqlite" in sinks else None,
+        prometheus_path=PROMETHEUS_PATH if "prometheus" in sinks else None,
+    )
@@ -0,0 +1,139 @@
+"""
+Small DAG orchestrator: runs independent pipeline stages (LLM calls) concurrently on a
+thread pool with per-stage timeouts, and reports time saved against the serial path
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+@dataclass
+class Stage:
+    """A pipeline step; fn receives the results of its dependencies keyed by stage name"""
+    name: str
+    fn: Callable[[Dict[str, Any]], Any]
+    deps: Tuple[str, ...] = ()
+    timeout: Optional[float] = None
+
+
+@dataclass
+class StageResult:
+    name: str
+    value: Any = None
+    error: Optional[BaseException] = None
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class StageSkipped(RuntimeError):
+    """Raised for stages whose dependencies failed or timed out"""
+
+
+@dataclass
+class PipelineResult:
+    results: Dict[str, StageResult] = field(default_factory=dict)
+    wall_time: float = 0.0
+
+    @property
+    def serial_time(self) -> float:
+        """What the same stages would have taken run one after another"""
+        return sum(r.elapsed for r in self.results.values())
+
+    @property
+    def time_saved(self) -> float:
+        return max(0.0, self.serial_time - self.wall_time)
+
+    def value(self, name: str) -> Any:
+        """Stage output, re-raising the stage's error if it failed"""
+        result = self.results[name]
+        if result.error is not None:
+            raise result.error
+        return result.value
+
+
+def _check_dag(stages: List[Stage]) -> None:
+    names = {s.name for s in stages}
+    if len(names) != len(stages):
+        raise ValueError("Stage names must be unique")
+    for stage in stages:
+        missing = set(stage.deps) - names
+        if missing:
+            raise ValueError(f"Stage '{stage.name}' depends on unknown stages: {sorted(missing)}")
+    resolved: set = set()
+    remaining = list(stages)
+    while remaining:
+        ready = [s for s in remaining if set(s.deps) <= resolved]
+        if not ready:
+            raise ValueError(f"Cycle between stages: {[s.name for s in remaining]}")
+        resolved.update(s.name for s in ready)
+        remaining = [s for s in remaining if s.name not in resolved]
+
+
+def run_pipeline(stages: List[Stage], max_workers: Optional[int] = None,
+                 default_timeout: Optional[float] = None) -> PipelineResult:
+    """Run stages as soon as their dependencies succeed; failures skip their dependents"""
+    _check_dag(stages)
+    pending = {s.name: s for s in stages}
+    outcome = PipelineResult()
+    running: Dict[Future, Tuple[Stage, float]] = {}
+    start = time.perf_counter()
+
+    def timed(stage: Stage, inputs: Dict[str, Any]) -> Tuple[Any, float]:
+        stage_start = time.perf_counter()
+        value = stage.fn(inputs)
+        return value, time.perf_counter() - stage_start
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or len(stages), thread_name_prefix="pipeline")
+    try:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                failed = [d for d in stage.deps if d in outcome.results and not outcome.results[d].ok]
+                if failed:
+                    outcome.results[name] = StageResult(
+                        name, error=StageSkipped(f"Skipped '{name}': dependency {failed[0]} failed")
+                    )
+                    del pending[name]
+                elif all(d in outcome.results for d in stage.deps):
+                    inputs = {d: outcome.results[d].value for d in stage.deps}
+                    running[executor.submit(timed, stage, inputs)] = (stage, time.perf_counter())
+                    del pending[name]
+            if not running:
+                continue
+
+            now = time.perf_counter()
+            deadlines = [
+                started + (stage.timeout or default_timeout) - now
+                for stage, started in running.values()
+                if (stage.timeout or default_timeout)
+            ]
+            done, _ = wait(running, timeout=max(0.0, min(deadlines)) if deadlines else None,
+                           return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, started = running.pop(future)
+                try:
+                    value, elapsed = future.result()
+                    outcome.results[stage.name] = StageResult(stage.name, value=value, elapsed=elapsed)
+                except Exception as e:
+                    outcome.results[stage.name] = StageResult(
+                        stage.name, error=e, elapsed=time.perf_counter() - started
+                    )
+            now = time.perf_counter()
+            for future, (stage, started) in list(running.items()):
+                limit = stage.timeout or default_timeout
+                if limit and now - started >= limit:
+                    # The worker thread cannot be killed; abandon it and move on
+                    future.cancel()
+                    running.pop(future)
+                    outcome.results[stage.name] = StageResult(
+                        stage.name, error=TimeoutError(f"Stage '{stage.name}' timed out after {limit:g}s"),
+                        elapsed=now - started,
+                    )
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    outcome.wall_time = time.perf_counter() - start
+    return outcome
@@ -0,0 +1,114 @@
+"""
+Prompt prefix caching: the invariant domain context + schema is built once per schema,
+hashed, and reused byte-for-byte so provider-side context caching can apply
+"""
+
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    """The static part of every agent prompt, with its hash and token count computed once"""
+    text: str
+    digest: str
+    tokens: int
+
+
+class PromptCacheStats:
+    """Thread-safe counters for prefix tokens served from cache.
+
+    tokens_saved is what the provider reported as cache reads (billed at the cached rate);
+    the TTL-based count of prefixes sent while still warm is only an estimate of reuse.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = 0
+            self.prefix_tokens = 0
+            self.warm_tokens = 0
+            self.provider_cached_tokens = 0
+
+    def record(self, prefix: PromptPrefix, cache_hit: bool, provider_cached_tokens: int = 0) -> None:
+        with self._lock:
+            self.calls += 1
+            self.prefix_tokens += prefix.tokens
+            if cache_hit:
+                self.warm_tokens += prefix.tokens
+            self.provider_cached_tokens += provider_cached_tokens
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "prefix_tokens": self.prefix_tokens,
+                "tokens_saved": self.provider_cached_tokens,
+                "hit_rate": self.provider_cached_tokens / self.prefix_tokens if self.prefix_tokens else 0.0,
+                "estimated_reused_tokens": self.warm_tokens,
+                "estimated_hit_rate": self.warm_tokens / self.prefix_tokens if self.prefix_tokens else 0.0,
+            }
+
+
+class PromptPrefixCache:
+    """Builds prefixes once per content hash and tracks which are warm within the TTL.
+
+    When a provider cache factory is supplied (e.g. Gemini explicit context caching)
+    the prefix is uploaded once per model and referenced by name; otherwise this acts
+    as the local stand-in that keeps the prefix stable and meters reuse.
+    """
+
+    def __init__(self, token_counter: Callable[[str], int], ttl_seconds: int = 3600,
+                 provider_factory: Optional[Callable[[PromptPrefix, str], str]] = None):
+        self.token_counter = token_counter
+        self.ttl_seconds = ttl_seconds
+        self.provider_factory = provider_factory
+        self.stats = PromptCacheStats()
+        self._prefixes: Dict[str, PromptPrefix] = {}
+        self._warm_until: Dict[str, float] = {}
+        self._provider_names: Dict[Tuple[str, str], Tuple[Optional[str], float]] = {}
+        self._lock = threading.Lock()
+
+    def prefix(self, *parts: str) -> PromptPrefix:
+        text = "\n\n".join(parts)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._prefixes.get(digest)
+            if cached is None:
+                cached = PromptPrefix(text=text, digest=digest, tokens=self.token_counter(text))
+                self._prefixes[digest] = cached
+            return cached
+
+    def touch(self, prefix: PromptPrefix) -> bool:
+        """Mark prefix as used now; True if it was already warm (a cache hit)"""
+        now = time.monotonic()
+        with self._lock:
+            hit = self._warm_until.get(prefix.digest, 0.0) > now
+            self._warm_until[prefix.digest] = now + self.ttl_seconds
+            return hit
+
+    def provider_cache_name(self, prefix: PromptPrefix, model: str) -> Optional[str]:
+        """Name of the provider-side cache for prefix on model, creating it on first use
+        (a cache only serves the model it was created for)"""
+        if self.provider_factory is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            name, expires = self._provider_names.get((prefix.digest, model), (None, 0.0))
+            if expires > now:
+                return name
+            try:
+                name = self.provider_factory(prefix, model)
+            except Exception:
+                # Too-short prefix, unsupported model or no credentials: fall back
+                # to the local stand-in and do not retry until the TTL runs out
+                name = None
+            # Refresh a little before the provider expires the cache
+            self._provider_names[(prefix.digest, model)] = (name, now + self.ttl_seconds * 0.9)
+            return name
@@ -0,0 +1,444 @@
+"""
+Cursor-based query execution: streams rows with fetchmany and serves typed result pages,
+under optional wall-clock / VM-step budgets and cooperative cancellation
+"""
+
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from utils.connection_pool import DEFAULT_POOL_SIZE, get_pool
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_PAGE_SIZE = 50
+# VM instructions between progress-handler checks: frequent enough to stop within
+# milliseconds, rare enough to cost nothing measurable
+PROGRESS_CHECK_INTERVAL = 1000
+
+
+@dataclass
+class QueryBudget:
+    """Per-query limits; None disables a limit"""
+    timeout: Optional[float] = None
+    max_vm_steps: Optional[int] = None
+
+
+class QueryInterrupted(RuntimeError):
+    """The query was stopped by its budget or by the user; carries the partial timing"""
+
+    def __init__(self, message: str, elapsed_ms: float, vm_steps: int, rows: int):
+        super().__init__(message)
+        self.elapsed_ms = elapsed_ms
+        self.vm_steps = vm_steps
+        self.rows = rows
+
+    def __reduce__(self):
+        # Keep the partial timing when the error crosses a process boundary
+        return type(self), (str(self), self.elapsed_ms, self.vm_steps, self.rows)
+
+
+class QueryTimeout(QueryInterrupted):
+    """Wall-clock or VM-step budget exhausted"""
+
+
+class QueryCancelled(QueryInterrupted):
+    pass
+
+
+class CancelToken:
+    """Progress and cancellation for one running query, safe to use from another thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._cancelled = False
+        self.started = time.perf_counter()
+        self.vm_steps = 0
+        self.rows = 0
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def cancel(self) -> None:
+        """Stop the query now; interrupt() aborts even a step that never yields to the handler"""
+        with self._lock:
+            self._cancelled = True
+            if self._conn is not None:
+                self._conn.interrupt()
+
+    def _attach(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._conn = conn
+            if self._cancelled:
+                conn.interrupt()
+
+    def _detach(self) -> None:
+        # Detached before the connection goes back to the pool so a late cancel()
+        # can never interrupt somebody else's query
+        with self._lock:
+            self._conn = None
+
+
+@contextmanager
+def budgeted(conn: sqlite3.Connection, budget: Optional[QueryBudget] = None,
+             token: Optional[CancelToken] = None) -> Iterator[CancelToken]:
+    """Enforce budget and token on conn via its progress handler for the enclosed work"""
+    token = token or CancelToken()
+    budget = budget or QueryBudget()
+    token.started = time.perf_counter()  # time in a queue does not count against the budget
+    deadline = token.started + budget.timeout if budget.timeout else None
+
+    def check() -> int:
+        token.vm_steps += PROGRESS_CHECK_INTERVAL
+        if token.cancelled:
+            token.reason = "cancelled"
+        elif deadline is not None and time.perf_counter() > deadline:
+            token.reason = "timeout"
+        elif budget.max_vm_steps and token.vm_steps > budget.max_vm_steps:
+            token.reason = "steps"
+        return 1 if token.reason else 0
+
+    conn.set_progress_handler(check, PROGRESS_CHECK_INTERVAL)
+    token._attach(conn)
+    try:
+        yield token
+    except sqlite3.OperationalError as e:
+        if "interrupted" not in str(e):
+            raise
+        reason = token.reason or "cancelled"
+        args = (token.elapsed_ms, token.vm_steps, token.rows)
+        if reason == "timeout":
+            raise QueryTimeout(f"Query timed out after {budget.timeout:g}s", *args) from e
+        if reason == "steps":
+            raise QueryTimeout(f"Query exceeded {budget.max_vm_steps:,} VM steps", *args) from e
+        raise QueryCancelled("Query cancelled", *args) from e
+    finally:
+        token._detach()
+        conn.set_progress_handler(None, 0)
+
+
+@dataclass
+class ResultPage:
+    """One page of a query result: column names plus the raw row tuples"""
+    columns: List[str]
+    rows: List[tuple]
+    page: int
+    page_size: int
+    has_more: bool
+
+    @property
+    def offset(self) -> int:
+        return self.page * self.page_size
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame.from_records(self.rows, columns=self.columns)
+
+
+def sqlite_type_name(value) -> str:
+    """Map a Python value returned by sqlite3 back to its SQLite storage class"""
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool) or isinstance(value, int):
+        return "INTEGER"
+    if isinstance(value, float):
+        return "REAL"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "BLOB"
+    return "TEXT"
+
+
+@dataclass
+class QueryResult:
+    """Typed execution result: schema, column arrays and timing, with no string formatting"""
+    columns: List[str]
+    column_types: List[str]
+    data: Dict[str, list] = field(default_factory=dict)
+    row_count: int = 0
+    elapsed_ms: float = 0.0
+    truncated: bool = False
+    engine: str = "sqlite"
+
+    @property
+    def schema(self) -> List[Tuple[str, str]]:
+        return list(zip(self.columns, self.column_types))
+
+    def rows(self) -> List[tuple]:
+        return list(zip(*(self.data[c] for c in self.columns))) if self.columns else []
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame({c: self.data[c] for c in self.columns}, columns=self.columns)
+
+    def to_page(self, page_size: int) -> ResultPage:
+        """Expose the first page_size rows as page 0 so a pager need not re-run the query"""
+        rows = self.rows()
+        return ResultPage(
+            columns=self.columns,
+            rows=rows[:page_size],
+            page=0,
+            page_size=page_size,
+            has_more=self.truncated or len(rows) > page_size,
+        )
+
+
+def unique_columns(names: Sequence[str]) -> List[str]:
+    """Suffix repeated column names (a.npi, b.npi -> npi, npi_1) so they can key column arrays"""
+    seen: Dict[str, int] = {}
+    unique = []
+    for name in names:
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        unique.append(name)
+    return unique
+
+
+def execute_query(db_path: str, sql: str, max_rows: Optional[int] = None,
+                  batch_size: int = DEFAULT_BATCH_SIZE, budget: Optional[QueryBudget] = None,
+                  token: Optional[CancelToken] = None) -> QueryResult:
+    """Run sql and collect up to max_rows rows into per-column arrays.
+
+    Raises QueryTimeout / QueryCancelled with the partial timing when stopped.
+    """
+    start = time.perf_counter()
+    if max_rows is not None:
+        # Read one row past the cap so truncation is detected without counting the rest
+        batch_size = min(batch_size, max_rows + 1)
+    row_count = 0
+    truncated = False
+    with get_pool(db_path).connection() as conn, budgeted(conn, budget, token) as progress:
+        cursor = conn.execute(sql)
+        try:
+            columns = unique_columns([d[0] for d in cursor.description or ()])
+            column_types = ["NULL"] * len(columns)
+            data: Dict[str, list] = {c: [] for c in columns}
+            while not truncated:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    break
+                if max_rows is not None and row_count + len(batch) > max_rows:
+                    batch = batch[:max_rows - row_count]
+                    truncated = True
+                for i, column in enumerate(columns):
+                    values = [row[i] for row in batch]
+                    data[column].extend(values)
+                    if column_types[i] == "NULL":
+                        column_types[i] = next((sqlite_type_name(v) for v in values if v is not None), "NULL")
+                row_count += len(batch)
+                progress.rows = row_count
+        finally:
+            cursor.close()
+    return QueryResult(
+        columns=columns,
+        column_types=column_types,
+        data=data,
+        row_count=row_count,
+        elapsed_ms=(time.perf_counter() - start) * 1000,
+        truncated=truncated,
+    )
+
+
+def is_select(sql: str) -> bool:
+    """True for statements that can be wrapped in a sub-select (SELECT/WITH/VALUES)"""
+    return bool(re.match(r"(?is)^\s*(select|with|values)\b", sql))
+
+
+def paginate_sql(sql: str, limit: int, offset: int = 0) -> Tuple[str, Tuple[int, int]]:
+    """Wrap a SELECT so SQLite applies LIMIT/OFFSET instead of Python slicing the rows"""
+    inner = sql.strip().rstrip(";").strip()
+    return f"SELECT * FROM (\n{inner}\n) LIMIT ? OFFSET ?", (limit, offset)
+
+
+def stream_rows(conn, sql: str, params: Sequence = (), batch_size: int = DEFAULT_BATCH_SIZE
+                ) -> Iterator[Tuple[List[str], List[tuple]]]:
+    """Yield (columns, rows) batches straight from the cursor without materializing the result"""
+    cursor = conn.execute(sql, params)
+    try:
+        columns = [d[0] for d in cursor.description or ()]
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                break
+            yield columns, batch
+    finally:
+        cursor.close()
+
+
+@dataclass
+class PlanStep:
+    """One row of EXPLAIN QUERY PLAN"""
+    id: int
+    parent: int
+    detail: str
+
+    @property
+    def is_full_scan(self) -> bool:
+        # "SCAN t USING COVERING INDEX i" reads only the index and is not flagged; "SCAN t USING
+        # INDEX i" still visits every row, plus a table lookup per row, so it is
+        return self.detail.startswith("SCAN ") and " USING COVERING INDEX " not in self.detail
+
+    @property
+    def uses_temp_btree(self) -> bool:
+        return self.detail.startswith("USE TEMP B-TREE")
+
+
+def explain_plan(conn, sql: str, params: Sequence = ()) -> List[PlanStep]:
+    """SQLite's query plan for sql, without running it"""
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {sql.strip().rstrip(';')}", params).fetchall()
+    return [PlanStep(id=row[0], parent=row[1], detail=row[3]) for row in rows]
+
+
+def fetch_page(db_path: str, sql: str, page: int = 0, page_size: int = DEFAULT_PAGE_SIZE,
+               budget: Optional[QueryBudget] = None) -> ResultPage:
+    """Fetch a single page of results, reading at most page_size + 1 rows from SQLite"""
+    offset = page * page_size
+    with get_pool(db_path).connection() as conn, budgeted(conn, budget):
+        if is_select(sql):
+            paged_sql, params = paginate_sql(sql, page_size + 1, offset)
+            cursor = conn.execute(paged_sql, params)
+        else:
+            # PRAGMA and friends cannot be wrapped; skip to the page on the cursor
+            cursor = conn.execute(sql)
+            while offset > 0 and cursor.fetchmany(min(offset, DEFAULT_BATCH_SIZE)):
+                offset -= min(offset, DEFAULT_BATCH_SIZE)
+        try:
+            columns = [d[0] for d in cursor.description or ()]
+            rows = cursor.fetchmany(page_size + 1)
+        finally:
+            cursor.close()
+    return ResultPage(
+        columns=columns,
+        rows=rows[:page_size],
+        page=page,
+        page_size=page_size,
+        has_more=len(rows) > page_size,
+    )
+
+
+class QueryPager:
+    """Pages through one query's results on a single open cursor: pages are read in order,
+    each exactly once, and kept, so neither paging forward nor back re-runs the statement.
+    A seeded first page (the rows the execute step fetched) is skipped on the cursor."""
+
+    def __init__(self, db_path: str, sql: str, page_size: int = DEFAULT_PAGE_SIZE,
+                 first_page: Optional[ResultPage] = None, budget: Optional[QueryBudget] = None):
+        self.db_path = db_path
+        self.sql = sql
+        self.page_size = page_size
+        self.budget = budget
+        self._pages: Dict[int, ResultPage] = {}
+        self.last_page: Optional[int] = None
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._cursor: Optional[sqlite3.Cursor] = None
+        self._lookahead: List[tuple] = []
+        if first_page is not None:
+            self._pages[0] = first_page
+            if not first_page.has_more:
+                self.last_page = 0
+
+    def _read_next(self) -> None:
+        """Read the page after the last one held from the cursor, opening it on first use"""
+        number = len(self._pages)
+        try:
+            if self._cursor is None:
+                self._conn = get_pool(self.db_path).open_dedicated()
+            with budgeted(self._conn, self.budget):
+                if self._cursor is None:
+                    self._cursor = self._conn.execute(self.sql)
+                    skip = number * self.page_size
+                    while skip > 0 and self._cursor.fetchmany(min(skip, DEFAULT_BATCH_SIZE)):
+                        skip -= min(skip, DEFAULT_BATCH_SIZE)
+                rows = self._lookahead + self._cursor.fetchmany(self.page_size + 1 - len(self._lookahead))
+        except BaseException:
+            self.close()
+            raise
+        self._lookahead = rows[self.page_size:]
+        columns = unique_columns([d[0] for d in self._cursor.description or ()])
+        self._pages[number] = ResultPage(columns=columns, rows=rows[:self.page_size], page=number,
+                                         page_size=self.page_size, has_more=bool(self._lookahead))
+        if not self._lookahead:
+            self.last_page = number
+            self.close()
+
+    def page(self, number: int) -> ResultPage:
+        number = max(0, number)
+        with self._lock:
+            while number not in self._pages and self.last_page is None:
+                self._read_next()
+            if self.last_page is not None:
+                number = min(number, self.last_page)
+            return self._pages[number]
+
+    def close(self) -> None:
+        """Release the cursor and its connection; pages already read stay available"""
+        self._lookahead = []
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __iter__(self) -> Iterator[ResultPage]:
+        number = 0
+        while True:
+            result = self.page(number)
+            yield result
+            if not result.has_more:
+                break
+            number += 1
+
+    @property
+    def columns(self) -> List[str]:
+        return self.page(0).columns
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+@dataclass
+class QueryHandle:
+    """A query running on a background thread; the caller stays free to poll or cancel"""
+    sql: str
+    token: CancelToken
+    future: Future
+
+    def done(self) -> bool:
+        return self.future.done()
+
+    def cancel(self) -> None:
+        self.token.cancel()
+
+    def result(self, timeout: Optional[float] = None) -> QueryResult:
+        return self.future.result(timeout)
+
+    def progress(self) -> Dict[str, float]:
+        return {"elapsed_ms": self.token.elapsed_ms, "vm_steps": self.token.vm_steps, "rows": self.token.rows}
+
+
+def submit_query(db_path: str, sql: str, max_rows: Optional[int] = None,
+                 budget: Optional[QueryBudget] = None, execute=execute_query) -> QueryHandle:
+    """Start execute (execute_query or a drop-in) off the calling thread (e.g. the Streamlit script thread)"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_POOL_SIZE, thread_name_prefix="query")
+    token = CancelToken()
+    future = _executor.submit(execute, db_path, sql, max_rows, DEFAULT_BATCH_SIZE, budget, token)
+    return QueryHandle(sql=sql, token=token, future=future)
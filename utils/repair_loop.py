@@ -0,0 +1,196 @@
+"""
+Self-correcting execution: when SQL fails to validate, plan or run (or returns no rows), the
+error and the offending SQL go back to a repair prompt, and the fix is re-checked and re-run
+locally, within an attempt and token budget
+"""
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from utils.query_engine import QueryCancelled, QueryInterrupted, QueryResult
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_TOKEN_BUDGET = 30_000
+
+EMPTY_RESULT_ERROR = ("The query ran without error but returned no rows. Check filter values against "
+                      "the sample values in the schema notes (case, spelling, codes, year format).")
+
+
+@dataclass
+class RepairAttempt:
+    sql: str
+    stage: str                       # "validate", "compliance", "cost", "execute", "empty" or "ok"
+    error: Optional[str] = None
+    elapsed_ms: float = 0.0
+    result: Optional[QueryResult] = field(default=None, repr=False)
+    tokens: int = 0                  # LLM spend of the checks (compliance can escalate to the LLM)
+    cost: float = 0.0
+
+
+@dataclass
+class RepairOutcome:
+    success: bool
+    sql: str
+    result: Optional[QueryResult] = None
+    attempts: List[RepairAttempt] = field(default_factory=list)
+    tokens: int = 0
+    cost: float = 0.0
+    seconds: float = 0.0
+    stop_reason: str = ""
+
+    @property
+    def repaired(self) -> bool:
+        return self.success and len(self.attempts) > 1
+
+    @property
+    def last_error(self) -> Optional[str]:
+        return self.attempts[-1].error if self.attempts else None
+
+
+class RepairStats:
+    """Process-wide success rate, attempts and time to a correct answer"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.runs = 0
+            self.successes = 0
+            self.attempts = 0
+            self.seconds = 0.0
+
+    def record(self, outcome: RepairOutcome) -> None:
+        with self._lock:
+            self.runs += 1
+            self.successes += outcome.success
+            self.attempts += len(outcome.attempts)
+            self.seconds += outcome.seconds
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "success_rate": self.successes / self.runs if self.runs else 0.0,
+                "mean_attempts": self.attempts / self.runs if self.runs else 0.0,
+                "mean_seconds": self.seconds / self.runs if self.runs else 0.0,
+            }
+
+
+def _normalized(sql: str) -> str:
+    return " ".join(sql.strip().rstrip(";").split()).lower()
+
+
+def run_repair_loop(sql: str,
+                    execute: Callable[[str], QueryResult],
+                    repair: Callable[[str, str], Dict[str, Any]],
+                    validate: Optional[Callable[[str], Any]] = None,
+                    guard: Optional[Callable[[str], Any]] = None,
+                    compliance: Optional[Callable[[str], Dict[str, Any]]] = None,
+                    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                    token_budget: int = DEFAULT_TOKEN_BUDGET,
+                    accept_empty: bool = False,
+                    first_error: Optional[str] = None,
+                    stats: Optional[RepairStats] = None) -> RepairOutcome:
+    """Check, run and, on failure, repair sql until it returns rows or a budget runs out.
+
+    repair(sql, error) returns an agent result ({"text", "cost", "tokens"}). validate returns
+    a ValidationReport, guard a CostVerdict and compliance a check_compliance result; the
+    compliance gate only applies to repaired SQL (the caller already vetted the first one),
+    and its cost and tokens count towards the outcome and the token budget.
+    first_error skips re-running SQL the caller has just seen fail. A user cancel is re-raised.
+    """
+    start = time.perf_counter()
+    outcome = RepairOutcome(success=False, sql=sql)
+    seen = {_normalized(sql)}
+    error = first_error
+    if first_error is not None:
+        outcome.attempts.append(RepairAttempt(sql, "execute", first_error))
+
+    try:
+        while True:
+            if error is None:
+                attempt = _check_and_run(sql, execute, validate, guard,
+                                         compliance if outcome.attempts else None, accept_empty)
+                outcome.attempts.append(attempt)
+                outcome.tokens += attempt.tokens
+                outcome.cost += attempt.cost
+                if attempt.stage == "ok":
+                    # attempt.sql is what ran, i.e. with the cost guard's LIMIT if one was added
+                    outcome.success, outcome.sql = True, attempt.sql
+                    outcome.result = attempt.result
+                    outcome.stop_reason = "ok"
+                    return outcome
+                error = attempt.error
+                if attempt.stage == "compliance":
+                    # A privacy failure is not something to iterate on automatically
+                    outcome.stop_reason = "compliance"
+                    return outcome
+            if len(outcome.attempts) >= max_attempts:
+                outcome.stop_reason = "attempts"
+                return outcome
+            if outcome.tokens >= token_budget:
+                outcome.stop_reason = "tokens"
+                return outcome
+
+            fix = repair(sql, error)
+            outcome.tokens += int(fix.get("tokens", 0))
+            outcome.cost += fix.get("cost", 0.0)
+            candidate = fix.get("text", "").strip()
+            if not candidate or _normalized(candidate) in seen:
+                outcome.stop_reason = "no new fix"
+                return outcome
+            seen.add(_normalized(candidate))
+            sql, error = candidate, None
+    finally:
+        outcome.seconds = time.perf_counter() - start
+        if outcome.success is False and not outcome.stop_reason:
+            outcome.stop_reason = "cancelled"
+        if stats is not None:
+            stats.record(outcome)
+
+
+def _check_and_run(sql: str, execute, validate, guard, compliance, accept_empty: bool) -> RepairAttempt:
+    """One local round: validate, compliance (repairs only), cost guard, then execute"""
+    started = time.perf_counter()
+    spent = {"tokens": 0, "cost": 0.0}
+
+    def attempt(stage: str, error: Optional[str] = None, run_sql: str = sql,
+                result: Optional[QueryResult] = None) -> RepairAttempt:
+        return RepairAttempt(run_sql, stage, error, (time.perf_counter() - started) * 1000, result,
+                             spent["tokens"], spent["cost"])
+
+    if validate is not None:
+        report = validate(sql)
+        if report.status == "invalid":
+            return attempt("validate", "; ".join(report.errors))
+    if compliance is not None:
+        verdict = compliance(sql)
+        spent["tokens"] += int(verdict.get("tokens", 0))
+        spent["cost"] += verdict.get("cost", 0.0)
+        if verdict.get("status") != "compliant":
+            return attempt("compliance", verdict.get("text", "Compliance check failed"))
+    run_sql = sql
+    if guard is not None:
+        try:
+            verdict = guard(sql)
+        except Exception as e:  # the planner rejects what the validator could not see
+            return attempt("validate", f"{type(e).__name__}: {e}")
+        if not verdict.allowed:
+            return attempt("cost", f"Rejected as too expensive: {'; '.join(verdict.reasons) or verdict.summary}. "
+                                   "Add selective filters, join on key columns or aggregate earlier.")
+        run_sql = verdict.sql
+    try:
+        result = execute(run_sql)
+    except QueryCancelled:
+        raise
+    except QueryInterrupted as e:
+        return attempt("execute", f"{e}: the query is too slow; simplify it or filter earlier", run_sql)
+    except Exception as e:
+        return attempt("execute", f"{type(e).__name__}: {e}", run_sql)
+    if result.row_count == 0 and not accept_empty:
+        return attempt("empty", EMPTY_RESULT_ERROR, run_sql)
+    return attempt("ok", run_sql=run_sql, result=result)
@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+Materialized rollups: summary tables for the common payment, referral and KOL-score
+aggregations, refreshed incrementally past each base table's last seen rowid, and a query
+rewriter that routes single-table aggregate queries to the smallest fresh rollup able to
+answer them, so dashboards read a few hundred summary rows instead of the base table
+
+Run from the project directory:
+    python -m utils.rollups [--db dataset/data.sqlite] [--full] [--explain SQL]
+"""
+
+import argparse
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import sqlparse
+from sqlparse import tokens as T
+
+from utils.connection_pool import get_pool
+from utils.query_engine import is_select
+from utils.schema_catalog import MATERIALIZED_PREFIX, SchemaCatalog, quote_identifier
+from utils.sql_tokens import CLAUSES, norm_identifier
+
+STATE_TABLE = f"{MATERIALIZED_PREFIX}rollup_state"
+AGGREGATES = {"COUNT", "SUM", "AVG", "TOTAL", "MIN", "MAX"}
+# Per-row functions that commute with pre-aggregation. Any other NAME(...) may aggregate
+# (group_concat, string_agg, json_group_array, user functions) and blocks routing
+SCALAR_FUNCTIONS = {
+    "ABS", "CAST", "CEIL", "CEILING", "CHAR", "COALESCE", "CONCAT", "CONCAT_WS", "DATE", "DATETIME",
+    "FLOOR", "FORMAT", "HEX", "IFNULL", "IIF", "INSTR", "JULIANDAY", "LENGTH", "LOWER", "LTRIM",
+    "NULLIF", "PRINTF", "QUOTE", "REPLACE", "ROUND", "RTRIM", "SIGN", "STRFTIME", "SUBSTR",
+    "SUBSTRING", "TIME", "TRIM", "TYPEOF", "UNICODE", "UNIXEPOCH", "UPPER",
+}
+# Keywords that may directly precede a parenthesis without being a function call
+_OPERATOR_KEYWORDS = {"AND", "OR", "NOT", "IN", "IS", "BETWEEN", "LIKE", "GLOB", "WHEN", "THEN", "ELSE",
+                      "DISTINCT", "ON"}
+
+
+@dataclass(frozen=True)
+class Rollup:
+    """GROUP BY dimensions over base, with row_count plus sum/count/min/max of each measure"""
+    name: str
+    base: str
+    dimensions: Tuple[str, ...]
+    measures: Tuple[str, ...] = ()
+
+    @property
+    def measure_columns(self) -> List[Tuple[str, str]]:
+        """(rollup column, aggregate over the base)"""
+        columns = [("row_count", "COUNT(*)")]
+        for measure in self.measures:
+            quoted = quote_identifier(measure)
+            for agg in ("sum", "count", "min", "max"):
+                columns.append((f"{agg}_{norm_identifier(measure)}", f"{agg.upper()}({quoted})"))
+        return columns
+
+    @property
+    def definition(self) -> str:
+        """Changes whenever the rollup must be rebuilt from scratch"""
+        text = repr((self.base, self.dimensions, self.measures))
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+    def aggregate_sql(self, source: str, where: str = "") -> str:
+        dims = ", ".join(quote_identifier(d) for d in self.dimensions)
+        measures = ", ".join(f"{expr} AS {quote_identifier(col)}" for col, expr in self.measure_columns)
+        return f"SELECT {dims}, {measures} FROM {source}{where} GROUP BY {dims}"
+
+    def merge_sql(self, source: str) -> str:
+        """Re-aggregate partial rollups (the table plus a delta) into one row per group"""
+        dims = ", ".join(quote_identifier(d) for d in self.dimensions)
+        merged = []
+        for col, _ in self.measure_columns:
+            combine = "MIN" if col.startswith("min_") else "MAX" if col.startswith("max_") else "SUM"
+            merged.append(f"{combine}({quote_identifier(col)}) AS {quote_identifier(col)}")
+        return f"SELECT {dims}, {', '.join(merged)} FROM ({source}) GROUP BY {dims}"
+
+
+ROLLUPS: List[Rollup] = [
+    Rollup(f"{MATERIALIZED_PREFIX}payments_by_firm_year", "Payments to HCPs",
+           ("life_science_firm_name", "year"), ("amount",)),
+    Rollup(f"{MATERIALIZED_PREFIX}payments_by_firm_product_nature_year", "Payments to HCPs",
+           ("life_science_firm_name", "product_name", "nature_of_payment", "year"), ("amount",)),
+    Rollup(f"{MATERIALIZED_PREFIX}referrals_by_state_pair", "Referral patterns",
+           ("primary_type_2_npi_state", "referring_type_2_npi_state", "primary_specialty", "referring_specialty"),
+           ("patient_count", "total_claim_charge", "total_claim_line_charge")),
+    Rollup(f"{MATERIALIZED_PREFIX}kol_scores_by_condition", "KOL Scores",
+           ("mf_conditions_projectId",), ("score",)),
+]
+
+
+# ---------- materialization ----------
+@dataclass
+class RefreshStats:
+    rollup: str
+    mode: str                        # "full", "incremental", "fresh" or "missing base"
+    base_rows: int = 0               # base rows aggregated by this refresh
+    rows: int = 0                    # rollup rows afterwards
+    seconds: float = 0.0
+
+
+def _table_exists(conn: sqlite3.Connection, name: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+
+def _refresh(conn: sqlite3.Connection, rollup: Rollup, full: bool) -> RefreshStats:
+    start = time.perf_counter()
+    if not _table_exists(conn, rollup.base):
+        return RefreshStats(rollup.name, "missing base")
+    base = quote_identifier(rollup.base)
+    table = quote_identifier(rollup.name)
+    state = conn.execute(f"SELECT definition, last_rowid FROM {quote_identifier(STATE_TABLE)} WHERE rollup = ?",
+                         (rollup.name,)).fetchone()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        max_rowid = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {base}").fetchone()[0]
+        # Fewer rows than last time means deletes or a reload: start over
+        rebuild = (full or state is None or state[0] != rollup.definition or max_rowid < state[1]
+                   or not _table_exists(conn, rollup.name))
+        if rebuild:
+            mode, base_rows = "full", conn.execute(f"SELECT COUNT(*) FROM {base}").fetchone()[0]
+            conn.execute(f"DROP TABLE IF EXISTS {table}")
+            conn.execute(f"CREATE TABLE {table} AS {rollup.aggregate_sql(base)}")
+            index = quote_identifier(f"{rollup.name}_dims")
+            conn.execute(f"CREATE INDEX {index} ON {table} "
+                         f"({', '.join(quote_identifier(d) for d in rollup.dimensions)})")
+        elif max_rowid == state[1]:
+            mode, base_rows = "fresh", 0
+        else:
+            mode = "incremental"
+            conn.execute("DROP TABLE IF EXISTS temp.rollup_delta")
+            conn.execute(f"CREATE TEMP TABLE rollup_delta AS {rollup.aggregate_sql(base, ' WHERE rowid > ?')}",
+                         (state[1],))
+            base_rows = conn.execute("SELECT COALESCE(SUM(row_count), 0) FROM temp.rollup_delta").fetchone()[0]
+            conn.execute("DROP TABLE IF EXISTS temp.rollup_merged")
+            conn.execute("CREATE TEMP TABLE rollup_merged AS "
+                         + rollup.merge_sql(f"SELECT * FROM {table} UNION ALL SELECT * FROM temp.rollup_delta"))
+            conn.execute(f"DELETE FROM {table}")
+            conn.execute(f"INSERT INTO {table} SELECT * FROM temp.rollup_merged")
+            conn.execute("DROP TABLE temp.rollup_delta")
+            conn.execute("DROP TABLE temp.rollup_merged")
+        if mode != "fresh":
+            # A no-op refresh writes nothing, so the file (and every fingerprint of it) stays the same
+            conn.execute(
+                f"INSERT OR REPLACE INTO {quote_identifier(STATE_TABLE)} "
+                "(rollup, base, definition, last_rowid, refreshed_at) VALUES (?, ?, ?, ?, ?)",
+                (rollup.name, rollup.base, rollup.definition, max_rowid, time.time()),
+            )
+        rows = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return RefreshStats(rollup.name, mode, base_rows, rows, time.perf_counter() - start)
+
+
+def refresh_rollups(db_path: str, rollups: Sequence[Rollup] = ROLLUPS, full: bool = False) -> List[RefreshStats]:
+    """Bring every rollup up to date: appended base rows are folded in, anything else rebuilds.
+
+    Appends are detected from the base table's rowids; in-place UPDATEs or a reload with at
+    least as many rows are not, so run with full=True after those (utils.ingest does).
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote_identifier(STATE_TABLE)} (rollup TEXT PRIMARY KEY, base TEXT, "
+            "definition TEXT, last_rowid INTEGER, refreshed_at REAL)"
+        )
+        return [_refresh(conn, rollup, full) for rollup in rollups]
+    finally:
+        conn.close()
+
+
+_fresh_cache: Dict[str, Tuple[Dict[str, int], Dict[str, int]]] = {}
+_fresh_lock = threading.Lock()
+
+
+def fresh_rollups(db_path: str, catalog: SchemaCatalog, rollups: Sequence[Rollup] = ROLLUPS) -> Dict[str, int]:
+    """Rollup name -> row count for rollups that reflect every base row; cached per catalog fingerprint"""
+    with _fresh_lock:
+        cached = _fresh_cache.get(db_path)
+        if cached is not None and cached[0] == catalog.fingerprint:
+            return cached[1]
+    fresh: Dict[str, int] = {}
+    with get_pool(db_path).connection() as conn:
+        if _table_exists(conn, STATE_TABLE):
+            states = {name: (definition, last_rowid) for name, definition, last_rowid in conn.execute(
+                f"SELECT rollup, definition, last_rowid FROM {quote_identifier(STATE_TABLE)}")}
+            for rollup in rollups:
+                state = states.get(rollup.name)
+                if state is None or state[0] != rollup.definition or not _table_exists(conn, rollup.base):
+                    continue
+                max_rowid = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {quote_identifier(rollup.base)}"
+                                         ).fetchone()[0]
+                if max_rowid == state[1]:
+                    fresh[rollup.name] = conn.execute(
+                        f"SELECT COUNT(*) FROM {quote_identifier(rollup.name)}").fetchone()[0]
+    with _fresh_lock:
+        _fresh_cache[db_path] = (catalog.fingerprint, fresh)
+    return fresh
+
+
+# ---------- rewriting ----------
+@dataclass
+class Rewrite:
+    sql: str
+    rollup: Optional[str] = None
+    reason: str = ""
+
+    @property
+    def routed(self) -> bool:
+        return self.rollup is not None
+
+
+@dataclass
+class _Aggregate:
+    start: int                       # token index of the function name
+    end: int                         # token index of the closing parenthesis
+    func: str
+    column: Optional[str]            # None for COUNT(*)
+    distinct: bool = False
+
+
+@dataclass
+class _Shape:
+    table_token: int = -1
+    names: Set[str] = field(default_factory=set)          # table name and alias
+    columns: Set[str] = field(default_factory=set)        # normalized refs outside aggregates
+    aliases: Set[str] = field(default_factory=set)
+    aggregates: List[_Aggregate] = field(default_factory=list)
+    grouped: bool = False
+    items: List[Tuple[int, int]] = field(default_factory=list)   # select items (first, last token index)
+    aliased: Set[int] = field(default_factory=set)                # last token of items with an alias
+
+
+def _significant(tokens) -> List[int]:
+    return [i for i, t in enumerate(tokens) if not t.is_whitespace and t.ttype not in T.Comment]
+
+
+def _analyze(tokens, sig: List[int], base_columns: Set[str]) -> Tuple[Optional[_Shape], str]:
+    """One pass over a single-table SELECT; (None, reason) for anything the rewriter cannot prove"""
+    shape = _Shape()
+    clause = None
+    depth = 0
+    cast_depths: List[int] = []
+    item_start = None
+    pos = 0
+    while pos < len(sig):
+        i = sig[pos]
+        token = tokens[i]
+        word = token.normalized.upper() if token.is_keyword else None
+        if word in ("UNION", "UNION ALL", "EXCEPT", "INTERSECT", "OVER", "WITH", "WINDOW") or \
+                (word and word.endswith("JOIN")):
+            return None, f"{word} is not supported"
+        if word == "SELECT" and clause is not None:
+            return None, "subqueries are not supported"
+        if word and word in CLAUSES and depth == 0:
+            if clause == "select" and item_start is not None:
+                shape.items.append((item_start, sig[pos - 1]))
+            clause = CLAUSES[word]
+            shape.grouped |= word == "GROUP BY"
+            item_start = None
+            pos += 1
+            continue
+        if clause == "select" and depth == 0:
+            if token.match(T.Punctuation, ","):
+                shape.items.append((item_start, sig[pos - 1]))
+                item_start = None
+                pos += 1
+                continue
+            if item_start is None and not token.match(T.Keyword, ("DISTINCT", "ALL")):
+                item_start = i
+        if clause == "from":
+            if token.match(T.Punctuation, ",") or token.match(T.Punctuation, "("):
+                return None, "only a single base table can be rewritten"
+            if word == "AS":
+                pos += 1
+                continue
+            if shape.table_token < 0:
+                shape.table_token = i
+                shape.names.add(norm_identifier(token.value))
+            elif len(shape.names) == 1:
+                shape.names.add(norm_identifier(token.value))
+            else:
+                return None, "only a single base table can be rewritten"
+            pos += 1
+            continue
+        if token.match(T.Punctuation, "("):
+            previous = tokens[sig[pos - 1]] if pos else None
+            if previous is not None and previous.normalized.upper() == "CAST":
+                cast_depths.append(depth)
+            depth += 1
+        elif token.match(T.Punctuation, ")"):
+            depth -= 1
+            if cast_depths and cast_depths[-1] == depth:
+                cast_depths.pop()
+        elif token.match(T.Wildcard, "*") and clause == "select":
+            return None, "SELECT * cannot be answered from a rollup"
+        elif word == "AS" and pos + 1 < len(sig):
+            if not cast_depths:
+                shape.aliases.add(norm_identifier(tokens[sig[pos + 1]].value))
+            pos += 2  # the alias, or the CAST target type
+            continue
+        elif (token.ttype in T.Name or token.ttype in T.String.Symbol or token.ttype in T.Keyword) \
+                and token.ttype not in T.Name.Placeholder:
+            following = tokens[sig[pos + 1]] if pos + 1 < len(sig) else None
+            name = token.value.upper()
+            if following is not None and following.match(T.Punctuation, "("):
+                if name in AGGREGATES:
+                    aggregate, reason, pos = _aggregate(tokens, sig, pos)
+                    if aggregate is None:
+                        return None, reason
+                    shape.aggregates.append(aggregate)
+                    continue
+                if name not in SCALAR_FUNCTIONS and not (token.is_keyword and name in _OPERATOR_KEYWORDS):
+                    return None, f"{token.value}() may aggregate rows; only known scalar functions are rewritten"
+                pos += 1
+                continue  # scalar function name or operator; its arguments are checked as usual
+            if following is not None and following.match(T.Punctuation, "."):
+                if norm_identifier(token.value) not in shape.names:
+                    return None, f"unknown qualifier {token.value}"
+                pos += 1
+                continue
+            if token.is_keyword and norm_identifier(token.value) not in base_columns:
+                pos += 1
+                continue  # DESC, AND, NULL ...; keywords only count when they name a column
+            shape.columns.add(norm_identifier(token.value))
+        pos += 1
+    if clause == "select" and item_start is not None:
+        shape.items.append((item_start, sig[-1]))
+    for first, last in shape.items:
+        if _alias(tokens, sig, first, last):
+            shape.aliases.add(norm_identifier(tokens[last].value))
+            shape.aliased.add(last)
+    if shape.table_token < 0:
+        return None, "no FROM table"
+    return shape, ""
+
+
+def _alias(tokens, sig: List[int], first: int, last: int) -> bool:
+    """Whether the select item ends in an alias, with or without AS"""
+    if first == last or not (tokens[last].ttype in T.Name or tokens[last].ttype in T.String.Symbol):
+        return False
+    previous = tokens[sig[sig.index(last) - 1]]
+    return (previous.match(T.Keyword, ("AS", "END")) or previous.match(T.Punctuation, ")")
+            or previous.ttype in T.Name or previous.ttype in T.String.Symbol)
+
+
+def _aggregate(tokens, sig: List[int], pos: int) -> Tuple[Optional[_Aggregate], str, int]:
+    """Parse NAME ( [DISTINCT] * | column | qualifier.column ) starting at sig[pos]"""
+    func = tokens[sig[pos]].value.upper()
+    j = pos + 2
+    distinct = False
+    if j < len(sig) and tokens[sig[j]].match(T.Keyword, "DISTINCT"):
+        distinct, j = True, j + 1
+    parts = []
+    while j < len(sig) and not tokens[sig[j]].match(T.Punctuation, ")"):
+        parts.append(tokens[sig[j]])
+        j += 1
+    if j >= len(sig):
+        return None, "unbalanced parentheses", pos
+    if len(parts) == 1 and parts[0].match(T.Wildcard, "*") and func == "COUNT" and not distinct:
+        column = None
+    elif len(parts) == 1 and parts[0].ttype not in T.Literal and not parts[0].match(T.Wildcard, "*"):
+        column = norm_identifier(parts[0].value)
+    elif len(parts) == 3 and parts[1].match(T.Punctuation, "."):
+        column = norm_identifier(parts[2].value)
+    else:
+        return None, f"{func} over an expression", pos
+    return _Aggregate(sig[pos], sig[j], func, column, distinct), "", j + 1
+
+
+def _replacement(aggregate: _Aggregate, rollup: Rollup) -> Optional[str]:
+    """Rollup expression equal to the base aggregate, or None if this rollup cannot provide it"""
+    dims = {norm_identifier(d) for d in rollup.dimensions}
+    measures = {norm_identifier(m) for m in rollup.measures}
+    col = aggregate.column
+    q = quote_identifier
+    if col is None:
+        return f'COALESCE(SUM({q("row_count")}), 0)'
+    if col in dims:
+        if aggregate.distinct or aggregate.func in ("MIN", "MAX"):
+            return f"{aggregate.func}({'DISTINCT ' if aggregate.distinct else ''}{q(_dimension(rollup, col))})"
+        if aggregate.func == "COUNT":
+            return f'COALESCE(SUM(CASE WHEN {q(_dimension(rollup, col))} IS NOT NULL THEN {q("row_count")} END), 0)'
+        return None
+    if col not in measures or aggregate.distinct:
+        return None
+    if aggregate.func == "COUNT":
+        return f"COALESCE(SUM({q('count_' + col)}), 0)"
+    if aggregate.func in ("SUM", "TOTAL"):
+        return f"{aggregate.func}({q('sum_' + col)})"
+    if aggregate.func == "AVG":
+        return f"(CAST(SUM({q('sum_' + col)}) AS REAL) / SUM({q('count_' + col)}))"
+    return f"{aggregate.func}({q(aggregate.func.lower() + '_' + col)})"
+
+
+def _dimension(rollup: Rollup, normalized: str) -> str:
+    return next(d for d in rollup.dimensions if norm_identifier(d) == normalized)
+
+
+def rewrite_query(sql: str, catalog: SchemaCatalog, available: Optional[Dict[str, int]] = None,
+                  rollups: Sequence[Rollup] = ROLLUPS) -> Rewrite:
+    """Route an aggregate over one base table to the smallest rollup that answers it exactly.
+
+    Every column outside an aggregate must be a rollup dimension (so WHERE/GROUP BY/ORDER BY
+    commute with the pre-aggregation), every aggregate must be derivable from the stored
+    measures and every other function must be a known scalar. available maps fresh rollup names to row counts (None: consider all).
+    """
+    statements = [s for s in sqlparse.split(sql) if s.strip().rstrip(";").strip()]
+    if len(statements) != 1 or not is_select(statements[0]):
+        return Rewrite(sql, reason="not a single SELECT")
+    statement = statements[0].strip().rstrip(";").strip()
+    tokens = list(sqlparse.parse(statement)[0].flatten())
+    sig = _significant(tokens)
+    base_columns = {norm_identifier(c.name) for t in catalog.tables for c in t.columns}
+    shape, reason = _analyze(tokens, sig, base_columns)
+    if shape is None:
+        return Rewrite(sql, reason=reason)
+    base = next((t.name for t in catalog.tables if norm_identifier(t.name) == norm_identifier(tokens[shape.table_token].value)), None)
+    if base is None:
+        return Rewrite(sql, reason="unknown base table")
+    if not shape.aggregates and not shape.grouped:
+        return Rewrite(sql, reason="not an aggregate query")
+
+    referenced = shape.columns - shape.aliases - shape.names
+    candidates = []
+    for rollup in rollups:
+        if rollup.base != base or (available is not None and rollup.name not in available):
+            continue
+        if not referenced <= {norm_identifier(d) for d in rollup.dimensions}:
+            continue
+        replacements = [_replacement(a, rollup) for a in shape.aggregates]
+        if any(r is None for r in replacements):
+            continue
+        candidates.append(((available or {}).get(rollup.name, 0), len(rollup.dimensions), rollup, replacements))
+    if not candidates:
+        return Rewrite(sql, reason="no rollup covers these columns and aggregates")
+    _, _, rollup, replacements = min(candidates, key=lambda c: (c[0], c[1]))
+
+    # Unaliased select items keep the column name SQLite would have given the original text
+    names = {}
+    for first, last in shape.items:
+        if last not in shape.aliased and any(first <= a.start <= last for a in shape.aggregates):
+            names[last] = "".join(t.value for t in tokens[first:last + 1]).strip()
+
+    out = []
+    i = 0
+    starts = {a.start: (a, r) for a, r in zip(shape.aggregates, replacements)}
+    while i < len(tokens):
+        if i == shape.table_token:
+            out.append(quote_identifier(rollup.name))
+        elif i in starts:
+            aggregate, replacement = starts[i]
+            out.append(replacement)
+            if aggregate.end in names:
+                out.append(f" AS {quote_identifier(names[aggregate.end])}")
+            i = aggregate.end + 1
+            continue
+        else:
+            out.append(tokens[i].value)
+        if i in names and not any(a.end == i for a in shape.aggregates):
+            out.append(f" AS {quote_identifier(names[i])}")
+        i += 1
+    return Rewrite("".join(out), rollup.name)
+
+
+class RoutingStats:
+    """How many executed queries were answered from each rollup"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.routed: Counter = Counter()
+
+    def record(self, rewrite: Rewrite) -> None:
+        with self._lock:
+            self.queries += 1
+            if rewrite.routed:
+                self.routed[rewrite.rollup] += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            routed = sum(self.routed.values())
+            return {"queries": self.queries, "routed": routed,
+                    "hit_rate": routed / self.queries if self.queries else 0.0, "by_rollup": dict(self.routed)}
+
+
+def main():
+    from utils.db_simulator import DB_PATH
+    from utils.schema_catalog import load_catalog
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", default=DB_PATH)
+    parser.add_argument("--full", action="store_true", help="Rebuild every rollup from scratch")
+    parser.add_argument("--explain", action="append", help="Show how this query would be routed (repeatable)")
+    args = parser.parse_args()
+
+    if args.explain:
+        catalog = load_catalog(args.db)
+        available = fresh_rollups(args.db, catalog)
+        for sql in args.explain:
+            rewrite = rewrite_query(sql, catalog, available)
+            print(f"⚡ {rewrite.rollup}:\n{rewrite.sql}" if rewrite.routed else f"➖ Not routed: {rewrite.reason}")
+        return
+    for stats in refresh_rollups(args.db, full=args.full):
+        print(f"✅ {stats.rollup:<44} {stats.mode:<12} {stats.base_rows:>10,} base rows -> "
+              f"{stats.rows:>8,} rows  {stats.seconds * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
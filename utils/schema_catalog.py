@@ -0,0 +1,176 @@
+"""
+Persistent schema catalog: tables, columns, keys and row counts built in one pass and
+cached on disk until the database file actually changes
+"""
+
+import hashlib
+import json
+import os
+import threading
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional
+
+from utils.connection_pool import get_pool
+
+CATALOG_CACHE_DIR = os.path.join(".cache", "schema_catalog")
+CATALOG_FORMAT_VERSION = 2
+# Derived tables (utils.rollups) live next to the data but are not part of the queryable schema
+MATERIALIZED_PREFIX = "mv_"
+
+
+@dataclass
+class ColumnInfo:
+    name: str
+    type: str
+    not_null: bool = False
+    default: Optional[str] = None
+    pk: int = 0
+
+
+@dataclass
+class ForeignKey:
+    column: str
+    ref_table: str
+    ref_column: Optional[str]
+
+
+@dataclass
+class TableInfo:
+    name: str
+    sql: str
+    columns: List[ColumnInfo] = field(default_factory=list)
+    foreign_keys: List[ForeignKey] = field(default_factory=list)
+    row_count: int = 0
+
+    @property
+    def primary_key(self) -> List[str]:
+        return [c.name for c in sorted(self.columns, key=lambda c: c.pk) if c.pk]
+
+    def column(self, name: str) -> Optional[ColumnInfo]:
+        lowered = name.lower()
+        return next((c for c in self.columns if c.name.lower() == lowered), None)
+
+
+@dataclass
+class SchemaCatalog:
+    fingerprint: Dict[str, int]
+    tables: List[TableInfo] = field(default_factory=list)
+
+    def table(self, name: str) -> Optional[TableInfo]:
+        lowered = name.lower()
+        return next((t for t in self.tables if t.name.lower() == lowered), None)
+
+    @property
+    def table_names(self) -> List[str]:
+        return [t.name for t in self.tables]
+
+    def to_dict(self) -> dict:
+        return {"format": CATALOG_FORMAT_VERSION, **asdict(self)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SchemaCatalog":
+        return cls(
+            fingerprint=data["fingerprint"],
+            tables=[
+                TableInfo(
+                    name=t["name"],
+                    sql=t["sql"],
+                    columns=[ColumnInfo(**c) for c in t["columns"]],
+                    foreign_keys=[ForeignKey(**fk) for fk in t["foreign_keys"]],
+                    row_count=t["row_count"],
+                )
+                for t in data["tables"]
+            ],
+        )
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def db_fingerprint(db_path: str) -> Dict[str, int]:
+    """mtime/size of the file plus SQLite's schema_version counter"""
+    stat = os.stat(db_path)
+    with get_pool(db_path).connection() as conn:
+        schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "schema_version": schema_version}
+
+
+def build_catalog(db_path: str) -> SchemaCatalog:
+    """Introspect every table with three set-based queries instead of two PRAGMAs per table"""
+    fingerprint = db_fingerprint(db_path)
+    tables: Dict[str, TableInfo] = {}
+    with get_pool(db_path).connection() as conn:
+        column_rows = conn.execute(
+            """
+            SELECT m.name, m.sql, p.name, p.type, p."notnull", p.dflt_value, p.pk
+            FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS p
+            WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' AND substr(m.name, 1, ?) != ?
+            ORDER BY m.rowid, p.cid
+            """,
+            (len(MATERIALIZED_PREFIX), MATERIALIZED_PREFIX),
+        ).fetchall()
+        for table_name, sql, name, data_type, not_null, default, pk in column_rows:
+            table = tables.setdefault(table_name, TableInfo(name=table_name, sql=sql))
+            table.columns.append(ColumnInfo(name, data_type, bool(not_null), default, pk))
+
+        fk_rows = conn.execute(
+            """
+            SELECT m.name, f."from", f."table", f."to"
+            FROM sqlite_master AS m JOIN pragma_foreign_key_list(m.name) AS f
+            WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite_%' AND substr(m.name, 1, ?) != ?
+            ORDER BY m.rowid, f.id, f.seq
+            """,
+            (len(MATERIALIZED_PREFIX), MATERIALIZED_PREFIX),
+        ).fetchall()
+        for table_name, from_col, ref_table, to_col in fk_rows:
+            tables[table_name].foreign_keys.append(ForeignKey(from_col, ref_table, to_col))
+
+        if tables:
+            counts_sql = " UNION ALL ".join(
+                f"SELECT ?, COUNT(*) FROM {quote_identifier(name)}" for name in tables
+            )
+            for table_name, count in conn.execute(counts_sql, list(tables)).fetchall():
+                tables[table_name].row_count = count
+    return SchemaCatalog(fingerprint=fingerprint, tables=list(tables.values()))
+
+
+def _cache_path(db_path: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(db_path).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CATALOG_CACHE_DIR, f"{digest}.json")
+
+
+_memory_cache: Dict[str, SchemaCatalog] = {}
+_cache_lock = threading.Lock()
+
+
+def load_catalog(db_path: str, refresh: bool = False) -> SchemaCatalog:
+    """Return the catalog for db_path from memory or disk, rebuilding only if the fingerprint moved"""
+    key = os.path.abspath(db_path)
+    fingerprint = db_fingerprint(db_path)
+    with _cache_lock:
+        if not refresh:
+            cached = _memory_cache.get(key)
+            if cached is not None and cached.fingerprint == fingerprint:
+                return cached
+            try:
+                with open(_cache_path(db_path), "r", encoding="utf-8") as fh:
+                    data = json.load(fh)
+                if data.get("format") == CATALOG_FORMAT_VERSION and data["fingerprint"] == fingerprint:
+                    cached = SchemaCatalog.from_dict(data)
+                    _memory_cache[key] = cached
+                    return cached
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+
+        catalog = build_catalog(db_path)
+        _memory_cache[key] = catalog
+        try:
+            os.makedirs(CATALOG_CACHE_DIR, exist_ok=True)
+            tmp_path = _cache_path(db_path) + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as fh:
+                json.dump(catalog.to_dict(), fh)
+            os.replace(tmp_path, _cache_path(db_path))
+        except OSError:
+            pass  # a read-only checkout still gets the in-memory cache
+        return catalog
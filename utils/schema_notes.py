@@ -0,0 +1,92 @@
+"""
+SchemaNotes.txt parsing shared by the schema retriever, loader, compliance screen and
+dialect translator: per-table sections, the extract -> notes table map and column types
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+SCHEMA_NOTES_PATH = "SchemaNotes.txt"
+
+# Extract file name -> SchemaNotes table. "Diagnosis & Procedures" is documented under a
+# duplicated CREATE TABLE name in the notes, so its types are inferred at load time.
+NOTES_TABLES = {
+    "Payments to HCPs": "as_lsf_v1",
+    "Provider details": "as_providers_v1",
+    "Referral patterns": "as_providers_referrals_v2",
+    "Pharmacy claims": "fct_pharmacy_clear_claim_allstatus_cluster_brand",
+    "Conditions directory": "mf_conditions",
+    "KOL Providers": "mf_providers",
+    "KOL Scores": "mf_scores",
+}
+
+
+@dataclass
+class TableSection:
+    name: str
+    text: str
+    columns: Dict[str, str] = field(default_factory=dict)
+    aliases: List[str] = field(default_factory=list)
+
+
+def split_schema_notes(notes: str) -> List[TableSection]:
+    """Split the notes at each 'Table N:' header; repeated CREATE TABLE names are merged"""
+    sections: Dict[str, TableSection] = {}
+    for chunk in re.split(r"(?m)^(?=Table \d+:)", notes):
+        match = re.search(r"CREATE TABLE\s+(?:\w+\.)?(\w+)", chunk)
+        if not match:
+            continue
+        name = match.group(1)
+        columns = {
+            m.group(1): m.group(0)
+            for m in re.finditer(r"(?m)^\s*`([^`]+)`.*$", chunk)
+        }
+        if name in sections:
+            # Keep the first definition but let the duplicate's header help retrieval
+            sections[name].aliases.append(chunk.strip().splitlines()[0])
+            continue
+        sections[name] = TableSection(name=name, text=chunk.strip(), columns=columns)
+    return list(sections.values())
+
+
+@dataclass
+class NotesTable:
+    types: Dict[str, str] = field(default_factory=dict)
+    order_by: List[str] = field(default_factory=list)
+
+
+def sqlite_affinity(notes_type: str) -> str:
+    """Map a ClickHouse type from the notes (e.g. Nullable(UInt64)) to a SQLite affinity"""
+    base = notes_type
+    while True:
+        match = re.fullmatch(r"(?:Nullable|LowCardinality)\((.*)\)", base)
+        if not match:
+            break
+        base = match.group(1)
+    if re.match(r"U?Int\d+$|Bool", base):
+        return "INTEGER"
+    if re.match(r"Float\d+$|Decimal", base):
+        return "REAL"
+    return "TEXT"
+
+
+def notes_column_types(notes_path: str = SCHEMA_NOTES_PATH) -> Dict[str, NotesTable]:
+    """Column affinities and sort key of every table documented in the notes"""
+    try:
+        with open(notes_path, "r", encoding="utf-8") as fh:
+            notes = fh.read()
+    except OSError:
+        return {}
+    tables = {}
+    for section in split_schema_notes(notes):
+        table = NotesTable()
+        for column, line in section.columns.items():
+            match = re.match(r"\s*`[^`]+`\s+([^\s,]+)", line)
+            if match:
+                table.types[column] = sqlite_affinity(match.group(1))
+        order_by = re.search(r"ORDER BY \(?([^)\n]+)\)?", section.text)
+        if order_by:
+            table.order_by = [c.strip() for c in order_by.group(1).split(",")]
+        tables[section.name] = table
+    return tables
@@ -0,0 +1,127 @@
+"""
+Offline BM25 retrieval over SchemaNotes.txt so agents only receive the table notes
+relevant to the question at hand
+"""
+
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import AbstractSet, Dict, List, Optional, Tuple
+
+from utils.schema_notes import SCHEMA_NOTES_PATH, TableSection, split_schema_notes
+
+DEFAULT_TOP_K = 3
+
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "for", "from", "in", "is", "it", "of", "on", "or",
+    "the", "to", "with", "this", "that", "which", "me", "show", "find", "list", "all", "what",
+    "who", "their", "column", "columns", "table", "stores", "contains", "samples", "select",
+    "where", "group", "order", "limit", "desc", "asc", "join", "count", "sum", "avg",
+}
+
+
+def tokenize(text: str, stopwords: AbstractSet[str] = _STOPWORDS) -> List[str]:
+    """Lowercase word tokens; snake_case identifiers also contribute their parts"""
+    tokens = []
+    for word in re.findall(r"[A-Za-z0-9_]+", text.lower()):
+        parts = [p for p in word.split("_") if p]
+        candidates = [word] + (parts if len(parts) > 1 else [])
+        for token in candidates:
+            if token in stopwords or len(token) < 2:
+                continue
+            # Cheap plural folding so "payments" matches "payment", "specialties" "specialty"
+            if len(token) > 4 and token.endswith("ies"):
+                token = token[:-3] + "y"
+            elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+                token = token[:-1]
+            tokens.append(token)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over a small in-memory corpus"""
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_freqs = [Counter(doc) for doc in documents]
+        self.doc_lens = [len(doc) for doc in documents]
+        self.avg_len = sum(self.doc_lens) / len(documents) if documents else 0.0
+        df = Counter(term for doc in documents for term in set(doc))
+        n = len(documents)
+        self.idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def scores(self, query: List[str]) -> List[float]:
+        results = []
+        for freqs, length in zip(self.doc_freqs, self.doc_lens):
+            score = 0.0
+            for term in query:
+                tf = freqs.get(term)
+                if not tf:
+                    continue
+                norm = tf + self.k1 * (1 - self.b + self.b * length / (self.avg_len or 1))
+                score += self.idf[term] * tf * (self.k1 + 1) / norm
+            results.append(score)
+        return results
+
+
+class SchemaNotesRetriever:
+    """Indexes each table section and each column note; a table scores as its own
+    document plus its best-matching columns"""
+
+    def __init__(self, notes: str):
+        self.sections = split_schema_notes(notes)
+        table_docs = []
+        self._column_owner: List[int] = []
+        column_docs = []
+        for i, section in enumerate(self.sections):
+            header = section.text.split("(", 1)[0]
+            table_docs.append(tokenize(" ".join([header, section.name] + section.aliases)))
+            for column, line in section.columns.items():
+                column_docs.append(tokenize(line))
+                self._column_owner.append(i)
+        self.table_index = BM25Index(table_docs)
+        self.column_index = BM25Index(column_docs)
+
+    def rank(self, query: str) -> List[Tuple[TableSection, float]]:
+        terms = tokenize(query)
+        totals = self.table_index.scores(terms)
+        best_columns: Dict[int, List[float]] = {}
+        for owner, score in zip(self._column_owner, self.column_index.scores(terms)):
+            if score > 0:
+                best_columns.setdefault(owner, []).append(score)
+        for owner, scores in best_columns.items():
+            totals[owner] += sum(sorted(scores, reverse=True)[:3])
+        ranked = sorted(zip(self.sections, totals), key=lambda pair: pair[1], reverse=True)
+        return ranked
+
+    def relevant_notes(self, query: str, top_k: int = DEFAULT_TOP_K) -> str:
+        """Notes for the top_k matching tables, in their original order"""
+        ranked = [(s, score) for s, score in self.rank(query) if score > 0][:top_k]
+        if not ranked:
+            # Nothing matched (e.g. a vague question): fall back to every table
+            return "\n\n".join(s.text for s in self.sections)
+        chosen = {s.name for s, _ in ranked}
+        return "\n\n".join(s.text for s in self.sections if s.name in chosen)
+
+
+_retrievers: Dict[Tuple[str, int], SchemaNotesRetriever] = {}
+_retriever_lock = threading.Lock()
+
+
+def get_retriever(file_path: str = SCHEMA_NOTES_PATH) -> Optional[SchemaNotesRetriever]:
+    """Index for file_path, rebuilt only when the file's mtime changes"""
+    try:
+        key = (os.path.abspath(file_path), os.stat(file_path).st_mtime_ns)
+    except OSError:
+        return None
+    with _retriever_lock:
+        retriever = _retrievers.get(key)
+        if retriever is None:
+            with open(file_path, "r", encoding="utf-8") as fh:
+                retriever = SchemaNotesRetriever(fh.read())
+            _retrievers.clear()
+            _retrievers[key] = retriever
+        return retriever
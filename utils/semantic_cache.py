@@ -0,0 +1,293 @@
+"""
+Persistent NL->SQL answer cache: exact hits on the normalized question, MinHash similarity
+hits for rewordings that agree on literals, names, direction and aggregate words, scoped to
+the model and schema fingerprint with TTL and LRU eviction
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from utils.schema_retriever import tokenize
+
+SEMANTIC_CACHE_PATH = os.path.join(".cache", "semantic_cache.sqlite")
+NUM_PERMUTATIONS = 128
+_MERSENNE = (1 << 61) - 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    kind TEXT NOT NULL,
+    model TEXT NOT NULL,
+    schema_digest TEXT NOT NULL,
+    norm_key TEXT NOT NULL,
+    guard TEXT NOT NULL,
+    question TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    value TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, model, schema_digest, norm_key)
+);
+CREATE INDEX IF NOT EXISTS answers_guard ON answers (kind, model, schema_digest, guard);
+CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used);
+CREATE INDEX IF NOT EXISTS answers_created ON answers (created);
+"""
+
+
+# Function words and request phrasing that never change which SQL answers a question. Unlike
+# the schema retriever's stopwords, aggregates and directions (count, sum, desc, ...) are kept
+QUESTION_STOPWORDS = frozenset({
+    "a", "all", "an", "and", "are", "as", "at", "be", "by", "can", "could", "display", "do",
+    "find", "for", "from", "get", "give", "got", "has", "have", "in", "is", "it", "let", "list",
+    "me", "of", "on", "or", "please", "return", "see", "show", "tell", "that", "the", "their",
+    "there", "this", "to", "us", "want", "what", "which", "who", "with", "would", "you",
+})
+
+
+# Interchangeable names for the dataset's entities, folded before keying and comparing
+SYNONYMS = {
+    "doctor": "provider", "physician": "provider", "hcp": "provider", "prescriber": "provider",
+    "clinician": "provider", "company": "firm", "manufacturer": "firm", "medication": "drug",
+    "medicine": "drug",
+}
+
+
+def normalize_question(text: str) -> str:
+    """Case, punctuation, filler, plural and synonym-insensitive form used as the exact key"""
+    return " ".join(SYNONYMS.get(token, token) for token in tokenize(text, QUESTION_STOPWORDS))
+
+
+def normalize_sql(text: str) -> str:
+    """Whitespace-insensitive SQL key; keywords like DESC/LIMIT must not be dropped"""
+    return " ".join(text.strip().rstrip(";").split())
+
+
+def _norm_key(text: str, similar: bool) -> str:
+    return normalize_question(text) if similar else normalize_sql(text)
+
+
+# Words that change which rows, which measure or which figure a question asks for; a
+# paraphrase must keep them
+DIRECTION_WORDS = frozenset({
+    "above", "after", "asc", "ascending", "before", "below", "best", "biggest", "bottom", "desc",
+    "descending", "earliest", "fewest", "first", "greatest", "highest", "increasing", "decreasing",
+    "largest", "last", "latest", "least", "less", "lowest", "max", "maximum", "min", "minimum",
+    "more", "most", "newest", "oldest", "over", "smallest", "top", "under", "worst",
+})
+AGGREGATE_WORDS = frozenset({
+    "average", "avg", "count", "distinct", "mean", "median", "number", "percent", "percentage",
+    "rate", "ratio", "share", "sum", "total", "unique",
+})
+SUBJECT_WORDS = frozenset({
+    "city", "claim", "condition", "diagnosis", "drug", "firm", "kol", "patient", "payment",
+    "procedure", "provider", "referral", "score", "specialty", "state",
+})
+
+
+def question_literals(text: str) -> List[str]:
+    """Numbers, quoted strings and capitalized names after the first word: paraphrases may
+    only share an answer if these agree ("top 5" vs "top 10", "Texas" vs "Ohio")"""
+    found = re.findall(r"'[^']*'|\"[^\"]*\"|\d+(?:\.\d+)?", text)
+    words = re.findall(r"[A-Za-z][A-Za-z0-9&.-]*", re.sub(r"'[^']*'|\"[^\"]*\"", " ", text))
+    found += [w for w in words[1:] if any(c.isupper() for c in w)]
+    return sorted(s.lower() for s in found)
+
+
+def question_guard(text: str, norm_key: str) -> str:
+    """Literals plus direction, aggregate and subject words: the part a similar hit must match"""
+    words = set(norm_key.split()) & (DIRECTION_WORDS | AGGREGATE_WORDS | SUBJECT_WORDS)
+    return json.dumps([question_literals(text), sorted(words)])
+
+
+def _permutations(n: int) -> List[Tuple[int, int]]:
+    seed = hashlib.sha256(b"semantic-cache-minhash").digest()
+    params = []
+    for i in range(n):
+        block = hashlib.sha256(seed + i.to_bytes(4, "big")).digest()
+        a = int.from_bytes(block[:8], "big") % _MERSENNE or 1
+        b = int.from_bytes(block[8:16], "big") % _MERSENNE
+        params.append((a, b))
+    return params
+
+
+_PERMUTATIONS = _permutations(NUM_PERMUTATIONS)
+
+
+def minhash(tokens: List[str]) -> Tuple[int, ...]:
+    """MinHash signature over the token set; the share of equal slots estimates Jaccard"""
+    shingles = set(tokens) or {""}
+    hashed = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "big") for s in shingles]
+    return tuple(min((a * h + b) % _MERSENNE for h in hashed) for a, b in _PERMUTATIONS)
+
+
+def similarity(left: Tuple[int, ...], right: Tuple[int, ...]) -> float:
+    return sum(x == y for x, y in zip(left, right)) / len(left)
+
+
+def _pack(signature: Tuple[int, ...]) -> bytes:
+    return struct.pack(f">{len(signature)}Q", *signature)
+
+
+def _unpack(blob: bytes) -> Tuple[int, ...]:
+    return struct.unpack(f">{len(blob) // 8}Q", blob)
+
+
+@dataclass
+class CacheHit:
+    value: Dict
+    tier: str          # "exact" or "similar"
+    score: float
+    question: str
+
+
+class SemanticCacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.exact_hits = 0
+            self.similar_hits = 0
+            self.misses = 0
+
+    def record(self, tier: Optional[str]) -> None:
+        with self._lock:
+            if tier == "exact":
+                self.exact_hits += 1
+            elif tier == "similar":
+                self.similar_hits += 1
+            else:
+                self.misses += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                "lookups": lookups,
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+class SemanticCache:
+    """SQLite-backed cache shared by every thread of the process (and across restarts).
+
+    Entries are keyed on (kind, model, schema digest, normalized text). With similar=True the
+    text is a natural-language question, and an exact miss falls back to the best MinHash
+    match at or above threshold among entries with the same guard (literals, capitalized
+    names, direction, aggregate and subject words): a reworded question, a synonym or an
+    extra qualifier may reuse an answer, but never one that says "lowest" for "highest",
+    counts instead of sums, asks about referrals instead of payments or names another state
+    or firm. Expired entries are never served and are evicted
+    on put().
+    """
+
+    def __init__(self, path: str = SEMANTIC_CACHE_PATH, ttl_seconds: float = 7 * 24 * 3600,
+                 max_entries: int = 2000, threshold: float = 0.8):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.stats = SemanticCacheStats()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Caches written before answers were keyed by model are dropped, not migrated
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(answers)")}
+            if columns and not {"model", "guard"} <= columns:
+                self._conn.execute("DROP TABLE answers")
+            self._conn.executescript(_SCHEMA)
+        return self._conn
+
+    def get(self, kind: str, schema_digest: str, text: str, similar: bool = True,
+            model: str = "") -> Optional[CacheHit]:
+        norm_key = _norm_key(text, similar)
+        now = time.time()
+        fresh_since = now - self.ttl_seconds
+        hit = None
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT norm_key, question, value FROM answers "
+                "WHERE kind = ? AND model = ? AND schema_digest = ? AND norm_key = ? AND created >= ?",
+                (kind, model, schema_digest, norm_key, fresh_since),
+            ).fetchone()
+            if row is not None:
+                hit = CacheHit(json.loads(row[2]), "exact", 1.0, row[1])
+            elif similar:
+                signature = minhash(norm_key.split())
+                best: Optional[Tuple[float, tuple]] = None
+                for candidate in conn.execute(
+                    "SELECT norm_key, question, value, signature FROM answers "
+                    "WHERE kind = ? AND model = ? AND schema_digest = ? AND guard = ? AND created >= ?",
+                    (kind, model, schema_digest, question_guard(text, norm_key), fresh_since),
+                ):
+                    score = similarity(signature, _unpack(candidate[3]))
+                    if score >= self.threshold and (best is None or score > best[0]):
+                        best = (score, candidate)
+                if best is not None:
+                    score, row = best
+                    hit = CacheHit(json.loads(row[2]), "similar", score, row[1])
+            if hit is not None:
+                conn.execute(
+                    "UPDATE answers SET last_used = ?, hits = hits + 1 "
+                    "WHERE kind = ? AND model = ? AND schema_digest = ? AND norm_key = ?",
+                    (now, kind, model, schema_digest, row[0]),
+                )
+        self.stats.record(hit.tier if hit else None)
+        return hit
+
+    def put(self, kind: str, schema_digest: str, text: str, value: Dict, similar: bool = True,
+            model: str = "") -> None:
+        """similar and model must match what get() is called with for this kind"""
+        norm_key = _norm_key(text, similar)
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO answers "
+                "(kind, model, schema_digest, norm_key, guard, question, signature, value, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (kind, model, schema_digest, norm_key, question_guard(text, norm_key), text,
+                 _pack(minhash(norm_key.split())), json.dumps(value), now, now),
+            )
+            conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl_seconds,))
+            # LRU: keep only the most recently used max_entries answers
+            conn.execute(
+                "DELETE FROM answers WHERE rowid IN ("
+                "SELECT rowid FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection().execute("DELETE FROM answers")
+        self.stats.reset()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+
+def schema_digest(db_schema: str) -> str:
+    """Fingerprint of the schema text the answer was generated against"""
+    return hashlib.sha256(db_schema.encode("utf-8")).hexdigest()[:16]
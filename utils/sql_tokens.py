@@ -0,0 +1,34 @@
+"""
+Token-level SQL helpers shared by the query analyzers (index advisor, cost guard, validator,
+compliance and rollup rewriter): identifier normalization and sqlparse leaf tokens
+"""
+
+from typing import List
+
+import sqlparse
+from sqlparse import tokens as T
+
+# Clause keyword -> the part of the statement the following tokens belong to
+CLAUSES = {
+    "SELECT": "select", "FROM": "from", "JOIN": "from", "ON": "on", "USING": "on",
+    "WHERE": "where", "GROUP BY": "order", "ORDER BY": "order", "HAVING": "where",
+    "LIMIT": "limit", "UNION": "select", "UNION ALL": "select", "EXCEPT": "select", "INTERSECT": "select",
+}
+
+
+def norm_identifier(name: str) -> str:
+    """Identifier as written in SQL; the extracts' first column carries a BOM and quotes"""
+    return name.replace("\ufeff", "").strip('"`[]').lower()
+
+
+def is_word(token) -> bool:
+    """Bare or quoted identifier, or a keyword that may double as a column name ("year")"""
+    if token.ttype in T.Name.Placeholder:
+        return False
+    return token.ttype in T.Name or token.ttype in T.String.Symbol or token.ttype in T.Keyword
+
+
+def significant_tokens(sql: str) -> List[sqlparse.sql.Token]:
+    """Leaf tokens of the first statement without whitespace and comments"""
+    statement = sqlparse.parse(sql)[0]
+    return [t for t in statement.flatten() if not t.is_whitespace and t.ttype not in T.Comment]
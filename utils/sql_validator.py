@@ -0,0 +1,174 @@
+"""
+Deterministic SQL validation against the schema catalog: SQLite compiles the statement
+(EXPLAIN), identifiers are resolved with close-match hints, and joins are checked for
+key consistency. Only what these checks cannot decide is left to the LLM validator.
+"""
+
+import difflib
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from typing import List, Optional, Set, Tuple
+
+import sqlparse
+from sqlparse import tokens as T
+
+from utils.index_advisor import analyze_query
+from utils.query_engine import is_select
+from utils.schema_catalog import SchemaCatalog, quote_identifier
+from utils.sql_tokens import norm_identifier, significant_tokens
+
+_MISSING = re.compile(r"no such (table|column): (.+)$")
+
+
+@dataclass
+class ValidationReport:
+    status: str                      # "valid", "invalid" or "undecided"
+    errors: List[str] = field(default_factory=list)
+    warnings: List[str] = field(default_factory=list)
+    undecided: List[str] = field(default_factory=list)
+
+    @property
+    def decided(self) -> bool:
+        return self.status != "undecided"
+
+    @property
+    def text(self) -> str:
+        """Markdown report in the same place the LLM validator's report is shown"""
+        title = {"valid": "✅ Valid", "invalid": "❌ Invalid", "undecided": "❔ Needs review"}[self.status]
+        lines = [f"**Validation: {title}** (checked locally against the schema catalog)"]
+        lines += [f"- ❌ {e}" for e in self.errors]
+        lines += [f"- ⚠️ {w}" for w in self.warnings]
+        lines += [f"- ❔ {u}" for u in self.undecided]
+        if self.status == "valid" and not self.warnings:
+            lines.append("- Tables and columns exist, joins use matching keys and SQLite compiles the query.")
+        return "\n".join(lines)
+
+
+def _key_family(column: str) -> str:
+    """Join-key family: type_1_npi, mf_providers_npi and REFERRING_NPI_NBR are all "npi" """
+    name = re.sub(r"_nbr$", "", norm_identifier(column))
+    return name.rsplit("_", 1)[-1]
+
+
+def _affinity(declared: str) -> Optional[str]:
+    declared = declared.upper()
+    if not declared:
+        return None
+    if "INT" in declared:
+        return "INTEGER"
+    if any(t in declared for t in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if any(t in declared for t in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+
+def _hint(kind: str, name: str, catalog: SchemaCatalog, sql: str = "") -> str:
+    """Explain a missing identifier: the exact spelling of a BOM-prefixed column in a table the
+    query reads, else which table has the column, else close matches"""
+    bare = norm_identifier(name.split(".")[-1])
+    if kind == "table":
+        matches = difflib.get_close_matches(bare, [norm_identifier(t) for t in catalog.table_names], n=3, cutoff=0.6)
+        real = [t for t in catalog.table_names if norm_identifier(t) in matches]
+        return f"; did you mean {', '.join(quote_identifier(t) for t in real)}?" if real else ""
+    exact = [(t.name, c.name) for t in catalog.tables for c in t.columns if norm_identifier(c.name) == bare]
+    if exact:
+        queried = set(analyze_query(sql, catalog).tables.values()) if sql else set()
+        for table, column in exact:
+            if table in queried and ("\ufeff" in column or '"' in column):
+                return (f"; in {table} the column name carries a byte-order mark or quotes, reference it as "
+                        f"{quote_identifier(column)}")
+        owners = ", ".join(dict.fromkeys(table for table, _ in exact))
+        read = any(table in queried for table, _ in exact)
+        return f"; {bare} is a column of {owners}" + ("" if read else ", which the query does not read")
+    names = {norm_identifier(c.name): (t.name, c.name) for t in catalog.tables for c in t.columns}
+    close = [names[m] for m in difflib.get_close_matches(bare, list(names), n=3, cutoff=0.75)]
+    return f"; did you mean {', '.join(f'{t}.{c}' for t, c in close)}?" if close else ""
+
+
+def _compile(conn: sqlite3.Connection, sql: str, catalog: SchemaCatalog) -> Optional[str]:
+    """None when SQLite compiles the statement, else the error with a hint"""
+    try:
+        conn.execute(f"EXPLAIN {sql}").fetchall()
+    except sqlite3.Error as e:
+        message = str(e)
+        missing = _MISSING.search(message)
+        return message + (_hint(missing.group(1), missing.group(2), catalog, sql) if missing else "")
+    return None
+
+
+def _declared_names(sql: str) -> Set[str]:
+    """Aliases and CTE names the statement defines itself (the word after / before AS)"""
+    leaves = significant_tokens(sql)
+    names = set()
+    for i, token in enumerate(leaves):
+        if token.match(T.Keyword, "AS"):
+            if i + 1 < len(leaves):
+                names.add(norm_identifier(leaves[i + 1].value))
+            if i > 0:
+                names.add(norm_identifier(leaves[i - 1].value))
+    return names
+
+
+def _quoted_literals(sql: str, catalog: SchemaCatalog) -> List[str]:
+    """Double-quoted names that match no table, column or alias: SQLite silently compiles them
+    as string literals, so "state" = 'CA' filters on a constant instead of a column"""
+    known = {norm_identifier(t.name) for t in catalog.tables}
+    known |= {norm_identifier(c.name) for t in catalog.tables for c in t.columns}
+    known |= _declared_names(sql)
+    return [token.value for token in significant_tokens(sql)
+            if token.ttype in T.Literal.String.Symbol and token.value.startswith('"')
+            and norm_identifier(token.value) not in known]
+
+
+def _check_joins(sql: str, catalog: SchemaCatalog) -> Tuple[List[str], List[str]]:
+    """(warnings, undecided) for each equality join predicate"""
+    shape = analyze_query(sql, catalog)
+    foreign_keys = {
+        frozenset({(t.name, fk.column.lower()), (fk.ref_table, (fk.ref_column or "").lower())})
+        for t in catalog.tables for fk in t.foreign_keys
+    }
+    warnings, undecided = [], []
+    for (left_table, left), (right_table, right) in shape.joins:
+        label = f"{left_table}.{norm_identifier(left)} = {right_table}.{norm_identifier(right)}"
+        if frozenset({(left_table, left.lower()), (right_table, right.lower())}) in foreign_keys:
+            continue
+        if _key_family(left) != _key_family(right):
+            undecided.append(f"Join {label} is not a declared foreign key and the columns are different keys")
+            continue
+        types = {_affinity(catalog.table(t).column(c).type) for t, c in ((left_table, left), (right_table, right))}
+        if None not in types and len(types) > 1:
+            warnings.append(f"Join {label} compares {' and '.join(sorted(types))} columns; "
+                            "SQLite will not match 123 to '123'")
+    return warnings, undecided
+
+
+def validate_sql(conn: sqlite3.Connection, sql: str, catalog: SchemaCatalog) -> ValidationReport:
+    """Local verdict for sql; status "undecided" means the LLM validator should look at it"""
+    statements = [s for s in sqlparse.split(sql) if s.strip().rstrip(";").strip()]
+    if not statements:
+        return ValidationReport("invalid", errors=["The query is empty"])
+    if len(statements) > 1:
+        return ValidationReport("invalid", errors=[f"Expected one statement, found {len(statements)}"])
+    sql = statements[0].strip().rstrip(";")
+    error = _compile(conn, sql, catalog)
+    if error:
+        return ValidationReport("invalid", errors=[error])
+    if not is_select(sql):
+        return ValidationReport("undecided", undecided=["Not a read-only SELECT; schema checks only cover queries"])
+    report = ValidationReport("valid")
+    for name in _quoted_literals(sql, catalog):
+        message = (f"{name} is not a table or column, so SQLite reads it as the string {name}"
+                   + _hint("column", name, catalog, sql))
+        if re.match(r"(?is)^\s*with\b", sql):
+            report.undecided.append(message)  # may be a CTE column list entry
+        else:
+            report.errors.append(message)
+    report.warnings, undecided = _check_joins(sql, catalog)
+    report.undecided += undecided
+    if report.errors:
+        report.status = "invalid"
+    elif report.undecided:
+        report.status = "undecided"
+    return report